@@ -0,0 +1,148 @@
+# benchmarks/postgres.py
+
+import glob
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from typing import Dict, List, Optional
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_ROOT = os.path.normpath(os.path.join(BENCHMARKS_DIR, '..', '..', '..', '..'))
+MODEL_DIR = os.path.join(REPOSITORY_ROOT, 'Модель_данных')
+CHECK_DIR = os.path.join(REPOSITORY_ROOT, 'Модуль_проверки')
+PREPARE_SQL = os.path.join(BENCHMARKS_DIR, 'prepare.sql')
+# Эталонная структура (данные, а не схема): загружается после регистрации ресурса в prepare.sql
+DESIGN_FILE = '03$design.psql'
+
+# Служебные строки передачи в файлах модели данных (например, "Передаю модель данных:")
+PROSE_LINE = re.compile(r"^[^\W\d_][^;()'\"]*:\s*$")
+
+
+def read_sql(path: str) -> str:
+    """Текст SQL-файла без служебных строк и символов нулевой ширины"""
+    with open(path, encoding='utf-8') as f:
+        text = f.read().replace('\u200b', '')
+    return '\n'.join(line for line in text.splitlines() if not PROSE_LINE.match(line))
+
+
+def schema_files() -> List[str]:
+    """
+    Файлы, из которых собирается база нагрузочных тестов, в порядке выполнения:
+    модель данных, подготовка (prepare.sql), эталон, процедуры модуля проверки
+    """
+    model = sorted(glob.glob(os.path.join(MODEL_DIR, '*.psql')))
+    design = [path for path in model if os.path.basename(path) == DESIGN_FILE]
+    model = [path for path in model if os.path.basename(path) != DESIGN_FILE]
+    return model + [PREPARE_SQL] + design + sorted(glob.glob(os.path.join(CHECK_DIR, '*.psql')))
+
+
+class PostgresServer:
+    """Существующий сервер PostgreSQL: базы нагрузочных тестов создаются и удаляются на нем"""
+
+    def __init__(self, host: str, port: int, user: str, password: str = ''):
+        self.params = dict(host=host, port=port, user=user, password=password)
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def connection_params(self, database: str) -> Dict:
+        """Параметры Database (scanner/database.py) для базы database"""
+        return dict(self.params, database=database)
+
+    def _admin(self):
+        conn = psycopg2.connect(dbname='postgres', **self.params)
+        conn.autocommit = True
+        return conn
+
+    def version(self) -> str:
+        conn = self._admin()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SHOW server_version")
+                return cur.fetchone()[0]
+        finally:
+            conn.close()
+
+    def create_database(self, name: str, template: Optional[str] = None) -> None:
+        conn = self._admin()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+                if template:
+                    cur.execute(f'CREATE DATABASE "{name}" TEMPLATE "{template}"')
+                else:
+                    cur.execute(f'CREATE DATABASE "{name}" TEMPLATE template0 ENCODING \'UTF8\'')
+        finally:
+            conn.close()
+
+    def drop_database(self, name: str) -> None:
+        conn = self._admin()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+        finally:
+            conn.close()
+
+    def create_template(self, name: str) -> None:
+        """Шаблонная база со схемой, эталоном и процедурами проверки (копируется для каждой конфигурации)"""
+        self.create_database(name)
+        conn = psycopg2.connect(dbname=name, **self.params)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                for path in schema_files():
+                    logger.info(f"Loading {os.path.relpath(path, REPOSITORY_ROOT)}")
+                    cur.execute(read_sql(path))
+        finally:
+            conn.close()
+
+
+class ThrowawayPostgres(PostgresServer):
+    """
+    Временный кластер PostgreSQL (initdb) во временном каталоге: подключения только через
+    Unix-сокет в том же каталоге, аутентификация trust; каталог удаляется при остановке
+    """
+
+    def __init__(self, bin_dir: Optional[str] = None, port: int = 55432, locale: str = 'C.UTF-8'):
+        self.bin_dir = bin_dir
+        self.port = port
+        self.locale = locale
+        self.directory: Optional[str] = None
+        super().__init__(host='', port=port, user='bench')
+
+    def _command(self, name: str) -> str:
+        return os.path.join(self.bin_dir, name) if self.bin_dir else name
+
+    def start(self) -> None:
+        self.directory = tempfile.mkdtemp(prefix='scanner_bench_pg_')
+        data_dir = os.path.join(self.directory, 'data')
+        subprocess.run([self._command('initdb'), '-D', data_dir, '-U', 'bench', '-A', 'trust',
+                        '-E', 'UTF8', f"--locale={self.locale}"],
+                       check=True, stdout=subprocess.DEVNULL)
+        options = f"-p {self.port} -k {self.directory} -c listen_addresses=''"
+        subprocess.run([self._command('pg_ctl'), '-D', data_dir, '-l', os.path.join(self.directory, 'server.log'),
+                        '-o', options, '-w', 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        self.params['host'] = self.directory
+        logger.info(f"Throwaway PostgreSQL started in {self.directory} (port {self.port})")
+
+    def stop(self) -> None:
+        if self.directory is None:
+            return
+        try:
+            subprocess.run([self._command('pg_ctl'), '-D', os.path.join(self.directory, 'data'),
+                            '-m', 'fast', '-w', 'stop'],
+                           check=False, stdout=subprocess.DEVNULL)
+        finally:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
@@ -0,0 +1,16 @@
+-- Подготовка базы нагрузочных тестов (выполняется после файлов Модель_данных, до эталона 03$design.psql)
+
+-- uuid_generate_v4() в 03$design.psql
+CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+
+-- Сканер сохраняет элементы с ON CONFLICT (information_resource_s, relative_path, name)
+ALTER TABLE directory DROP CONSTRAINT IF EXISTS c_directory_resource_path_unq;
+ALTER TABLE directory ADD CONSTRAINT c_directory_resource_path_unq UNIQUE (information_resource_s, relative_path, name);
+ALTER TABLE file DROP CONSTRAINT IF EXISTS c_file_resource_path_unq;
+ALTER TABLE file ADD CONSTRAINT c_file_resource_path_unq UNIQUE (information_resource_s, relative_path, name);
+
+-- Домен и ресурс, к которым относится эталон 03$design.psql (information_resource_s = 1)
+INSERT INTO data_domain (data_domain_s, name, description, key_business_obj_class)
+    VALUES (1, 'Фото', 'Нагрузочные тесты', 'Проект');
+INSERT INTO information_resource (information_resource_s, data_domain_s, path, name, path_to_mount)
+    VALUES (1, 1, '//bench/resource', 'Синтетическое дерево', '/bench');
@@ -0,0 +1,302 @@
+# benchmarks/run_benchmarks.py
+"""
+Нагрузочные тесты сканера и модуля проверки на синтетических деревьях.
+
+Для каждой конфигурации (configurations.json) генерируется дерево каталогов (tree_generator.TreeSpec),
+создается чистая база из шаблона (модель данных, эталон, процедуры модуля проверки) и выполняются:
+полное сканирование (FilesystemScanner + Database), проверка соответствия check_domain_compliance,
+инкрементальное сканирование после изменения доли каталогов и check_domain_compliance_incremental.
+Каждая конфигурация выполняется в отдельном процессе, поэтому пиковый объем памяти (ru_maxrss)
+относится только к ней. Результаты сравниваются с сохраненной базовой линией.
+
+Запуск из каталога 2.0:
+    python -m benchmarks.run_benchmarks --pg-bin /usr/lib/postgresql/16/bin --baseline benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --db-host localhost --db-user postgres --db-password ... --save-baseline
+Пользователь существующего сервера должен иметь права CREATE DATABASE и CREATE EXTENSION.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource as rlimit
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from scanner.database import Database
+from scanner.metrics import profiling
+from scanner.models import InformationResource
+from scanner.scanner import FilesystemScanner
+from scanner.scheduler import run_scan
+from .postgres import BENCHMARKS_DIR, PostgresServer, ThrowawayPostgres
+from .tree_generator import TreeGenerator, TreeSpec, touch_directories
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DATABASE = 'scanner_bench_template'
+RUN_DATABASE = 'scanner_bench_run'
+
+# Сравниваемые показатели: (имя, больше - лучше)
+COMPARED_METRICS = (
+    ('full_entries_per_second', True),
+    ('full_seconds', False),
+    ('full_db_round_trips', False),
+    ('incremental_seconds', False),
+    ('compliance_seconds', False),
+    ('compliance_incremental_seconds', False),
+    ('peak_memory_bytes', False),
+)
+
+# Ресурс эталона (Модель_данных/03$design.psql), зарегистрированный в prepare.sql
+RESOURCE_ID = 1
+
+
+def _max_rss_bytes() -> int:
+    """Пиковый объем резидентной памяти процесса (ru_maxrss: Linux - КиБ, macOS - байты)"""
+    max_rss = rlimit.getrusage(rlimit.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _call(db: Database, statement: str) -> float:
+    """Выполнение процедуры модуля проверки с фиксацией; возвращает длительность, секунды"""
+    start = time.perf_counter()
+    with db.conn.cursor() as cur:
+        cur.execute(statement)
+    db.commit()
+    return time.perf_counter() - start
+
+
+def load_dictionary(db: Database) -> None:
+    """
+    Справочник "Проект" из имен каталогов второго уровня без цифр
+    (как в Модель_данных/03$design.psql, но после сканирования)
+    """
+    with db.conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO nsi_data (dictionary_s, entity_id, entity_name, is_actual)
+            SELECT DISTINCT 1, md5(name), name, TRUE
+            FROM directory
+            WHERE information_resource_s = %s AND nesting_level = 2 AND name !~ '[0-9]'
+        """, (RESOURCE_ID,))
+    db.commit()
+
+
+def run_configuration(config: dict, db_params: dict, tree_root: str, trace_memory: bool) -> dict:
+    """Измерение одной конфигурации (выполняется в отдельном процессе)"""
+    logging.basicConfig(level=logging.WARNING)
+    results = {}
+    options = config.get('scanner', {})
+    # Пул вмещает соединение сканера и сессии фоновой записи файлов
+    db = Database(**db_params, loader=config.get('loader', 'values'),
+                  pool_size=options.get('write_sessions', 0) + 1)
+    try:
+        resource = InformationResource(
+            information_resource_s=RESOURCE_ID,
+            path=os.path.dirname(tree_root),
+            name=os.path.basename(tree_root),
+            description=config['name']
+        )
+
+        scanner = FilesystemScanner(db, **options)
+        with profiling(db.metrics, trace_memory=trace_memory):
+            result = run_scan(db, scanner, resource)
+        if result.errors:
+            raise RuntimeError(f"Full scan errors: {result.errors[:5]}")
+        duration = (result.end_time - result.start_time).total_seconds()
+        counters = result.metrics['counters']
+        results.update(
+            directories=result.total_directories,
+            files=result.total_files,
+            full_seconds=duration,
+            full_entries_per_second=(result.total_directories + result.total_files) / duration if duration else 0.0,
+            full_db_round_trips=counters.get('db_round_trips', 0),
+            full_phases={name: phase['sum'] for name, phase in result.metrics['phases'].items()},
+        )
+        if trace_memory:
+            results['traced_peak_bytes'] = db.metrics.gauges.get('memory_peak_bytes', 0)
+
+        if config.get('compliance'):
+            load_dictionary(db)
+            results['compliance_seconds'] = _call(db, f"CALL check_domain_compliance({RESOURCE_ID})")
+
+        fraction = config.get('incremental_fraction', 0.0)
+        if fraction > 0:
+            created = touch_directories(tree_root, fraction)
+            try:
+                scanner = FilesystemScanner(db, **dict(options, incremental=True))
+                result = run_scan(db, scanner, resource)
+                if result.errors:
+                    raise RuntimeError(f"Incremental scan errors: {result.errors[:5]}")
+                results.update(
+                    incremental_changed_directories=len(created),
+                    incremental_seconds=(result.end_time - result.start_time).total_seconds(),
+                    incremental_created_items=result.created_items,
+                )
+                if config.get('compliance'):
+                    results['compliance_incremental_seconds'] = _call(
+                        db, f"CALL check_domain_compliance_incremental({RESOURCE_ID})")
+            finally:
+                for path in created:
+                    os.remove(path)
+    finally:
+        db.close()
+
+    results['peak_memory_bytes'] = _max_rss_bytes()
+    return results
+
+
+def _median_results(runs: List[dict]) -> dict:
+    """Медиана числовых показателей повторов (остальные значения - из первого повтора)"""
+    merged = dict(runs[0])
+    for key, value in runs[0].items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            merged[key] = statistics.median(run[key] for run in runs if key in run)
+    return merged
+
+
+def compare_with_baseline(results: Dict[str, dict], baseline: Dict[str, dict],
+                          tolerance: float) -> Tuple[List[str], List[str]]:
+    """
+    Сравнение с базовой линией. Возвращает (строки отчета, регрессии):
+    регрессия - ухудшение показателя больше чем на tolerance (доля)
+    """
+    lines = []
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            lines.append(f"{name}: no baseline")
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            if metric not in result or not base.get(metric):
+                continue
+            change = (result[metric] - base[metric]) / base[metric]
+            worse = -change if higher_is_better else change
+            mark = 'REGRESSION' if worse > tolerance else ('improved' if worse < -tolerance else 'ok')
+            line = f"{name}: {metric} {base[metric]:.3f} -> {result[metric]:.3f} ({change:+.1%}) {mark}"
+            lines.append(line)
+            if mark == 'REGRESSION':
+                regressions.append(line)
+    return lines, regressions
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Scanner benchmark suite on synthetic trees')
+    parser.add_argument('--configurations', default=os.path.join(BENCHMARKS_DIR, 'configurations.json'),
+                        help='JSON file with benchmark configurations')
+    parser.add_argument('--only', action='append', help='Run only configurations with this name (repeatable)')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per configuration (median is reported)')
+    parser.add_argument('--work-dir', help='Directory for generated trees (default - temporary, removed at exit)')
+    parser.add_argument('--pg-bin', help='Directory with initdb/pg_ctl for a throwaway cluster')
+    parser.add_argument('--pg-port', type=int, default=55432, help='Port of the throwaway cluster')
+    parser.add_argument('--pg-locale', default='C.UTF-8', help='Locale of the throwaway cluster')
+    parser.add_argument('--db-host', help='Use an existing PostgreSQL server instead of a throwaway cluster')
+    parser.add_argument('--db-port', type=int, default=5432, help='Existing server port')
+    parser.add_argument('--db-user', default='postgres', help='Existing server user')
+    parser.add_argument('--db-password', default='', help='Existing server password')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Also report tracemalloc peak (slows scanning down, affects throughput)')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--baseline', default=os.path.join(BENCHMARKS_DIR, 'baseline.json'),
+                        help='Baseline JSON file to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='Store results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Allowed relative degradation before a metric is reported as a regression')
+    return parser.parse_args()
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_arguments()
+
+    with open(args.configurations, encoding='utf-8') as f:
+        configurations = [config for config in json.load(f) if not args.only or config['name'] in args.only]
+    if not configurations:
+        logger.error("No configurations to run")
+        return 2
+
+    if args.db_host:
+        server = PostgresServer(args.db_host, args.db_port, args.db_user, args.db_password)
+    else:
+        server = ThrowawayPostgres(args.pg_bin, args.pg_port, args.pg_locale)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='scanner_bench_trees_')
+    trees: Dict[str, str] = {}
+    results: Dict[str, dict] = {}
+    # Новый процесс на каждое измерение: ru_maxrss относится только к нему
+    context = multiprocessing.get_context('spawn')
+
+    server.start()
+    try:
+        server.create_template(TEMPLATE_DATABASE)
+        for config in configurations:
+            spec = TreeSpec(**config['tree'])
+            tree_root = trees.get(spec.key())
+            if tree_root is None:
+                tree_dir = os.path.join(work_dir, spec.key())
+                tree_root = os.path.join(tree_dir, spec.root_name)
+                if not os.path.isdir(tree_root):
+                    directories, files = spec.expected_counts()
+                    logger.info(f"Generating tree {spec.key()}: {directories} directories, {files} files")
+                    TreeGenerator(spec).generate(tree_dir)
+                trees[spec.key()] = tree_root
+
+            runs = []
+            for run in range(args.repeat):
+                server.create_database(RUN_DATABASE, TEMPLATE_DATABASE)
+                logger.info(f"Running {config['name']} ({run + 1}/{args.repeat})")
+                with context.Pool(1) as pool:
+                    runs.append(pool.apply(run_configuration, (config, server.connection_params(RUN_DATABASE),
+                                                               tree_root, args.trace_memory)))
+                server.drop_database(RUN_DATABASE)
+            results[config['name']] = _median_results(runs)
+            logger.info(f"{config['name']}: " + ', '.join(
+                f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                for key, value in results[config['name']].items() if not isinstance(value, dict)))
+
+        report = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'postgresql': server.version(),
+                'cpu_count': os.cpu_count(),
+            },
+            'results': results,
+        }
+        server.drop_database(TEMPLATE_DATABASE)
+    finally:
+        server.stop()
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    exit_code = 0
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        lines, regressions = compare_with_baseline(results, baseline['results'], args.tolerance)
+        logger.info(f"Comparison with baseline {args.baseline} ({baseline.get('created')}):\n  " + '\n  '.join(lines))
+        if regressions:
+            logger.error(f"{len(regressions)} regressions beyond {args.tolerance:.0%}")
+            exit_code = 1
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"Baseline saved to {args.baseline}")
+
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+# benchmarks/tree_generator.py
+
+import os
+import random
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Tuple
+
+# Слоги для имен в кириллице и латинице
+CYRILLIC_SYLLABLES = ('ка', 'ро', 'ми', 'ст', 'ле', 'на', 'ды', 'то', 'пре', 'ва', 'ше', 'зу')
+LATIN_SYLLABLES = ('ka', 'ro', 'mi', 'st', 'le', 'na', 'dy', 'to', 'pre', 'va', 'she', 'zu')
+
+# Расширения файлов: соответствующие эталону (Модель_данных/03$design.psql) и посторонние
+PHOTO_EXTENSIONS = ('jpg', 'jpeg', 'nef', 'cr2', 'orf', 'tif', 'dng', 'xmp', 'pp3')
+OTHER_EXTENSIONS = ('txt', 'doc', 'pdf', 'zip', 'bak')
+
+
+@dataclass
+class TreeSpec:
+    """
+    Параметры синтетического дерева каталогов.
+    fanout - число подкаталогов в каталоге, depth - число уровней под корнем,
+    files_per_dir - число файлов в каталоге, file_size - размер файлов (файлы разреженные, место на диске не занимают),
+    name_style - распределение имен: ascii, cyrillic, long (имена около 100 символов с пробелами),
+    photo (структура эталона ФОТО/ГГГГ/Проект с долей несоответствующих имен nonconforming)
+    """
+    fanout: int = 10
+    depth: int = 3
+    files_per_dir: int = 20
+    file_size: int = 0
+    name_style: str = 'ascii'
+    nonconforming: float = 0.1
+    seed: int = 1
+
+    @property
+    def root_name(self) -> str:
+        """Имя корневого каталога ресурса (для photo - литерал корневого правила эталона)"""
+        return 'ФОТО' if self.name_style == 'photo' else 'bench'
+
+    def expected_counts(self) -> Tuple[int, int]:
+        """(количество каталогов с корнем, количество файлов) дерева"""
+        directories = sum(self.fanout ** level for level in range(self.depth + 1))
+        return directories, directories * self.files_per_dir
+
+    def key(self) -> str:
+        """Ключ дерева для повторного использования сгенерированного каталога"""
+        return '_'.join(f"{name}-{value}" for name, value in asdict(self).items())
+
+
+def _syllable_name(rnd: random.Random, syllables: Tuple[str, ...], low: int, high: int) -> str:
+    return ''.join(rnd.choice(syllables) for _ in range(rnd.randint(low, high)))
+
+
+def _letters(index: int) -> str:
+    """Номер, записанный буквами (уникальный суффикс имен без цифр)"""
+    letters = 'абвгдежзиклмнопрстуфхцчшэюя'
+    result = letters[index % len(letters)]
+    while index >= len(letters):
+        index = index // len(letters) - 1
+        result = letters[index % len(letters)] + result
+    return result
+
+
+def _ascii_name(rnd: random.Random, level: int, index: int) -> str:
+    return f"{_syllable_name(rnd, LATIN_SYLLABLES, 2, 5)}_{index}"
+
+
+def _cyrillic_name(rnd: random.Random, level: int, index: int) -> str:
+    return f"{_syllable_name(rnd, CYRILLIC_SYLLABLES, 2, 5).capitalize()} {index}"
+
+
+def _long_name(rnd: random.Random, level: int, index: int) -> str:
+    words = [_syllable_name(rnd, CYRILLIC_SYLLABLES + LATIN_SYLLABLES, 2, 6) for _ in range(40)]
+    return f"{' '.join(words)[:100]} {index}"
+
+
+NAME_STYLES: Dict[str, Callable[[random.Random, int, int], str]] = {
+    'ascii': _ascii_name,
+    'cyrillic': _cyrillic_name,
+    'long': _long_name,
+}
+
+
+class TreeGenerator:
+    """Генерация синтетического дерева TreeSpec (воспроизводимо: имена определяются seed)"""
+
+    def __init__(self, spec: TreeSpec):
+        if spec.name_style not in NAME_STYLES and spec.name_style != 'photo':
+            raise ValueError(f"Unknown name style: {spec.name_style}")
+        self.spec = spec
+        self.rnd = random.Random(spec.seed)
+
+    def _directory_name(self, level: int, index: int) -> str:
+        spec = self.spec
+        if spec.name_style != 'photo':
+            return NAME_STYLES[spec.name_style](self.rnd, level, index)
+        conforming = self.rnd.random() >= spec.nonconforming
+        if level == 1:
+            # Уровень года (правило ^YYYY$)
+            return str(2000 + index) if conforming else f"{2000 + index}_old"
+        if level == 2:
+            # Проект: имена без цифр попадают в справочник "Проект" (см. run_benchmarks.load_dictionary)
+            name = _syllable_name(self.rnd, CYRILLIC_SYLLABLES, 2, 4).capitalize()
+            return f"{name} {_letters(index)}" if conforming else f"Проект {index}"
+        return _cyrillic_name(self.rnd, level, index)
+
+    def _file_name(self, index: int) -> str:
+        spec = self.spec
+        if spec.name_style == 'photo':
+            extensions = PHOTO_EXTENSIONS if self.rnd.random() >= spec.nonconforming else OTHER_EXTENSIONS
+            return f"IMG_{index:05d}.{self.rnd.choice(extensions)}"
+        base = NAME_STYLES[spec.name_style](self.rnd, 0, index)
+        return f"{base}.{self.rnd.choice(PHOTO_EXTENSIONS + OTHER_EXTENSIONS)}"
+
+    def generate(self, parent: str) -> str:
+        """
+        Создание дерева в каталоге parent. Возвращает путь корневого каталога.
+        Файлы создаются разреженными (truncate), поэтому размер не влияет на занимаемое место
+        """
+        root = os.path.join(parent, self.spec.root_name)
+        os.makedirs(root)
+        stack = [(root, 0)]
+        while stack:
+            path, level = stack.pop()
+            for index in range(self.spec.files_per_dir):
+                with open(os.path.join(path, self._file_name(index)), 'wb') as f:
+                    if self.spec.file_size:
+                        f.truncate(self.spec.file_size)
+            if level >= self.spec.depth:
+                continue
+            for index in range(self.spec.fanout):
+                child = os.path.join(path, self._directory_name(level + 1, index))
+                os.mkdir(child)
+                stack.append((child, level + 1))
+        return root
+
+
+def touch_directories(root: str, fraction: float, seed: int = 1) -> List[str]:
+    """
+    Изменение доли fraction каталогов дерева для инкрементального сканирования:
+    в каждом выбранном каталоге создается новый файл (меняется mtime каталога).
+    Возвращает пути созданных файлов (удаляются после измерения, чтобы дерево можно было использовать повторно)
+    """
+    rnd = random.Random(seed)
+    created = []
+    for dirpath, _, _ in os.walk(root):
+        if rnd.random() < fraction:
+            path = os.path.join(dirpath, f"IMG_new_{len(created):05d}.jpg")
+            with open(path, 'wb'):
+                pass
+            created.append(path)
+    return created
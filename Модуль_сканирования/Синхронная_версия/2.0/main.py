@@ -2,14 +2,24 @@
 import os
 import logging
 import argparse
+import asyncio
 import sys
-from datetime import datetime
-from typing import List
+from datetime import datetime, timedelta
+from typing import List, Optional
 
 from scanner.models import InformationResource, ScanResult
 from scanner.scanner import FilesystemScanner
 from scanner.database import Database
+from scanner.hash_calculator import HashCalculator
+from scanner.hashing import HashingStage
+from scanner.dedup import DuplicateFinder
+from scanner.indexing import IndexingStage
+from scanner.text_extractor import TextExtractor
+from scanner.nsi_import import NsiImporter
+from scanner.analysis import AnalysisRunner
+from scanner.scheduler import ScanScheduler, run_scan
 from scanner.config import DatabaseConfig
+from scanner.metrics import ScanMetrics, profiling, write_metrics
 
 
 def setup_logging():
@@ -28,16 +38,108 @@ def setup_logging():
 def parse_arguments():
     """Парсинг аргументов командной строки"""
     parser = argparse.ArgumentParser(description='Filesystem scanner')
-    parser.add_argument('--path', required=True, help='Path to scan')
-    parser.add_argument('--name', required=True, help='Resource name')
+    parser.add_argument('--path', help='Path to scan')
+    parser.add_argument('--name', help='Resource name')
     parser.add_argument('--db-host', default='localhost', help='Database host')
     parser.add_argument('--db-port', type=int, default=5432, help='Database port')
     parser.add_argument('--db-name', required=True, help='Database name')
     parser.add_argument('--db-user', required=True, help='Database user')
     parser.add_argument('--db-password', required=True, help='Database password')
-    parser.add_argument('--batch-size', type=int, default=5000, help='Batch size for bulk operations')
-
-    return parser.parse_args()
+    parser.add_argument('--batch-size', type=int, default=50000, help='Batch size for bulk operations')
+    parser.add_argument('--walk-workers', type=int, default=1,
+                        help='Number of directory walk threads (1 - sequential walk)')
+    parser.add_argument('--pipeline-depth', type=int, default=0,
+                        help='Overlap walking and database writes through a queue of N directories (0 - off)')
+    parser.add_argument('--path-index-limit', type=int, default=0,
+                        help='Directory path index entries kept in memory before spilling to disk (0 - unlimited)')
+    parser.add_argument('--loader', choices=['values', 'prepared', 'copy'], default='prepared',
+                        help='Bulk loader: execute_values per batch, server-side prepared statement per batch '
+                             'or COPY into staging tables')
+    parser.add_argument('--write-sessions', type=int, default=0,
+                        help='Pooled database sessions writing file batches of a full scan in background '
+                             '(0 - write in the scanner connection; not used with --loader copy)')
+    parser.add_argument('--db-retries', type=int, default=3,
+                        help='Retries of a database operation on a new connection after the connection is lost')
+    parser.add_argument('--async', dest='async_scan', action='store_true',
+                        help='Full scan with asyncio: many directories read concurrently, '
+                             'database writes over a connection pool (asyncpg)')
+    parser.add_argument('--max-in-flight', type=int, default=64,
+                        help='Directories read concurrently by the asyncio scanner')
+    parser.add_argument('--db-pool-size', type=int, default=4,
+                        help='Database connection pool size of the asyncio scanner')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Write only changes detected by directory/file modification time')
+    parser.add_argument('--branch',
+                        help='Scan only this subdirectory (path relative to the resource root); '
+                             'its parent directory must already be scanned')
+    parser.add_argument('--checkpoint-interval', type=float, default=300,
+                        help='Save a checkpoint of a full scan every N seconds (0 - off)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume the last interrupted full scan of the resource (or branch) from its checkpoint '
+                             '(with --scheduler - for every scheduled scan)')
+    parser.add_argument('--resume-max-age', type=float, default=24,
+                        help='Do not resume from checkpoints older than N hours (0 - any age)')
+    parser.add_argument('--hash', action='store_true',
+                        help='Calculate MD5 for new and changed files after scanning')
+    parser.add_argument('--hash-workers', type=int, default=4, help='Number of hashing threads')
+    parser.add_argument('--hash-chunk-size', type=int, default=1024,
+                        help='Hashing read buffer size, KiB')
+    parser.add_argument('--hash-bandwidth', type=float, default=None,
+                        help='Total hashing read bandwidth limit, MB/s (default - unlimited)')
+    parser.add_argument('--index', action='store_true',
+                        help='Build full-text search vectors (name, path, content) for new and changed files '
+                             'after scanning')
+    parser.add_argument('--index-workers', type=int, default=2, help='Number of text extraction processes')
+    parser.add_argument('--index-max-size', type=int, default=256,
+                        help='Text read from one file for the full-text index, KiB')
+    parser.add_argument('--search',
+                        help='Search files in the full-text index (web search syntax) and exit')
+    parser.add_argument('--search-limit', type=int, default=50, help='Maximum number of search results')
+    parser.add_argument('--changes-since', type=int, metavar='SCAN_RUN',
+                        help='Report file and directory changes recorded after this scan run and exit')
+    parser.add_argument('--drop-history-before', type=int, metavar='SCAN_RUN',
+                        help='Drop change history partitions of scan runs before this one and exit')
+    parser.add_argument('--analyze', action='store_true',
+                        help='Check data integrity of resources scanned since their last analysis, '
+                             'store findings and exit')
+    parser.add_argument('--analysis-workers', type=int, default=4,
+                        help='Number of resources analyzed concurrently (database sessions)')
+    parser.add_argument('--freshness-days', type=int, default=7,
+                        help='Report resources without a completed scan for more than this many days (with --analyze)')
+    parser.add_argument('--nsi-import',
+                        help='Synchronize NSI dictionaries with an export (JSON Lines file or HTTP(S) URL) and exit')
+    parser.add_argument('--nsi-chunk-size', type=int, default=10000,
+                        help='NSI export records loaded into the database with one COPY')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Find duplicate files by content after scanning and report reclaimable space')
+    parser.add_argument('--scheduler', choices=['once', 'loop'],
+                        help='Scan resources from the database by their scan_schedule: one pass or continuously')
+    parser.add_argument('--scheduler-interval', type=int, default=60, help='Scheduler check interval, seconds')
+    parser.add_argument('--scan-workers', type=int, default=4, help='Number of scheduler worker processes')
+    parser.add_argument('--per-host-limit', type=int, default=1,
+                        help='Maximum concurrent scans of resources on one storage host')
+    parser.add_argument('--metrics-json',
+                        help='Write scan phase metrics of each resource to this JSON file '
+                             '({resource} is replaced by the resource name)')
+    parser.add_argument('--metrics-prom',
+                        help='Write scan phase metrics of each resource in Prometheus text format '
+                             '({resource} is replaced by the resource name)')
+    parser.add_argument('--profile',
+                        help='Profile scanning of each resource with cProfile and save stats to this file '
+                             '({resource} is replaced by the resource name)')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Trace memory allocations with tracemalloc and report peak usage and top allocations')
+
+    args = parser.parse_args()
+    # Режимы отчетов и обслуживания не сканируют указанный путь
+    args.report_only = bool(args.search or args.nsi_import or args.analyze or args.changes_since is not None
+                            or args.drop_history_before is not None)
+    if not args.scheduler and not args.report_only and (not args.path or not args.name):
+        parser.error('--path and --name are required unless --scheduler, --search, --nsi-import, --analyze, '
+                     '--changes-since or --drop-history-before is used')
+    if args.async_scan and (args.incremental or args.scheduler):
+        parser.error('--async supports only full scans without --scheduler')
+    return args
 
 
 def get_resources_to_scan() -> List[InformationResource]:
@@ -53,44 +155,245 @@ def get_resources_to_scan() -> List[InformationResource]:
     ]
 
 
-def mark_inactive_items(db: Database, resource: InformationResource):
-    db.mark_items_not_actual(resource.information_resource_s)
+def scan_resource(db: Database, resource: InformationResource, logger, walk_workers: int = 1,
+                  incremental: bool = False, pipeline_depth: int = 0, batch_size: int = 50000,
+                  path_index_limit: int = 0, branch: Optional[str] = None, checkpoint_interval: float = 0,
+                  resume: bool = False, write_sessions: int = 0,
+                  resume_max_age: Optional[timedelta] = None) -> ScanResult:
+    """
+    Сканирование одного информационного ресурса (или его ветви branch)
+    resume - продолжить прерванное полное сканирование с контрольной точки не старше resume_max_age
+    """
+    scanner = FilesystemScanner(db, **scanner_options(walk_workers, incremental, pipeline_depth, batch_size,
+                                                      path_index_limit, checkpoint_interval, write_sessions))
+    return run_scan(db, scanner, resource, branch=branch, resume=resume, resume_max_age=resume_max_age)
+
+
+async def scan_resource_async(args, resource: InformationResource, metrics: ScanMetrics) -> ScanResult:
+    """
+    Сканирование одного информационного ресурса (или его ветви --branch) асинхронным сканером
+    с собственным пулом соединений; метрики записываются в общий объект metrics
+    """
+    # asyncpg нужен только асинхронному сканеру
+    from scanner.async_scanner import AsyncFilesystemScanner, run_scan_async
+    from scanner.async_database import AsyncDatabase
+
+    db = await AsyncDatabase.connect(
+        host = args.db_host,
+        port = args.db_port,
+        database = args.db_name,
+        user = args.db_user,
+        password = args.db_password,
+        pool_size = args.db_pool_size,
+        metrics = metrics
+    )
+    try:
+        scanner = AsyncFilesystemScanner(db, batch_size=args.batch_size, max_in_flight=args.max_in_flight,
+                                         pool_size=args.db_pool_size, path_index_limit=args.path_index_limit)
+        return await run_scan_async(db, scanner, resource, branch=args.branch)
+    finally:
+        await db.close()
+
+
+def scanner_options(walk_workers: int = 1, incremental: bool = False, pipeline_depth: int = 0,
+                    batch_size: int = 50000, path_index_limit: int = 0, checkpoint_interval: float = 0,
+                    write_sessions: int = 0) -> dict:
+    """Параметры FilesystemScanner"""
+    return dict(
+        batch_size=batch_size,
+        walk_workers=walk_workers,
+        incremental=incremental,
+        pipeline_depth=pipeline_depth,
+        path_index_limit=path_index_limit,
+        checkpoint_interval=checkpoint_interval,
+        write_sessions=write_sessions
+    )
 
 
-def scan_resource(db: Database, resource: InformationResource, logger) -> ScanResult:
-    """Сканирование одного информационного ресурса"""
-    start_time = datetime.now()
-    errors = []
+def resume_max_age(args) -> Optional[timedelta]:
+    """Максимальный возраст контрольной точки для продолжения сканирования (None - любой)"""
+    return timedelta(hours=args.resume_max_age) if args.resume_max_age > 0 else None
+
 
+def resource_path(template: Optional[str], resource: InformationResource) -> Optional[str]:
+    """Путь файла метрик или профиля ресурса: {resource} заменяется именем ресурса"""
+    return template.replace('{resource}', resource.name) if template else None
+
+
+def export_metrics(db: Database, resource: InformationResource, args, logger) -> None:
+    """Выгрузка метрик сканирования (и хеширования) ресурса в файлы --metrics-json/--metrics-prom"""
+    if not args.metrics_json and not args.metrics_prom:
+        return
     try:
-        # Создаем сканер с размером пакета 5000
-        scanner = FilesystemScanner(db, batch_size=5000)
+        write_metrics(db.metrics, resource_path(args.metrics_json, resource),
+                      resource_path(args.metrics_prom, resource), labels={'resource': resource.name})
+    except OSError as e:
+        logger.error(f"Error writing metrics of {resource.name}: {str(e)}")
+
+
+def run_scheduler(db: Database, args, logger) -> None:
+    """Сканирование ресурсов по расписанию из БД (планировщик заданий)"""
+    db_config = dict(
+        host = args.db_host,
+        port = args.db_port,
+        database = args.db_name,
+        user = args.db_user,
+        password = args.db_password,
+        loader = args.loader,
+        # Соединение сканера и сессии фоновой записи файлов
+        pool_size = args.write_sessions + 1,
+        retries = args.db_retries
+    )
+    options = scanner_options(args.walk_workers, args.incremental, args.pipeline_depth, args.batch_size,
+                              args.path_index_limit, args.checkpoint_interval, args.write_sessions)
+    scheduler = ScanScheduler(db, db_config, options, max_workers=args.scan_workers,
+                              per_host_limit=args.per_host_limit, resume=args.resume,
+                              resume_max_age=resume_max_age(args))
+
+    if args.scheduler == 'loop':
+        logger.info(f"Scheduler started (check interval {args.scheduler_interval} seconds)")
+        scheduler.run_forever(args.scheduler_interval)
+        return
+
+    jobs = scheduler.run_pending()
+    failed = sum(1 for job in jobs if job.result is None or job.result.errors)
+    logger.info(f"Scheduler pass completed: {len(jobs)} jobs, {failed} with errors")
 
-        # Помечаем существующие записи как неактуальные
-        mark_inactive_items(db, resource)
 
-        # Сканируем ресурс
-        scanner.scan_resource(resource)
+def create_hash_calculator(args, metrics: Optional[ScanMetrics] = None) -> HashCalculator:
+    """Калькулятор хешей с параметрами командной строки"""
+    return HashCalculator(
+        chunk_size=args.hash_chunk_size * 1024,
+        workers=args.hash_workers,
+        bandwidth_limit=int(args.hash_bandwidth * 1024 * 1024) if args.hash_bandwidth else None,
+        metrics=metrics
+    )
 
-        # Получаем статистику
-        stats = db.get_resource_stats(resource.information_resource_s)
 
-    except Exception as e:
-        error_msg = f"Error scanning resource {resource.information_resource_s}: {str(e)}"
-        logger.error(error_msg)
-        errors.append(error_msg)
-        stats = (0, 0, 0)  # directories, files, total_size
-
-    end_time = datetime.now()
-
-    return ScanResult(
-        total_directories=stats[0],
-        total_files=stats[1],
-        total_size=stats[2],
-        start_time=start_time,
-        end_time=end_time,
-        errors=errors
+def hash_resource(db: Database, resource: InformationResource, args, logger) -> None:
+    """Вычисление MD5 для файлов ресурса, у которых хеш отсутствует или сброшен при сканировании"""
+    calculator = create_hash_calculator(args, db.metrics)
+    start_time = datetime.now()
+    hashed, bytes_read, errors = HashingStage(db, calculator).hash_resource(resource)
+    duration = (datetime.now() - start_time).total_seconds()
+    throughput = bytes_read / duration / (1024 * 1024) if duration > 0 else 0.0
+
+    logger.info(
+        f"Hashing completed for {resource.name}:\n"
+        f"  Files hashed: {hashed}\n"
+        f"  Bytes read: {bytes_read:,}\n"
+        f"  Throughput: {throughput:.2f} MB/s\n"
+        f"  Duration: {duration:.2f} seconds"
+    )
+    if errors:
+        logger.error(f"Errors during hashing: {len(errors)} files could not be read")
+
+
+def index_resource(db: Database, resource: InformationResource, args, logger) -> None:
+    """Полнотекстовая индексация новых и изменившихся файлов ресурса"""
+    extractor = TextExtractor(workers=args.index_workers, max_bytes=args.index_max_size * 1024)
+    start_time = datetime.now()
+    indexed, with_content, errors = IndexingStage(db, extractor).index_resource(resource)
+    duration = (datetime.now() - start_time).total_seconds()
+
+    logger.info(
+        f"Indexing completed for {resource.name}:\n"
+        f"  Files indexed: {indexed}\n"
+        f"  Files with extracted text: {with_content}\n"
+        f"  Duration: {duration:.2f} seconds"
     )
+    if errors:
+        logger.error(f"Errors during indexing: text of {len(errors)} files could not be extracted")
+
+
+def search_files(db: Database, args, logger) -> None:
+    """Поиск файлов в полнотекстовом индексе всех ресурсов"""
+    results = db.search_files(args.search, limit=args.search_limit)
+    logger.info(f"Search results for '{args.search}': {len(results)}")
+    for file_s, resource_id, relative_path, name, rank in results:
+        print(f"{rank:.4f}\t{resource_id}\t{os.path.join(relative_path, name)}")
+
+
+def report_changes(db: Database, resources: List[InformationResource], args, logger) -> None:
+    """Изменения файлов и каталогов ресурсов после запуска сканирования args.changes_since"""
+    for resource in resources:
+        changes = db.get_changes_since(resource.information_resource_s, args.changes_since)
+        logger.info(f"Changes in {resource.name} after scan run {args.changes_since}: {len(changes)}")
+        for scan_run_s, object_type, object_s, change_type, change_time, relative_path, name, size in changes:
+            print(f"{scan_run_s}\t{change_time:%Y-%m-%d %H:%M:%S}\t{change_type}\t{object_type}\t"
+                  f"{os.path.join(relative_path, name)}\t{size if size is not None else ''}")
+
+
+def analyze_resources(db: Database, args, logger) -> None:
+    """Анализ корректности данных ресурсов, сканированных после последнего анализа, и свежести сканирования"""
+    start_time = datetime.now()
+    results, errors = AnalysisRunner(db, workers=args.analysis_workers).run()
+    duration = (datetime.now() - start_time).total_seconds()
+
+    logger.info(f"Analysis completed: {len(results)} resources, duration {duration:.2f} seconds")
+    for result in results:
+        issues = ', '.join(f"{issue_type}: {count}"
+                           for issue_type, count in db.get_analysis_findings(result.analysis_run_s))
+        logger.info(
+            f"Analysis {result.analysis_run_s} of resource {result.information_resource_s} "
+            f"(scan run {result.scan_run_s}):\n"
+            f"  Directories: {result.total_directories}\n"
+            f"  Files: {result.total_files}\n"
+            f"  Total size: {result.total_size:,} bytes\n"
+            f"  Compliance: {result.percent_compliance:.2f}%\n"
+            f"  Findings: {result.finding_count}" + (f" ({issues})" if issues else "")
+        )
+    if errors:
+        logger.error(f"Errors during analysis: {len(errors)} resources could not be analyzed")
+
+    for resource_id, name, days, status in db.check_scan_freshness(args.freshness_days):
+        logger.warning(f"Resource {name} (ID={resource_id}): {status}"
+                       + (f", {days} days without scan" if days is not None else ""))
+
+
+def import_nsi(db: Database, args, logger) -> None:
+    """Синхронизация справочников с выгрузкой НСИ и отчет об изменениях"""
+    start_time = datetime.now()
+    result = NsiImporter(db, chunk_size=args.nsi_chunk_size).import_export(args.nsi_import)
+    duration = (datetime.now() - start_time).total_seconds()
+
+    logger.info(
+        f"NSI sync {result.nsi_sync_run_s} completed for {args.nsi_import}:\n"
+        f"  Records: {result.records}\n"
+        f"  Changed dictionaries: {len(result.changes)}\n"
+        f"  Duration: {duration:.2f} seconds"
+    )
+    for change in result.changes:
+        logger.info(
+            f"Dictionary {change.code}: {change.inserted} inserted, {change.updated} updated, "
+            f"{change.deactivated} deactivated, {change.links_changed} links changed, "
+            f"{change.affected_rules} rules to recheck"
+        )
+    if result.errors:
+        logger.error(f"Errors during NSI sync: {len(result.errors)}")
+
+
+def find_duplicates(db: Database, resources: List[InformationResource], args, logger) -> None:
+    """Поиск дубликатов файлов и отчет по каждому ресурсу"""
+    finder = DuplicateFinder(db, create_hash_calculator(args, db.metrics))
+    partial, full, groups, errors = finder.find_duplicates(resources)
+    logger.info(
+        f"Duplicate search completed:\n"
+        f"  Partially hashed files: {partial}\n"
+        f"  Fully hashed files: {full}\n"
+        f"  Duplicate groups: {groups}"
+    )
+    if errors:
+        logger.error(f"Errors during duplicate search: {len(errors)} files could not be read")
+
+    for resource in resources:
+        group_count, file_count, reclaimable, shared = db.get_duplicate_report(resource.information_resource_s)
+        logger.info(
+            f"Duplicates in {resource.name}:\n"
+            f"  Groups: {group_count} ({shared} with copies in other resources)\n"
+            f"  Files: {file_count}\n"
+            f"  Reclaimable size: {reclaimable:,} bytes"
+        )
 
 
 def main():
@@ -101,7 +404,7 @@ def main():
     args = parse_arguments()
 
     # Проверяем существование указанного пути
-    if not os.path.exists(args.path):
+    if not args.scheduler and not args.report_only and not os.path.exists(args.path):
         logger.error(f"Path {args.path} does not exist")
         return
 
@@ -112,12 +415,42 @@ def main():
             port = args.db_port,
             database = args.db_name,
             user = args.db_user,
-            password = args.db_password
+            password = args.db_password,
+            loader = args.loader,
+            # Соединение сканера и сессии фоновой записи файлов или анализа ресурсов
+            pool_size = max(args.write_sessions, args.analysis_workers if args.analyze else 0) + 1,
+            retries = args.db_retries
         )
 
+        if args.scheduler:
+            # Ресурсы и расписания сканирования берутся из БД
+            run_scheduler(db, args, logger)
+            return
+
+        if args.search:
+            search_files(db, args, logger)
+            return
+
+        if args.nsi_import:
+            import_nsi(db, args, logger)
+            return
+
+        if args.analyze:
+            analyze_resources(db, args, logger)
+            return
+
+        if args.drop_history_before is not None:
+            dropped = db.drop_history_before(args.drop_history_before)
+            logger.info(f"Dropped {dropped} change history partitions before scan run {args.drop_history_before}")
+            return
+
         # Получение списка ресурсов для сканирования
         resources = get_resources_to_scan()
 
+        if args.changes_since is not None:
+            report_changes(db, resources, args, logger)
+            return
+
         print (f"resources={resources}")
 
         total_start_time = datetime.now()
@@ -126,7 +459,16 @@ def main():
         # Сканирование каждого ресурса
         for resource in resources:
             logger.info(f"Starting scan of resource: {resource.name}")
-            result = scan_resource(db, resource, logger)
+            with profiling(db.metrics, resource_path(args.profile, resource), args.trace_memory):
+                if args.async_scan:
+                    result = asyncio.run(scan_resource_async(args, resource, db.metrics))
+                else:
+                    result = scan_resource(db, resource, logger, walk_workers=args.walk_workers,
+                                           incremental=args.incremental, pipeline_depth=args.pipeline_depth,
+                                           batch_size=args.batch_size, path_index_limit=args.path_index_limit,
+                                           branch=args.branch, checkpoint_interval=args.checkpoint_interval,
+                                           resume=args.resume, write_sessions=args.write_sessions,
+                                           resume_max_age=resume_max_age(args))
             results.append(result)
 
             # Логирование результатов сканирования
@@ -136,12 +478,27 @@ def main():
                 f"  Directories: {result.total_directories}\n"
                 f"  Files: {result.total_files}\n"
                 f"  Total size: {result.total_size:,} bytes\n"
+                f"  Syscalls per entry: {result.syscalls_per_entry:.2f}\n"
+                f"  Changes: {result.created_items} created, {result.modified_items} modified, "
+                f"{result.deleted_items} deleted\n"
                 f"  Duration: {duration:.2f} seconds"
             )
 
             if result.errors:
                 logger.error(f"Errors during scan: {result.errors}")
 
+            if args.hash:
+                hash_resource(db, resource, args, logger)
+
+            # После хеширования: MD5 в векторе уже известен и не вызовет повторной индексации
+            if args.index:
+                index_resource(db, resource, args, logger)
+
+            export_metrics(db, resource, args, logger)
+
+        if args.dedup:
+            find_duplicates(db, resources, args, logger)
+
         # Общая статистика
         total_duration = (datetime.now() - total_start_time).total_seconds()
         total_dirs = sum(r.total_directories for r in results)
@@ -0,0 +1,61 @@
+# scanner/analysis.py
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+from .models import AnalysisResult
+from .database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisRunner:
+    """
+    Анализ корректности данных ресурсов (f_analyze_resource модуля анализа).
+    Анализируются только ресурсы, сканированные после их последнего анализа; каждый ресурс
+    проверяется за один проход по своим секциям каталогов и файлов отдельной сессией пула,
+    поэтому ресурсы анализируются параллельно на сервере
+    """
+
+    def __init__(self, db: Database, workers: int = 4):
+        """workers - число ресурсов, анализируемых одновременно (сессий пула подключения db)"""
+        self.db = db
+        self.metrics = db.metrics
+        self.workers = max(1, workers)
+
+    def run(self, resource_ids: Optional[List[int]] = None) -> Tuple[List[AnalysisResult], list]:
+        """
+        Анализ ресурсов, сканированных после последнего анализа (resource_ids - только из этого списка).
+        Возвращает (итоги анализа по ресурсам, ошибки)
+        """
+        resources = [
+            (resource_id, name) for resource_id, name, _ in self.db.get_resources_to_analyze()
+            if resource_ids is None or resource_id in resource_ids
+        ]
+        results = []
+        errors = []
+        if not resources:
+            return results, errors
+
+        with self.metrics.timer('analysis'):
+            with ThreadPoolExecutor(min(self.workers, len(resources)), thread_name_prefix='analysis') as executor:
+                futures = {executor.submit(self._analyze, resource_id): name for resource_id, name in resources}
+                for future in as_completed(futures):
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        error_msg = f"Error analyzing resource {futures[future]}: {str(e)}"
+                        logger.error(error_msg)
+                        errors.append(error_msg)
+
+        results.sort(key=lambda result: result.information_resource_s)
+        self.metrics.add('analysis_resources', len(results))
+        return results, errors
+
+    def _analyze(self, resource_id: int) -> AnalysisResult:
+        """Анализ одного ресурса отдельной сессией пула"""
+        session = self.db.session()
+        try:
+            return session.analyze_resource(resource_id)
+        finally:
+            session.close()
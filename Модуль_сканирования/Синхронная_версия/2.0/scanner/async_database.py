@@ -0,0 +1,244 @@
+# scanner/async_database.py
+
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+import asyncpg
+from .models import DirectoryBatch, FileBatch, ScanResult
+from .metrics import ScanMetrics
+from .database import (DIRECTORY_UNNEST_INSERT, FILE_UNNEST_INSERT, directory_batch_params, file_batch_params,
+                       _subtree_condition)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDatabase:
+    """
+    Асинхронное подключение к БД (asyncpg) для AsyncFilesystemScanner: небольшой пул соединений,
+    запросы вне явных транзакций фиксируются сразу (как пакеты загрузчиков 'values' и 'prepared' в Database).
+    Создается корутиной AsyncDatabase.connect
+    """
+
+    def __init__(self, pool: asyncpg.Pool, metrics: Optional[ScanMetrics] = None):
+        self.pool = pool
+        self.metrics = metrics or ScanMetrics()
+
+    @classmethod
+    async def connect(cls, host: str, port: int, database: str, user: str, password: str,
+                      pool_size: int = 4, metrics: Optional[ScanMetrics] = None) -> 'AsyncDatabase':
+        """
+        Создание пула из pool_size соединений
+        metrics - метрики, общие для сканера процесса (по умолчанию - новые)
+        """
+        pool = await asyncpg.create_pool(
+            host=host,
+            port=port,
+            database=database,
+            user=user,
+            password=password,
+            min_size=1,
+            max_size=max(1, pool_size)
+        )
+        logger.info(f"Database connection pool established (size: {pool_size})")
+        return cls(pool, metrics)
+
+    async def close(self) -> None:
+        """Закрытие пула соединений"""
+        if self.pool:
+            await self.pool.close()
+            logger.info("Database connection pool closed")
+
+    async def _call(self, method: str, query: str, *args):
+        """Выполнение запроса на свободном соединении пула с учетом в метриках (фаза db_execute)"""
+        start = time.perf_counter()
+        try:
+            return await getattr(self.pool, method)(query, *args)
+        finally:
+            self.metrics.observe('db_execute', time.perf_counter() - start)
+            self.metrics.add('db_round_trips')
+
+    async def finalize_scan(self, resource_id: int, scan_run_s: int, branch_path: Optional[str] = None) -> None:
+        """
+        Завершение полного сканирования: записи ресурса (или поддерева branch_path), не встреченные
+        запуском scan_run_s и более поздними запусками, помечаются неактуальными; контрольные точки
+        этого и более ранних запусков удаляются (как Database.finalize_scan)
+        """
+        directory_condition = file_condition = ""
+        if branch_path:
+            directory_condition = f"AND {_subtree_condition('full_path', '$3::text')}"
+            file_condition = f"AND {_subtree_condition('relative_path', '$3::text')}"
+        # Путь ветви передается, только если он используется в условии
+        args = (resource_id, scan_run_s) + ((branch_path,) if branch_path else ())
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # Удаления записываются в историю изменений этого запуска
+                await conn.execute("SELECT set_config('scanner.scan_run_s', $1, true)", str(scan_run_s))
+                await conn.execute(f"""
+                    UPDATE directory SET is_actual = FALSE
+                    WHERE information_resource_s = $1
+                    AND is_actual = TRUE
+                    AND (last_seen_scan_run_s IS NULL OR last_seen_scan_run_s < $2)
+                    {directory_condition}
+                """, *args)
+                await conn.execute(f"""
+                    UPDATE file SET is_actual = FALSE
+                    WHERE information_resource_s = $1
+                    AND is_actual = TRUE
+                    AND (last_seen_scan_run_s IS NULL OR last_seen_scan_run_s < $2)
+                    {file_condition}
+                """, *args)
+                await conn.execute("""
+                    DELETE FROM scan_checkpoint c
+                    USING scan_run sr
+                    WHERE sr.scan_run_s = c.scan_run_s
+                    AND c.information_resource_s = $1
+                    AND c.scan_run_s <= $2
+                    AND ($3::text IS NULL OR sr.branch_path = $3::text)
+                """, resource_id, scan_run_s, branch_path)
+
+    async def get_directory_id(self, resource_id: int, full_path: str) -> Optional[int]:
+        """ID актуального каталога ресурса по полному пути ("<relative_path>/<name>")"""
+        return await self._call('fetchval', """
+            SELECT directory_s
+            FROM directory
+            WHERE information_resource_s = $1
+            AND full_path COLLATE "C" = $2
+            AND is_actual = TRUE
+        """, resource_id, full_path)
+
+    async def save_directories_bulk(self, directories: DirectoryBatch, path_to_id: Dict[str, int]) -> None:
+        """
+        Пакетное сохранение директорий одним запросом (массивы-параметры, unnest).
+        ID сохраненных директорий добавляются в path_to_id по ключу "<relative_path>/<name>"
+        """
+        if not len(directories):
+            return
+
+        try:
+            results = await self._call('fetch', DIRECTORY_UNNEST_INSERT, *directory_batch_params(directories))
+            for id, rel_path, name in results:
+                path_to_id[f"{rel_path}/{name}"] = id
+            self.metrics.add('db_rows', len(directories))
+            logger.debug(f"Saved {len(directories)} directories")
+
+        except Exception as e:
+            logger.error(f"Error saving directories: {str(e)}")
+            raise
+
+    async def save_files_bulk(self, files: FileBatch) -> None:
+        """Пакетное сохранение файлов одним запросом"""
+        if not len(files):
+            return
+
+        try:
+            await self._call('execute', FILE_UNNEST_INSERT, *file_batch_params(files))
+            self.metrics.add('db_rows', len(files))
+            logger.debug(f"Saved {len(files)} files")
+
+        except Exception as e:
+            logger.error(f"Error saving files: {str(e)}")
+            raise
+
+    async def get_resource_stats(self, resource_id: int) -> Tuple[int, int, int]:
+        """
+        Получение статистики по ресурсу:
+        возвращает (количество директорий, количество файлов, общий размер файлов)
+        """
+        try:
+            row = await self._call('fetchrow', """
+                SELECT
+                    (SELECT COUNT(*)
+                     FROM directory
+                     WHERE information_resource_s = $1
+                     AND is_actual = TRUE),
+                    COUNT(*),
+                    COALESCE(SUM(size_bytes), 0)
+                FROM file
+                WHERE information_resource_s = $1
+                AND is_actual = TRUE
+            """, resource_id)
+            return tuple(row) if row else (0, 0, 0)
+
+        except Exception as e:
+            logger.error(f"Error getting resource stats: {str(e)}")
+            return (0, 0, 0)
+
+    async def get_subtree_stats(self, resource_id: int, branch_path: str) -> Tuple[int, int, int]:
+        """
+        Статистика поддерева каталога branch_path (включая сам каталог):
+        возвращает (количество директорий, количество файлов, общий размер файлов)
+        """
+        try:
+            row = await self._call('fetchrow', f"""
+                SELECT
+                    (SELECT COUNT(*)
+                     FROM directory
+                     WHERE information_resource_s = $1
+                     AND is_actual = TRUE
+                     AND {_subtree_condition('full_path', '$2::text')}),
+                    COUNT(*),
+                    COALESCE(SUM(size_bytes), 0)
+                FROM file
+                WHERE information_resource_s = $1
+                AND is_actual = TRUE
+                AND {_subtree_condition('relative_path', '$2::text')}
+            """, resource_id, branch_path)
+            return tuple(row)
+
+        except Exception as e:
+            logger.error(f"Error getting subtree stats: {str(e)}")
+            return (0, 0, 0)
+
+    async def start_scan_run(self, resource_id: int, scan_mode: str, scheduled_time: Optional[datetime] = None,
+                             branch_path: Optional[str] = None) -> int:
+        """
+        Регистрация запуска сканирования, возвращает scan_run_s
+        scheduled_time - время постановки задания в очередь планировщиком
+        branch_path - полный путь корневого каталога сканируемой ветви (None - весь ресурс)
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    scan_run_s = await conn.fetchval("""
+                        INSERT INTO scan_run (information_resource_s, scan_mode, status, start_time, scheduled_time,
+                                              branch_path)
+                        VALUES ($1, $2, 'running', $3, $4, $5)
+                        RETURNING scan_run_s
+                    """, resource_id, scan_mode, datetime.now(), scheduled_time, branch_path)
+                    # Секции истории изменений, в которые пишет запуск
+                    await conn.execute("CALL ensure_history_partitions($1)", scan_run_s)
+            return scan_run_s
+
+        except Exception as e:
+            logger.error(f"Error starting scan run: {str(e)}")
+            raise
+
+    async def finish_scan_run(self, scan_run_s: int, result: ScanResult) -> None:
+        """Фиксация итогов запуска сканирования"""
+        try:
+            await self._call('execute', """
+                UPDATE scan_run
+                SET status = $1,
+                    end_time = $2,
+                    total_directories = $3,
+                    total_files = $4,
+                    total_size = $5,
+                    error_count = $6,
+                    metrics = $7::jsonb
+                WHERE scan_run_s = $8
+            """,
+                'failed' if result.errors else 'completed',
+                result.end_time,
+                result.total_directories,
+                result.total_files,
+                result.total_size,
+                len(result.errors),
+                json.dumps(result.metrics, ensure_ascii=False) if result.metrics is not None else None,
+                scan_run_s
+            )
+
+        except Exception as e:
+            logger.error(f"Error finishing scan run: {str(e)}")
+            raise
@@ -0,0 +1,371 @@
+# scanner/async_scanner.py
+
+import asyncio
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional, Set
+from .models import InformationResource, FileBatch, DirectoryBatch, ScanResult
+from .async_database import AsyncDatabase
+from .scanner import FilesystemScanner, branch_path
+from .path_index import create_path_index
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncFilesystemScanner(FilesystemScanner):
+    """
+    Асинхронный вариант полного сканирования (asyncio) для сетевых ресурсов с большой задержкой
+    обращений к метаданным: одновременно читаются до max_in_flight каталогов (чтение выполняется
+    в пуле потоков, os.scandir блокирующий), запись в БД выполняется через пул соединений AsyncDatabase.
+    Записи пакетов формируются методами FilesystemScanner, поэтому строки directory/file и ScanResult
+    совпадают с результатом синхронного полного сканирования (инкрементальный режим не поддерживается).
+
+    Порядок записи: подкаталог ставится в очередь обхода после того, как содержимое родителя
+    добавлено в пакеты, а пакет директорий сохраняется до обработки каталога, ID которого еще
+    неизвестен, так что родительская запись directory всегда фиксируется раньше дочерних.
+    Пакеты директорий сохраняются по очереди (их ID нужны дочерним элементам),
+    пакеты файлов - параллельно, не более pool_size одновременно
+    """
+
+    def __init__(self, db: AsyncDatabase, batch_size: int = 5000, max_in_flight: int = 64,
+                 queue_depth: int = 0, pool_size: int = 4, path_index_limit: int = 0):
+        """
+        max_in_flight - число одновременно читаемых каталогов (и потоков чтения)
+        queue_depth - число прочитанных каталогов, ожидающих записи в БД (0 - 2 * max_in_flight)
+        pool_size - число пакетов файлов, записываемых одновременно (не больше размера пула соединений)
+        """
+        super().__init__(db, batch_size=batch_size, path_index_limit=path_index_limit)
+        self.max_in_flight = max(1, max_in_flight)
+        self.queue_depth = queue_depth if queue_depth > 0 else 2 * self.max_in_flight
+        self.pool_size = max(1, pool_size)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._write_slots: Optional[asyncio.Semaphore] = None
+        # Выполняемые записи пакетов файлов и первая ошибка завершившейся записи
+        self._file_writes: Set[asyncio.Task] = set()
+        self._write_error: Optional[BaseException] = None
+
+    async def _write_directories(self) -> None:
+        """Сохранение накопленных директорий в БД и получение их ID (фаза flush_directories)"""
+        batch = self.directories
+        if not len(batch):
+            return
+        self.directories = DirectoryBatch(batch.information_resource_s, batch.first_discovered, batch.scan_run_s)
+        with self.metrics.timer('flush_directories'):
+            batch.parent_directory_s = self._resolve_directory_ids(batch.relative_path)
+            await self.db.save_directories_bulk(batch, self.path_to_dir_id)
+
+    async def _write_files(self) -> None:
+        """
+        Передача накопленных файлов на запись в БД в отдельной задаче.
+        Сначала сохраняются директории: после этого ID завершенных каталогов не нужны ни
+        подкаталогам, ни файлам пакета и удаляются из индекса
+        """
+        batch = self.files
+        if not len(batch):
+            return
+        await self._write_directories()
+        self._check_file_writes()
+        await self._write_slots.acquire()
+        self.files = FileBatch(batch.information_resource_s, batch.first_discovered, batch.scan_run_s)
+        batch.directory_s = self._resolve_directory_ids(batch.relative_path)
+        task = asyncio.create_task(self._save_files(batch))
+        self._file_writes.add(task)
+        task.add_done_callback(self._file_write_done)
+        self._release_finished_directories()
+
+    async def _save_files(self, batch: FileBatch) -> None:
+        """Запись пакета файлов (фаза flush_files)"""
+        try:
+            with self.metrics.timer('flush_files'):
+                await self.db.save_files_bulk(batch)
+        finally:
+            self._write_slots.release()
+
+    def _file_write_done(self, task: asyncio.Task) -> None:
+        self._file_writes.discard(task)
+        if not task.cancelled() and task.exception() is not None and self._write_error is None:
+            self._write_error = task.exception()
+
+    def _check_file_writes(self) -> None:
+        """Ошибка завершившейся записи пакета файлов прерывает сканирование"""
+        if self._write_error is not None:
+            raise self._write_error
+
+    async def _wait_file_writes(self) -> None:
+        """Ожидание завершения всех записей пакетов файлов"""
+        if self._file_writes:
+            await asyncio.gather(*self._file_writes, return_exceptions=True)
+        self._check_file_writes()
+
+    async def _walk_worker(self, tasks: asyncio.Queue, segments: asyncio.Queue) -> None:
+        """
+        Задача обхода: берет каталоги из общей очереди, читает их в пуле потоков
+        и передает содержимое в очередь записи (при ее заполнении ожидает освобождения места)
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            dir_path = await tasks.get()
+            if dir_path is None:
+                break
+            try:
+                dirs, files, errors, syscalls, _ = await loop.run_in_executor(
+                    self._executor, self._list_directory, dir_path)
+                segment = (dir_path, dirs, files, errors, syscalls, None)
+            except Exception as e:
+                segment = (dir_path, [], [], [], 1, e)
+            await segments.put(segment)
+
+    def _process_segment(self, resource: InformationResource, dirpath: str, dirs: list, files: list,
+                         entry_errors: list, errors: list):
+        """
+        Добавление содержимого одного каталога в пакеты (без записи в БД)
+        Возвращает (количество директорий, количество файлов, общий размер файлов)
+        """
+        total_directories = 0
+        total_files = 0
+        total_size = 0
+
+        for error_msg in entry_errors:
+            logger.error(error_msg)
+            errors.append(error_msg)
+
+        for dirname, dir_stat, _ in dirs:
+            try:
+                self._append_directory(resource, dirpath, dirname, dir_stat)
+                total_directories += 1
+            except Exception as e:
+                error_msg = f"Error processing directory {dirname}: {str(e)}"
+                logger.error(error_msg)
+                errors.append(error_msg)
+
+        for filename, file_stat in files:
+            try:
+                total_size += self._append_file(resource, dirpath, filename, file_stat)
+                total_files += 1
+            except Exception as e:
+                error_msg = f"Error processing file {filename}: {str(e)}"
+                logger.error(error_msg)
+                errors.append(error_msg)
+
+        self._finished_dirs.append(self._directory_context(resource, dirpath)[0])
+        return total_directories, total_files, total_size
+
+    async def _scan_concurrent(self, resource: InformationResource, errors: list):
+        """
+        Обход дерева каталогов max_in_flight задачами с общей очередью заданий.
+        Текущая задача принимает прочитанные каталоги, формирует пакеты и ставит в очередь
+        обхода подкаталоги (как _scan_parallel с потоками)
+        Возвращает (количество директорий, количество файлов, общий размер файлов)
+        """
+        total_directories = 0
+        total_files = 0
+        total_size = 0
+
+        tasks = asyncio.Queue()
+        segments = asyncio.Queue(maxsize=self.queue_depth)
+        workers = [asyncio.create_task(self._walk_worker(tasks, segments)) for _ in range(self.max_in_flight)]
+
+        tasks.put_nowait(self.walk_root)
+        pending = 1
+        try:
+            while pending:
+                dirpath, dirs, files, entry_errors, syscalls, list_error = await segments.get()
+                pending -= 1
+                self.syscalls += syscalls
+                self._check_file_writes()
+
+                if list_error is not None:
+                    error_msg = f"Error reading directory {dirpath}: {str(list_error)}"
+                    logger.error(error_msg)
+                    errors.append(error_msg)
+                    continue
+
+                # Элементы каталога ссылаются на его ID: сохраняем ожидающие директории, если ID еще неизвестен
+                if self.path_to_dir_id.get(self._directory_context(resource, dirpath)[0]) is None:
+                    await self._write_directories()
+
+                directories, files_count, size = self._process_segment(
+                    resource, dirpath, dirs, files, entry_errors, errors)
+                total_directories += directories
+                total_files += files_count
+                total_size += size
+
+                if len(self.directories) >= self.batch_size:
+                    await self._write_directories()
+                if len(self.files) >= self.batch_size:
+                    await self._write_files()
+
+                # Символические ссылки на каталоги не обходим (как os.walk по умолчанию)
+                for dirname, _, is_symlink in dirs:
+                    if not is_symlink:
+                        tasks.put_nowait(os.path.join(dirpath, dirname))
+                        pending += 1
+
+            await self._write_directories()
+            await self._write_files()
+            await self._wait_file_writes()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        return total_directories, total_files, total_size
+
+    async def scan_resource(self, resource: InformationResource, scan_run_s: Optional[int] = None,
+                            branch: Optional[str] = None) -> ScanResult:
+        """
+        Сканирование информационного ресурса (корутина, аналог FilesystemScanner.scan_resource)
+        scan_run_s - ID запуска сканирования
+        branch - путь ветви относительно корневого каталога ресурса (сканируется только ее поддерево;
+                 родительский каталог ветви должен быть сохранен предыдущим сканированием)
+        """
+        start_time = datetime.now()
+        total_directories = 0
+        total_files = 0
+        total_size = 0
+        errors = []
+        self.syscalls = 0
+        self.resource_id = resource.information_resource_s
+        self.scan_run_s = scan_run_s
+        self.discovered_at = time.time_ns() // 1000
+        self._dir_context = ('', '', 0)
+        self._new_batches(resource)
+        self.path_to_dir_id = create_path_index(self.path_index_limit)
+        self._finished_dirs = []
+        self._file_writes = set()
+        self._write_error = None
+        self._write_slots = asyncio.Semaphore(self.pool_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='scandir')
+
+        try:
+            self.root_path = os.path.join(resource.path, resource.name)
+            root_key = branch_path(resource, branch)
+            if root_key is None:
+                self.walk_root = self.root_path
+                root_parent, root_name = resource.path, resource.name
+            else:
+                self.walk_root = os.path.normpath(os.path.join(self.root_path, branch))
+                root_parent, root_name = os.path.split(self.walk_root)
+                # Ссылка корня ветви на родительский каталог из ранее сохраненного дерева
+                parent_key = os.path.dirname(root_key)
+                parent_id = await self.db.get_directory_id(resource.information_resource_s, parent_key)
+                if parent_id is None:
+                    raise ValueError(f"Parent directory {parent_key} of branch is not scanned")
+                self.path_to_dir_id[parent_key] = parent_id
+            root_stat = await asyncio.get_running_loop().run_in_executor(self._executor, os.stat, self.walk_root)
+            self.syscalls += 1
+
+            self._append_directory(resource, root_parent, root_name, root_stat)
+            await self._write_directories()
+            total_directories += 1
+
+            directories, files, size = await self._scan_concurrent(resource, errors)
+            total_directories += directories
+            total_files += files
+            total_size += size
+            self.metrics.add('directories', total_directories)
+            self.metrics.add('files', total_files)
+            self.metrics.add('bytes', total_size)
+            self.metrics.add('syscalls', self.syscalls)
+
+            end_time = datetime.now()
+
+            return ScanResult(
+                total_directories=total_directories,
+                total_files=total_files,
+                total_size=total_size,
+                start_time=start_time,
+                end_time=end_time,
+                errors=errors,
+                syscalls=self.syscalls
+            )
+
+        except Exception as e:
+            end_time = datetime.now()
+            error_msg = f"Error scanning resource: {str(e)}"
+            logger.error(error_msg)
+            errors.append(error_msg)
+
+            return ScanResult(
+                total_directories=total_directories,
+                total_files=total_files,
+                total_size=total_size,
+                start_time=start_time,
+                end_time=end_time,
+                errors=errors,
+                syscalls=self.syscalls,
+                interrupted=True
+            )
+        finally:
+            # Записи пакетов файлов, не дождавшиеся ошибки сканирования, отменяются
+            for task in list(self._file_writes):
+                task.cancel()
+            await asyncio.gather(*self._file_writes, return_exceptions=True)
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self.path_to_dir_id.close()
+
+
+async def run_scan_async(db: AsyncDatabase, scanner: AsyncFilesystemScanner, resource: InformationResource,
+                         scheduled_time: Optional[datetime] = None, branch: Optional[str] = None) -> ScanResult:
+    """
+    Сканирование одного информационного ресурса с регистрацией запуска в scan_run
+    (аналог scheduler.run_scan для AsyncFilesystemScanner)
+    branch - путь ветви относительно корневого каталога ресурса (None - весь ресурс)
+    Метрики этапов (db.metrics) измеряются заново и сохраняются в scan_run.metrics
+    """
+    start_time = datetime.now()
+    errors = []
+    scan_run_s = None
+    scan_result = None
+    db.metrics.reset()
+
+    try:
+        branch_key = branch_path(resource, branch)
+
+        # Регистрируем запуск сканирования
+        scan_run_s = await db.start_scan_run(resource.information_resource_s, 'full', scheduled_time, branch_key)
+
+        # Сканируем ресурс
+        scan_result = await scanner.scan_resource(resource, scan_run_s, branch)
+
+        if scan_result.interrupted:
+            errors.extend(scan_result.errors[-1:])
+        else:
+            # Не встреченные запуском записи помечаем неактуальными
+            await db.finalize_scan(resource.information_resource_s, scan_run_s, branch_key)
+
+        # Получаем статистику
+        if branch_key:
+            stats = await db.get_subtree_stats(resource.information_resource_s, branch_key)
+        else:
+            stats = await db.get_resource_stats(resource.information_resource_s)
+
+    except Exception as e:
+        error_msg = f"Error scanning resource {resource.information_resource_s}: {str(e)}"
+        logger.error(error_msg)
+        errors.append(error_msg)
+        stats = (0, 0, 0)  # directories, files, total_size
+
+    end_time = datetime.now()
+
+    result = ScanResult(
+        total_directories=stats[0],
+        total_files=stats[1],
+        total_size=stats[2],
+        start_time=start_time,
+        end_time=end_time,
+        errors=errors,
+        syscalls=scan_result.syscalls if scan_result else 0,
+        metrics=db.metrics.to_dict()
+    )
+
+    if scan_run_s is not None:
+        try:
+            await db.finish_scan_run(scan_run_s, result)
+        except Exception as e:
+            logger.error(f"Error finishing scan run {scan_run_s}: {str(e)}")
+
+    return result
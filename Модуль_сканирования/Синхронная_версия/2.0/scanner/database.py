@@ -1,163 +1,686 @@
 # scanner/database.py
 
+import io
 import logging
-from typing import List, Tuple, Dict
+import time
+from datetime import datetime, timedelta
+from typing import List, Tuple, Dict, Optional
 import psycopg2
-from psycopg2.extras import execute_values
-from .models import DirectoryItem, FileItem
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2.extras import execute_values, Json
+from .models import AnalysisResult, DirectoryBatch, FileBatch, NsiDictionaryChange, ScanCheckpoint, ScanResult
+from .metrics import ScanMetrics
 
 logger = logging.getLogger(__name__)
 
+# Способы пакетной загрузки: execute_values с фиксацией каждого пакета,
+# подготовленный на сервере запрос с массивами-параметрами (unnest) с фиксацией каждого пакета
+# или COPY во временную staging-таблицу со слиянием одним запросом и фиксацией по этапу сканирования
+LOADERS = ('values', 'prepared', 'copy')
+
+# Пауза перед первым повтором операции после разрыва соединения, секунды (удваивается с каждым повтором)
+RETRY_DELAY = 0.5
+
+DIRECTORY_COLUMNS = """
+    information_resource_s,
+    parent_directory_s,
+    name,
+    relative_path,
+    nesting_level,
+    first_discovered,
+    owner,
+    is_actual,
+    modification_time,
+    last_seen_scan_run_s
+"""
+
+DIRECTORY_UPSERT = """
+    ON CONFLICT (information_resource_s, relative_path, name)
+    DO UPDATE SET
+        is_actual = EXCLUDED.is_actual,
+        owner = EXCLUDED.owner,
+        modification_time = EXCLUDED.modification_time,
+        last_seen_scan_run_s = EXCLUDED.last_seen_scan_run_s
+    RETURNING directory_s, relative_path, name
+"""
+
+# Метки времени передаются из пакетов в микросекундах от эпохи и преобразуются на стороне сервера
+DIRECTORY_EPOCH_COLUMNS = ('first_discovered', 'modification_time')
+
+FILE_COLUMNS = """
+    information_resource_s,
+    directory_s,
+    name,
+    relative_path,
+    extension,
+    size_bytes,
+    creation_time,
+    modification_time,
+    first_discovered,
+    owner,
+    is_actual,
+    nesting_level,
+    last_seen_scan_run_s
+"""
+
+FILE_UPSERT = """
+    ON CONFLICT (information_resource_s, relative_path, name)
+    DO UPDATE SET
+        is_actual = EXCLUDED.is_actual,
+        -- Хеш сохраняется, пока не изменились размер и время изменения файла. У вновь появившегося
+        -- файла хеш сбрасывается: его ключ попадает в пересчет групп дубликатов при повторном хешировании
+        md5_hash = CASE
+            WHEN NOT file.is_actual
+              OR file.size_bytes IS DISTINCT FROM EXCLUDED.size_bytes
+              OR file.modification_time IS DISTINCT FROM EXCLUDED.modification_time
+            THEN NULL
+            ELSE file.md5_hash
+        END,
+        partial_md5_hash = CASE
+            WHEN NOT file.is_actual
+              OR file.size_bytes IS DISTINCT FROM EXCLUDED.size_bytes
+              OR file.modification_time IS DISTINCT FROM EXCLUDED.modification_time
+            THEN NULL
+            ELSE file.partial_md5_hash
+        END,
+        size_bytes = EXCLUDED.size_bytes,
+        modification_time = EXCLUDED.modification_time,
+        owner = EXCLUDED.owner,
+        extension = EXCLUDED.extension,
+        last_seen_scan_run_s = EXCLUDED.last_seen_scan_run_s
+"""
+
+FILE_RETURNING = "RETURNING file_s, relative_path, name"
+
+FILE_EPOCH_COLUMNS = ('creation_time', 'modification_time', 'first_discovered')
+
+
+def _row_expressions(columns: str, epoch_columns: Tuple[str, ...], from_stage: bool = False) -> str:
+    """
+    Выражения значений строки для INSERT: параметры execute_values (%s) или столбцы staging-таблицы;
+    метки времени (микросекунды от эпохи) преобразуются в TIMESTAMP часового пояса сессии
+    """
+    expressions = []
+    for column in (c.strip() for c in columns.split(',')):
+        value = column if from_stage else '%s'
+        if column in epoch_columns:
+            value = f"to_timestamp({value} / 1000000.0)::timestamp"
+        expressions.append(value)
+    return ', '.join(expressions)
+
+
+DIRECTORY_TEMPLATE = f"({_row_expressions(DIRECTORY_COLUMNS, DIRECTORY_EPOCH_COLUMNS)})"
+DIRECTORY_STAGE_SELECT = _row_expressions(DIRECTORY_COLUMNS, DIRECTORY_EPOCH_COLUMNS, from_stage=True)
+FILE_TEMPLATE = f"({_row_expressions(FILE_COLUMNS, FILE_EPOCH_COLUMNS)})"
+FILE_STAGE_SELECT = _row_expressions(FILE_COLUMNS, FILE_EPOCH_COLUMNS, from_stage=True)
+
+# Пакет передается одним запросом: столбцы пакета - массивы-параметры, строки собираются через unnest.
+# Общие для пакета значения (ресурс, время обнаружения, запуск) передаются скалярными параметрами,
+# метки времени (микросекунды от эпохи) преобразуются так же, как в _row_expressions
+DIRECTORY_UNNEST_INSERT = f"""
+    INSERT INTO directory ({DIRECTORY_COLUMNS})
+    SELECT $1::integer, u.parent_directory_s, u.name, u.relative_path, u.nesting_level,
+           to_timestamp($2::bigint / 1000000.0)::timestamp, u.owner, TRUE,
+           to_timestamp(u.modification_time / 1000000.0)::timestamp, $9::integer
+    FROM unnest($3::integer[], $4::text[], $5::text[], $6::integer[], $7::text[], $8::bigint[])
+        AS u(parent_directory_s, name, relative_path, nesting_level, owner, modification_time)
+    {DIRECTORY_UPSERT}
+"""
+
+DIRECTORY_PARAMETER_TYPES = ('integer', 'bigint', 'integer[]', 'text[]', 'text[]', 'integer[]', 'text[]',
+                             'bigint[]', 'integer')
+
+FILE_UNNEST_INSERT = f"""
+    INSERT INTO file ({FILE_COLUMNS})
+    SELECT $1::integer, u.directory_s, u.name, u.relative_path, u.extension, u.size_bytes,
+           to_timestamp(u.creation_time / 1000000.0)::timestamp,
+           to_timestamp(u.modification_time / 1000000.0)::timestamp,
+           to_timestamp($2::bigint / 1000000.0)::timestamp, u.owner, TRUE, u.nesting_level, $12::integer
+    FROM unnest($3::integer[], $4::text[], $5::text[], $6::text[], $7::bigint[], $8::bigint[], $9::bigint[],
+                $10::text[], $11::integer[])
+        AS u(directory_s, name, relative_path, extension, size_bytes, creation_time, modification_time,
+             owner, nesting_level)
+    {FILE_UPSERT}
+"""
+
+FILE_PARAMETER_TYPES = ('integer', 'bigint', 'integer[]', 'text[]', 'text[]', 'text[]', 'bigint[]', 'bigint[]',
+                        'bigint[]', 'text[]', 'integer[]', 'integer')
+
+
+def directory_batch_params(directories: DirectoryBatch) -> tuple:
+    """Параметры DIRECTORY_UNNEST_INSERT: общие значения пакета и его столбцы"""
+    return (directories.information_resource_s, directories.first_discovered,
+            directories.parent_directory_s, directories.name, directories.relative_path,
+            directories.nesting_level, directories.owner, list(directories.modification_time),
+            directories.scan_run_s)
+
+
+def file_batch_params(files: FileBatch) -> tuple:
+    """Параметры FILE_UNNEST_INSERT: общие значения пакета и его столбцы"""
+    return (files.information_resource_s, files.first_discovered,
+            files.directory_s, files.name, files.relative_path, files.extension,
+            list(files.size_bytes), list(files.creation_time), list(files.modification_time),
+            files.owner, files.nesting_level, files.scan_run_s)
+
+
+# Время изменения в микросекундах от эпохи (обратное преобразование к _row_expressions)
+EPOCH_MODIFICATION_TIME = "(EXTRACT(EPOCH FROM modification_time::timestamptz) * 1000000)::bigint"
+
+
+def _subtree_condition(column: str, path: str) -> str:
+    """
+    Условие принадлежности поддереву каталога с полным путем path (SQL-выражение):
+    column - full_path каталога или relative_path файла. Диапазон по материализованному пути
+    использует индексы idx_directory_full_path/idx_file_relative_path (символ '0' следует за '/')
+    """
+    return (f"({column} COLLATE \"C\" = {path} "
+            f"OR ({column} COLLATE \"C\" >= {path} || '/' AND {column} COLLATE \"C\" < {path} || '0'))")
+
+
+# Запросы, подготавливаемые на сервере (PREPARE) при первом выполнении в соединении:
+# имя -> (типы параметров, текст запроса с параметрами $n)
+PREPARED_STATEMENTS = {
+    'directory_upsert': (DIRECTORY_PARAMETER_TYPES, DIRECTORY_UNNEST_INSERT),
+    'file_upsert': (FILE_PARAMETER_TYPES, FILE_UNNEST_INSERT),
+    'file_upsert_returning': (FILE_PARAMETER_TYPES, f"{FILE_UNNEST_INSERT} {FILE_RETURNING}"),
+    'resource_stats': (('integer',), """
+        SELECT
+            (SELECT COUNT(*)
+             FROM directory
+             WHERE information_resource_s = $1
+             AND is_actual = TRUE),
+            COUNT(*),
+            COALESCE(SUM(size_bytes), 0)
+        FROM file
+        WHERE information_resource_s = $1
+        AND is_actual = TRUE
+    """),
+    'subtree_stats': (('integer', 'text'), f"""
+        SELECT
+            (SELECT COUNT(*)
+             FROM directory
+             WHERE information_resource_s = $1
+             AND is_actual = TRUE
+             AND {_subtree_condition('full_path', '$2')}),
+            COUNT(*),
+            COALESCE(SUM(size_bytes), 0)
+        FROM file
+        WHERE information_resource_s = $1
+        AND is_actual = TRUE
+        AND {_subtree_condition('relative_path', '$2')}
+    """),
+    # Завершение сканирования всего ресурса и ветви $3 - отдельные запросы: в общем (generic) плане
+    # подготовленного запроса условие "$3 IS NULL OR ..." не упрощается и диапазон пути не использует индекс
+    'finalize_directories': (('integer', 'integer'), """
+        UPDATE directory SET is_actual = FALSE
+        WHERE information_resource_s = $1
+        AND is_actual = TRUE
+        AND (last_seen_scan_run_s IS NULL OR last_seen_scan_run_s < $2)
+    """),
+    'finalize_branch_directories': (('integer', 'integer', 'text'), f"""
+        UPDATE directory SET is_actual = FALSE
+        WHERE information_resource_s = $1
+        AND is_actual = TRUE
+        AND (last_seen_scan_run_s IS NULL OR last_seen_scan_run_s < $2)
+        AND {_subtree_condition('full_path', '$3')}
+    """),
+    'finalize_files': (('integer', 'integer'), """
+        UPDATE file SET is_actual = FALSE
+        WHERE information_resource_s = $1
+        AND is_actual = TRUE
+        AND (last_seen_scan_run_s IS NULL OR last_seen_scan_run_s < $2)
+    """),
+    'finalize_branch_files': (('integer', 'integer', 'text'), f"""
+        UPDATE file SET is_actual = FALSE
+        WHERE information_resource_s = $1
+        AND is_actual = TRUE
+        AND (last_seen_scan_run_s IS NULL OR last_seen_scan_run_s < $2)
+        AND {_subtree_condition('relative_path', '$3')}
+    """),
+    # Полное сканирование ресурса делает неактуальными и контрольные точки ветвей
+    'finalize_checkpoints': (('integer', 'integer'), """
+        DELETE FROM scan_checkpoint
+        WHERE information_resource_s = $1
+        AND scan_run_s <= $2
+    """),
+    'finalize_branch_checkpoints': (('integer', 'integer', 'text'), """
+        DELETE FROM scan_checkpoint c
+        USING scan_run sr
+        WHERE sr.scan_run_s = c.scan_run_s
+        AND c.information_resource_s = $1
+        AND c.scan_run_s <= $2
+        AND sr.branch_path = $3
+    """),
+}
+
+
+# Временные таблицы загрузки выгрузки НСИ (сливаются процедурой nsi_apply_stage модуля интеграции с НСИ)
+NSI_STAGE_TABLES = {
+    '_nsi_stage_dictionary': (('line_no', 'BIGINT'), ('code', 'TEXT'), ('name', 'TEXT'), ('description', 'TEXT')),
+    '_nsi_stage_data': (('line_no', 'BIGINT'), ('dictionary_code', 'TEXT'), ('entity_id', 'TEXT'),
+                        ('entity_name', 'TEXT'), ('types', 'JSONB'), ('attributes', 'JSONB')),
+    '_nsi_stage_link': (('dictionary_code', 'TEXT'), ('entity_id', 'TEXT'), ('dependent_dictionary_code', 'TEXT'),
+                        ('dependent_entity_id', 'TEXT')),
+}
+
+
+def _csv_value(value) -> str:
+    """Представление значения для COPY ... (FORMAT csv): пустое поле без кавычек - NULL"""
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+
+class MeteredCursor(psycopg2.extensions.cursor):
+    """
+    Курсор с учетом обращений к серверу в метриках соединения: каждый execute (в том числе
+    страницы execute_values) и COPY - одно обращение; fetch - разбор уже полученного результата
+    """
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self.connection.metrics.observe('db_execute', time.perf_counter() - start)
+            self.connection.metrics.add('db_round_trips')
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            self.connection.metrics.observe('db_copy', time.perf_counter() - start)
+            self.connection.metrics.add('db_round_trips')
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self.connection.metrics.observe('db_fetch', time.perf_counter() - start)
+
+
+class MeteredConnection(psycopg2.extensions.connection):
+    """
+    Соединение, учитывающее фиксации транзакций в метриках (metrics задается после подключения).
+    prepared - имена запросов, подготовленных в сессии соединения (сохраняются при возврате в пул)
+    """
+    metrics: ScanMetrics
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            self.metrics.observe('db_commit', time.perf_counter() - start)
+            self.metrics.add('db_round_trips')
+
+
 class Database:
-    def __init__(self, host: str, port: int, database: str, user: str, password: str):
-        """Инициализация подключения к базе данных"""
-        self.conn = psycopg2.connect(
-            host=host,
-            port=port,
-            database=database,
-            user=user,
-            password=password
+    def __init__(self, host: str, port: int, database: str, user: str, password: str,
+                 loader: str = 'values', metrics: Optional[ScanMetrics] = None, pool_size: int = 1,
+                 retries: int = 3, pool: Optional[psycopg2.pool.ThreadedConnectionPool] = None):
+        """
+        Инициализация подключения к базе данных: соединение берется из пула соединений
+        metrics - метрики, общие для сканера и калькулятора хешей процесса (по умолчанию - новые)
+        pool_size - размер пула (соединение подключения и сессии session() для записи из других потоков)
+        retries - число повторов операции на новом соединении после разрыва соединения с сервером
+        pool - пул другого подключения (для session()), по умолчанию создается собственный
+        """
+        if loader not in LOADERS:
+            raise ValueError(f"Unknown loader: {loader}")
+        self.metrics = metrics or ScanMetrics()
+        self._params = dict(host=host, port=port, database=database, user=user, password=password)
+        self.pool_size = max(1, pool_size)
+        self.retries = max(0, retries)
+        self._own_pool = pool is None
+        self.pool = pool or psycopg2.pool.ThreadedConnectionPool(
+            1, self.pool_size,
+            **self._params,
+            connection_factory=MeteredConnection,
+            cursor_factory=MeteredCursor
         )
+        self.loader = loader
+        # При загрузке через COPY транзакция фиксируется по завершении этапа сканирования (commit)
+        self.commit_per_batch = loader != 'copy'
+        self.conn: Optional[MeteredConnection] = None
+        self._connect()
+        if self._own_pool:
+            logger.info(f"Database connection established (loader: {loader}, pool size: {self.pool_size})")
+
+    def session(self) -> 'Database':
+        """
+        Отдельное соединение из пула этого подключения с тем же загрузчиком и общими метриками
+        (для записи из другого потока); закрывается close(), пул остается у исходного подключения
+        """
+        return Database(**self._params, loader=self.loader, metrics=self.metrics, pool_size=self.pool_size,
+                        retries=self.retries, pool=self.pool)
+
+    def _connect(self) -> None:
+        """Получение соединения из пула и подготовка сессии (staging-таблицы загрузки через COPY)"""
+        self.conn = self.pool.getconn()
+        self.conn.metrics = self.metrics
         self.conn.autocommit = False
-        logger.info("Database connection established")
+        if self.loader == 'copy':
+            self._create_stage_tables()
+
+    def _run(self, operation, retry: bool = True):
+        """
+        Выполнение operation(cur) с курсором текущего соединения, возвращает ее результат.
+        При разрыве соединения (ошибка подключения, после которой соединение закрыто) и retry
+        операция повторяется до retries раз на новом соединении из пула с удваивающейся паузой.
+        Повторяется только сама операция, поэтому она должна фиксировать свою транзакцию и быть
+        идемпотентной (пакеты сохраняются через upsert)
+        """
+        attempt = 0
+        while True:
+            try:
+                if self.conn is None:
+                    self._connect()
+                with self.conn.cursor() as cur:
+                    return operation(cur)
+
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                lost = self.conn is None or self.conn.closed
+                if not retry or not lost or attempt >= self.retries:
+                    raise
+                attempt += 1
+                logger.warning(f"Database connection lost ({str(e).strip()}), retry {attempt} of {self.retries}")
+                self.metrics.add('db_retries')
+                if self.conn is not None:
+                    self.pool.putconn(self.conn, close=True)
+                    self.conn = None
+                time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+
+    def _rollback(self) -> None:
+        """Откат транзакции после ошибки (если соединение не разорвано)"""
+        if self.conn is not None and not self.conn.closed:
+            self.conn.rollback()
+
+    def _execute_prepared(self, cur, name: str, params: tuple) -> None:
+        """
+        Выполнение запроса PREPARED_STATEMENTS[name]: при первом выполнении в соединении запрос
+        подготавливается на сервере (PREPARE), далее передаются только параметры (EXECUTE)
+        """
+        types, query = PREPARED_STATEMENTS[name]
+        if name not in self.conn.prepared:
+            cur.execute(f"PREPARE {name} ({', '.join(types)}) AS {query}")
+            self.conn.prepared.add(name)
+        # Явные приведения: массив из одних NULL передается как text[]
+        cur.execute(f"EXECUTE {name} ({', '.join(f'%s::{t}' for t in types)})", params)
+
+    @staticmethod
+    def _set_history_scan_run(cur, scan_run_s: int) -> None:
+        """
+        Запуск сканирования, которому до конца транзакции относятся изменения в истории file_history/
+        directory_history (по умолчанию - last_seen_scan_run_s строки; задается для пометки удаленных)
+        """
+        cur.execute("SELECT set_config('scanner.scan_run_s', %s, true)", (str(scan_run_s),))
+
+    def commit(self) -> None:
+        """Фиксация транзакции (завершение этапа сканирования)"""
+        self.conn.commit()
+
+    def _create_stage_tables(self) -> None:
+        """
+        Создание временных staging-таблиц для загрузки через COPY.
+        Временные таблицы не журналируются и видны только текущему соединению
+        """
+        with self.conn.cursor() as cur:
+            for table, columns, epoch_columns in (('directory', DIRECTORY_COLUMNS, DIRECTORY_EPOCH_COLUMNS),
+                                                  ('file', FILE_COLUMNS, FILE_EPOCH_COLUMNS)):
+                cur.execute(f"""
+                    CREATE TEMP TABLE IF NOT EXISTS {table}_stage AS
+                    SELECT {columns} FROM {table} WITH NO DATA
+                """)
+                # Метки времени загружаются в микросекундах от эпохи
+                for column in epoch_columns:
+                    cur.execute(f"ALTER TABLE {table}_stage ALTER COLUMN {column} TYPE BIGINT USING NULL")
+        self.conn.commit()
+
+    def _copy_merge(self, cur, table: str, columns: str, select: str, upsert: str, rows,
+                    fetch: bool = True) -> list:
+        """
+        Загрузка строк потоком COPY FROM STDIN (CSV) во временную таблицу <table>_stage
+        и слияние с основной таблицей одним запросом. Возвращает строки RETURNING (при fetch)
+        """
+        stage = f"{table}_stage"
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(','.join(_csv_value(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+        cur.copy_expert(f"COPY {stage} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cur.execute(f"INSERT INTO {table} ({columns}) SELECT {select} FROM {stage} {upsert}")
+        results = cur.fetchall() if fetch else []
+        cur.execute(f"TRUNCATE {stage}")
+        return results
 
     def close(self):
-        """Закрытие соединения с базой данных"""
-        if self.conn:
-            self.conn.close()
+        """Возврат соединения в пул; пул закрывается подключением, которое его создало"""
+        if self.conn is not None:
+            self.pool.putconn(self.conn, close=bool(self.conn.closed))
+            self.conn = None
+        if self._own_pool and not self.pool.closed:
+            self.pool.closeall()
             logger.info("Database connection closed")
 
-    def mark_items_not_actual(self, resource_id: int) -> None:
-        """Пометка записей как неактуальных"""
-        with self.conn.cursor() as cur:
-            cur.execute(
-                "UPDATE directory SET is_actual = FALSE WHERE information_resource_s = %s",
-                (resource_id,)
-            )
-            cur.execute(
-                "UPDATE file SET is_actual = FALSE WHERE information_resource_s = %s",
-                (resource_id,)
-            )
-
-    def save_directories_bulk(self, directories: List[DirectoryItem]) -> Dict[str, int]:
-        """Пакетное сохранение директорий"""
-        path_to_id = {}
-
-        if not directories:
-            return path_to_id
+    def _execute_finalize(self, cur, objects: str, resource_id: int, scan_run_s: int,
+                          branch_path: Optional[str]) -> None:
+        """Запрос завершения сканирования finalize_<objects> всего ресурса или finalize_branch_<objects> ветви"""
+        if branch_path is None:
+            self._execute_prepared(cur, f"finalize_{objects}", (resource_id, scan_run_s))
+        else:
+            self._execute_prepared(cur, f"finalize_branch_{objects}", (resource_id, scan_run_s, branch_path))
+
+    def finalize_scan(self, resource_id: int, scan_run_s: int, branch_path: Optional[str] = None) -> None:
+        """
+        Завершение полного сканирования: записи ресурса (или поддерева branch_path), не встреченные
+        запуском scan_run_s и более поздними запусками, помечаются неактуальными; контрольные точки
+        этого и более ранних запусков удаляются. Выполняется одной транзакцией
+        """
+        def finalize(cur):
+            self._set_history_scan_run(cur, scan_run_s)
+            for objects in ('directories', 'files', 'checkpoints'):
+                self._execute_finalize(cur, objects, resource_id, scan_run_s, branch_path)
+            self.conn.commit()
 
         try:
-            with self.conn.cursor() as cur:
-                values = [(
-                    d.information_resource_s,
-                    d.parent_directory_s,
-                    d.name,
-                    d.relative_path,
-                    d.nesting_level,
-                    d.first_discovered,
-                    d.owner,
-                    d.is_actual
-                ) for d in directories]
-
-                execute_values(cur, """
-                    INSERT INTO directory (
-                        information_resource_s,
-                        parent_directory_s,
-                        name,
-                        relative_path,
-                        nesting_level,
-                        first_discovered,
-                        owner,
-                        is_actual
-                    ) 
-                    VALUES %s
-                    ON CONFLICT (information_resource_s, relative_path, name) 
-                    DO UPDATE SET
-                        is_actual = EXCLUDED.is_actual,
-                        owner = EXCLUDED.owner
-                    RETURNING directory_s, relative_path, name
-                """, values)
+            self._run(finalize)
 
-                results = cur.fetchall()
-                for id, rel_path, name in results:
-                    full_path = f"{rel_path}/{name}"
-                    path_to_id[full_path] = id
-                    # Обновляем directory_s в объектах DirectoryItem
-                    # for directory in directories:
-                    #     dir_full_path = f"{directory.relative_path}/{directory.name}" if directory.relative_path != '.' else directory.name
-                    #     if dir_full_path == full_path:
-                    #         directory.directory_s = id
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error finalizing scan run {scan_run_s}: {str(e)}")
+            raise
 
+    def save_checkpoint(self, scan_run_s: int, resource_id: int, frontier: List[str], total_directories: int,
+                        total_files: int, total_size: int, syscalls: int) -> None:
+        """
+        Сохранение контрольной точки полного сканирования (фронт обхода и итоги обработанных каталогов).
+        Фиксирует транзакцию вместе с пакетами, сохраненными к этому моменту
+        """
+        def save(cur):
+            cur.execute("""
+                INSERT INTO scan_checkpoint (scan_run_s, information_resource_s, frontier, total_directories,
+                                             total_files, total_size, syscalls, checkpoint_time)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (scan_run_s) DO UPDATE SET
+                    frontier = EXCLUDED.frontier,
+                    total_directories = EXCLUDED.total_directories,
+                    total_files = EXCLUDED.total_files,
+                    total_size = EXCLUDED.total_size,
+                    syscalls = EXCLUDED.syscalls,
+                    checkpoint_time = EXCLUDED.checkpoint_time
+            """, (scan_run_s, resource_id, frontier, total_directories, total_files, total_size, syscalls,
+                  datetime.now()))
             self.conn.commit()
-            logger.debug(f"Saved {len(directories)} directories")
-            return path_to_id
+
+        try:
+            # Повтор возможен, только если пакеты фиксируются по отдельности (иначе они потеряны с соединением)
+            self._run(save, retry=self.commit_per_batch)
+            logger.debug(f"Checkpoint of scan run {scan_run_s} saved ({len(frontier)} pending directories)")
 
         except Exception as e:
-            self.conn.rollback()
-            logger.error(f"Error saving directories: {str(e)}")
+            self._rollback()
+            logger.error(f"Error saving checkpoint of scan run {scan_run_s}: {str(e)}")
             raise
 
+    def get_checkpoint(self, resource_id: int, branch_path: Optional[str] = None,
+                       max_age: Optional[timedelta] = None) -> Optional[ScanCheckpoint]:
+        """
+        Последняя контрольная точка незавершенного полного сканирования ресурса (или ветви branch_path),
+        сохраненная не раньше max_age назад (None - любого возраста)
+        """
+        since = datetime.now() - max_age if max_age is not None else None
 
-    def save_files_bulk(self, files: List[FileItem]) -> None:
-        """Пакетное сохранение файлов"""
-        if not files:
-            return
+        def fetch(cur):
+            cur.execute("""
+                SELECT c.scan_run_s, c.frontier, c.total_directories, c.total_files, c.total_size, c.syscalls
+                FROM scan_checkpoint c
+                JOIN scan_run sr ON sr.scan_run_s = c.scan_run_s
+                WHERE c.information_resource_s = %s
+                AND sr.branch_path IS NOT DISTINCT FROM %s
+                AND sr.scan_mode = 'full'
+                AND sr.status <> 'completed'
+                AND (%s::timestamp IS NULL OR c.checkpoint_time >= %s::timestamp)
+                ORDER BY c.scan_run_s DESC
+                LIMIT 1
+            """, (resource_id, branch_path, since, since))
+            row = cur.fetchone()
+            self.conn.commit()
+            return row
+
+        row = self._run(fetch)
+        return ScanCheckpoint(*row) if row else None
+
+    def clear_checkpoints(self, resource_id: int, scan_run_s: int, branch_path: Optional[str] = None) -> None:
+        """
+        Удаление контрольных точек запусков ресурса (или ветви branch_path) до завершенного запуска
+        scan_run_s (как при finalize_scan): прерванные раньше запуски больше не продолжаются
+        """
+        def clear(cur):
+            self._execute_finalize(cur, 'checkpoints', resource_id, scan_run_s, branch_path)
+            self.conn.commit()
 
         try:
-            with self.conn.cursor() as cur:
-                values = [(
-                    f.information_resource_s,
-                    f.directory_s,
-                    f.name,
-                    f.relative_path,
-                    f.extension,
-                    f.size_bytes,
-                    f.creation_time,
-                    f.modification_time,
-                    f.first_discovered,
-                    f.owner,
-                    f.is_actual,
-                    f.nesting_level
-                ) for f in files]
-
-                execute_values(cur, """
-                    INSERT INTO file (
-                        information_resource_s,
-                        directory_s,
-                        name,
-                        relative_path,
-                        extension,
-                        size_bytes,
-                        creation_time,
-                        modification_time,
-                        first_discovered,
-                        owner,
-                        is_actual,
-                        nesting_level
-                    ) 
-                    VALUES %s
-                    ON CONFLICT (information_resource_s, relative_path, name) 
-                    DO UPDATE SET
-                        is_actual = EXCLUDED.is_actual,
-                        size_bytes = EXCLUDED.size_bytes,
-                        modification_time = EXCLUDED.modification_time,
-                        owner = EXCLUDED.owner,
-                        extension = EXCLUDED.extension
-                    RETURNING file_s, relative_path, name
-                """, values)
+            self._run(clear)
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error clearing checkpoints before scan run {scan_run_s}: {str(e)}")
+            raise
+
+    def get_directory_ids(self, resource_id: int, full_paths: List[str]) -> Dict[str, int]:
+        """ID актуальных каталогов ресурса по полным путям: словарь полный путь -> directory_s"""
+        def fetch(cur):
+            cur.execute("""
+                SELECT full_path, directory_s
+                FROM directory
+                WHERE information_resource_s = %s
+                AND full_path COLLATE "C" = ANY(%s)
+                AND is_actual = TRUE
+            """, (resource_id, full_paths))
+            return dict(cur.fetchall())
+
+        # Чтение внутри этапа сканирования повторяется, только если пакеты фиксируются по отдельности
+        return self._run(fetch, retry=self.commit_per_batch)
+
+    def get_directory_id(self, resource_id: int, full_path: str) -> Optional[int]:
+        """ID актуального каталога ресурса по полному пути ("<relative_path>/<name>")"""
+        def fetch(cur):
+            cur.execute("""
+                SELECT directory_s
+                FROM directory
+                WHERE information_resource_s = %s
+                AND full_path COLLATE "C" = %s
+                AND is_actual = TRUE
+            """, (resource_id, full_path))
+            return cur.fetchone()
+
+        row = self._run(fetch, retry=self.commit_per_batch)
+        return row[0] if row else None
 
+    def save_directories_bulk(self, directories: DirectoryBatch, path_to_id: Dict[str, int]) -> None:
+        """
+        Пакетное сохранение директорий.
+        ID сохраненных директорий добавляются в path_to_id по ключу "<relative_path>/<name>"
+        """
+        if not len(directories):
+            return
+
+        def save(cur):
+            if self.loader == 'copy':
+                results = self._copy_merge(cur, 'directory', DIRECTORY_COLUMNS, DIRECTORY_STAGE_SELECT,
+                                           DIRECTORY_UPSERT, directories.rows())
+            elif self.loader == 'prepared':
+                self._execute_prepared(cur, 'directory_upsert', directory_batch_params(directories))
                 results = cur.fetchall()
-                path_to_id = {f"{rel_path}/{name}": id for id, rel_path, name in results}
+            else:
+                # fetch=True - RETURNING всех страниц execute_values, а не только последней
+                results = execute_values(
+                    cur, f"INSERT INTO directory ({DIRECTORY_COLUMNS}) VALUES %s {DIRECTORY_UPSERT}",
+                    directories.rows(), template=DIRECTORY_TEMPLATE, fetch=True)
+            if self.commit_per_batch:
+                self.conn.commit()
+            return results
 
-                for file in files:
-                    file_full_path = f"{file.relative_path}/{file.name}"
-                    file.file_s = path_to_id.get(file_full_path)
+        try:
+            # Пакет повторяется после разрыва соединения, только если предыдущие пакеты зафиксированы
+            for id, rel_path, name in self._run(save, retry=self.commit_per_batch):
+                path_to_id[f"{rel_path}/{name}"] = id
+            self.metrics.add('db_rows', len(directories))
+            logger.debug(f"Saved {len(directories)} directories")
 
-            self.conn.commit()
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error saving directories: {str(e)}")
+            raise
+
+    def save_files_bulk(self, files: FileBatch) -> Dict[str, int]:
+        """
+        Пакетное сохранение файлов.
+        ID возвращаются (словарь "<relative_path>/<name>" -> file_s) только для пакетов
+        с изменениями для журнала, иначе RETURNING не запрашивается
+        """
+        if not len(files):
+            return {}
+
+        fetch = bool(files.changes)
+        upsert = f"{FILE_UPSERT} {FILE_RETURNING}" if fetch else FILE_UPSERT
+
+        def save(cur):
+            if self.loader == 'copy':
+                results = self._copy_merge(cur, 'file', FILE_COLUMNS, FILE_STAGE_SELECT, upsert,
+                                           files.rows(), fetch=fetch)
+            elif self.loader == 'prepared':
+                self._execute_prepared(cur, 'file_upsert_returning' if fetch else 'file_upsert',
+                                       file_batch_params(files))
+                results = cur.fetchall() if fetch else []
+            else:
+                results = execute_values(
+                    cur, f"INSERT INTO file ({FILE_COLUMNS}) VALUES %s {upsert}",
+                    files.rows(), template=FILE_TEMPLATE, fetch=fetch)
+            if self.commit_per_batch:
+                self.conn.commit()
+            return results
+
+        try:
+            results = self._run(save, retry=self.commit_per_batch)
+            path_to_id = {f"{rel_path}/{name}": id for id, rel_path, name in results or ()}
+            self.metrics.add('db_rows', len(files))
             logger.debug(f"Saved {len(files)} files")
+            return path_to_id
 
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             logger.error(f"Error saving files: {str(e)}")
             raise
 
@@ -166,28 +689,894 @@ class Database:
         Получение статистики по ресурсу:
         возвращает (количество директорий, количество файлов, общий размер файлов)
         """
+        def stats(cur):
+            self._execute_prepared(cur, 'resource_stats', (resource_id,))
+            return cur.fetchone()
+
         try:
-            with self.conn.cursor() as cur:
-                cur.execute("""
-                    WITH dir_count AS (
-                        SELECT COUNT(*) as dir_count
-                        FROM directory
-                        WHERE information_resource_s = %s
-                        AND is_actual = TRUE
-                    ),
-                    file_stats AS (
-                        SELECT COUNT(*) as file_count, COALESCE(SUM(size_bytes), 0) as total_size
-                        FROM file
-                        WHERE information_resource_s = %s
-                        AND is_actual = TRUE
-                    )
-                    SELECT dir_count, file_count, total_size
-                    FROM dir_count, file_stats
-                """, (resource_id, resource_id))
-
-                result = cur.fetchone()
-                return result if result else (0, 0, 0)
+            result = self._run(stats)
+            return result if result else (0, 0, 0)
 
         except Exception as e:
             logger.error(f"Error getting resource stats: {str(e)}")
             return (0, 0, 0)
+
+    def get_subtree_stats(self, resource_id: int, branch_path: str) -> Tuple[int, int, int]:
+        """
+        Статистика поддерева каталога branch_path (включая сам каталог):
+        возвращает (количество директорий, количество файлов, общий размер файлов)
+        """
+        def stats(cur):
+            self._execute_prepared(cur, 'subtree_stats', (resource_id, branch_path))
+            return cur.fetchone()
+
+        try:
+            return self._run(stats)
+
+        except Exception as e:
+            logger.error(f"Error getting subtree stats: {str(e)}")
+            return (0, 0, 0)
+
+    def start_scan_run(self, resource_id: int, scan_mode: str, scheduled_time: Optional[datetime] = None,
+                       branch_path: Optional[str] = None) -> int:
+        """
+        Регистрация запуска сканирования, возвращает scan_run_s
+        scheduled_time - время постановки задания в очередь планировщиком
+        branch_path - полный путь корневого каталога сканируемой ветви (None - весь ресурс)
+        """
+        def start(cur):
+            cur.execute("""
+                INSERT INTO scan_run (information_resource_s, scan_mode, status, start_time, scheduled_time,
+                                      branch_path)
+                VALUES (%s, %s, 'running', %s, %s, %s)
+                RETURNING scan_run_s
+            """, (resource_id, scan_mode, datetime.now(), scheduled_time, branch_path))
+            scan_run_s = cur.fetchone()[0]
+            # Секции истории изменений, в которые пишет запуск
+            cur.execute("CALL ensure_history_partitions(%s)", (scan_run_s,))
+            self.conn.commit()
+            return scan_run_s
+
+        try:
+            return self._run(start)
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error starting scan run: {str(e)}")
+            raise
+
+    def resume_scan_run(self, scan_run_s: int) -> None:
+        """Возобновление прерванного запуска сканирования с контрольной точки"""
+        def resume(cur):
+            cur.execute("""
+                UPDATE scan_run
+                SET status = 'running',
+                    end_time = NULL
+                WHERE scan_run_s = %s
+            """, (scan_run_s,))
+            self.conn.commit()
+
+        try:
+            self._run(resume)
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error resuming scan run {scan_run_s}: {str(e)}")
+            raise
+
+    def finish_scan_run(self, scan_run_s: int, result: ScanResult) -> None:
+        """Фиксация итогов запуска сканирования"""
+        def finish(cur):
+            cur.execute("""
+                UPDATE scan_run
+                SET status = %s,
+                    end_time = %s,
+                    total_directories = %s,
+                    total_files = %s,
+                    total_size = %s,
+                    error_count = %s,
+                    metrics = %s
+                WHERE scan_run_s = %s
+            """, (
+                'failed' if result.errors else 'completed',
+                result.end_time,
+                result.total_directories,
+                result.total_files,
+                result.total_size,
+                len(result.errors),
+                Json(result.metrics) if result.metrics is not None else None,
+                scan_run_s
+            ))
+            self.conn.commit()
+
+        try:
+            self._run(finish)
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error finishing scan run: {str(e)}")
+            raise
+
+    def get_scheduled_resources(self) -> List[Tuple[int, str, str, str, str, Optional[datetime]]]:
+        """
+        Ресурсы с расписанием сканирования: возвращает список
+        (information_resource_s, path, name, scan_schedule, path_to_mount, время начала последнего запуска)
+        """
+        def fetch(cur):
+            cur.execute("""
+                SELECT ir.information_resource_s, ir.path, ir.name, ir.scan_schedule, ir.path_to_mount,
+                       MAX(sr.start_time)
+                FROM information_resource ir
+                -- Сканирования отдельных ветвей не сдвигают расписание сканирования ресурса
+                LEFT JOIN scan_run sr ON sr.information_resource_s = ir.information_resource_s
+                    AND sr.branch_path IS NULL
+                WHERE ir.scan_schedule IS NOT NULL
+                AND length(trim(ir.scan_schedule)) > 0
+                GROUP BY ir.information_resource_s
+                ORDER BY ir.information_resource_s
+            """)
+            result = cur.fetchall()
+            # Завершаем транзакцию чтения, чтобы не удерживать снимок между проходами планировщика
+            self.conn.commit()
+            return result
+
+        return self._run(fetch)
+
+    def get_directory_state(self, resource_id: int, full_path: str) -> Optional[Tuple[int, Optional[int]]]:
+        """
+        Сохраненное состояние актуального каталога ресурса по полному пути ("<relative_path>/<name>"):
+        (directory_s, modification_time в микросекундах от эпохи) или None
+        """
+        def state(cur):
+            cur.execute(f"""
+                SELECT directory_s, {EPOCH_MODIFICATION_TIME}
+                FROM directory
+                WHERE information_resource_s = %s
+                AND full_path COLLATE "C" = %s
+                AND is_actual = TRUE
+            """, (resource_id, full_path))
+            return cur.fetchone()
+
+        return self._run(state, retry=self.commit_per_batch)
+
+    def get_directory_contents(self, resource_id: int, directory_id: int) -> Tuple[
+            Dict[str, Tuple[int, Optional[int]]], Dict[str, Tuple[int, int, Optional[int]]]]:
+        """
+        Сохраненное состояние содержимого каталога для инкрементального сканирования (один запрос):
+        возвращает (словарь имя подкаталога -> (directory_s, modification_time),
+                    словарь имя файла -> (file_s, size_bytes, modification_time)),
+        время - в микросекундах от эпохи. Условие по ресурсу ограничивает запрос секциями ресурса
+        """
+        def contents(cur):
+            cur.execute(f"""
+                SELECT TRUE, directory_s, name, NULL::bigint, {EPOCH_MODIFICATION_TIME}
+                FROM directory
+                WHERE information_resource_s = %(resource_id)s
+                AND parent_directory_s = %(directory_id)s
+                AND is_actual = TRUE
+                UNION ALL
+                SELECT FALSE, file_s, name, size_bytes, {EPOCH_MODIFICATION_TIME}
+                FROM file
+                WHERE information_resource_s = %(resource_id)s
+                AND directory_s = %(directory_id)s
+                AND is_actual = TRUE
+            """, {'resource_id': resource_id, 'directory_id': directory_id})
+            return cur.fetchall()
+
+        directories = {}
+        files = {}
+        for is_directory, object_s, name, size, mtime in self._run(contents, retry=self.commit_per_batch):
+            if is_directory:
+                directories[name] = (object_s, mtime)
+            else:
+                files[name] = (object_s, size, mtime)
+        return directories, files
+
+    def save_scan_changes(self, scan_run_s: int, resource_id: int,
+                          changes: List[Tuple[str, int, str, str, str]]) -> None:
+        """
+        Пакетное сохранение изменений, обнаруженных при сканировании.
+        changes - список (object_type, object_s, change_type, relative_path, name)
+        """
+        if not changes:
+            return
+
+        def save(cur):
+            values = [(scan_run_s, resource_id) + change for change in changes]
+            execute_values(cur, """
+                INSERT INTO scan_change (
+                    scan_run_s,
+                    information_resource_s,
+                    object_type,
+                    object_s,
+                    change_type,
+                    relative_path,
+                    name
+                )
+                VALUES %s
+            """, values)
+            self.conn.commit()
+
+        try:
+            self._run(save, retry=self.commit_per_batch)
+            logger.debug(f"Saved {len(changes)} scan changes")
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error saving scan changes: {str(e)}")
+            raise
+
+    def mark_directories_deleted(self, scan_run_s: int, resource_id: int, paths: List[str]) -> int:
+        """
+        Пометка удаленных каталогов (вместе со всем поддеревом каталогов и файлов) как неактуальных
+        с записью изменений в журнал. paths - полные относительные пути каталогов (relative_path/name).
+        Возвращает количество помеченных записей
+        """
+        if not paths:
+            return 0
+
+        def mark(cur):
+            self._set_history_scan_run(cur, scan_run_s)
+            cur.execute(f"""
+                WITH deleted_directories AS (
+                    UPDATE directory d
+                    SET is_actual = FALSE
+                    FROM unnest(%(paths)s::text[]) AS p(path)
+                    WHERE d.information_resource_s = %(resource_id)s
+                    AND d.is_actual = TRUE
+                    AND {_subtree_condition('d.full_path', 'p.path')}
+                    RETURNING d.directory_s, d.relative_path, d.name
+                ),
+                deleted_files AS (
+                    UPDATE file f
+                    SET is_actual = FALSE
+                    FROM unnest(%(paths)s::text[]) AS p(path)
+                    WHERE f.information_resource_s = %(resource_id)s
+                    AND f.is_actual = TRUE
+                    AND {_subtree_condition('f.relative_path', 'p.path')}
+                    RETURNING f.file_s, f.relative_path, f.name
+                )
+                INSERT INTO scan_change (
+                    scan_run_s, information_resource_s, object_type, object_s, change_type, relative_path, name
+                )
+                SELECT %(scan_run_s)s, %(resource_id)s, 'directory', directory_s, 'deleted', relative_path, name
+                FROM deleted_directories
+                UNION ALL
+                SELECT %(scan_run_s)s, %(resource_id)s, 'file', file_s, 'deleted', relative_path, name
+                FROM deleted_files
+            """, {'paths': paths, 'resource_id': resource_id, 'scan_run_s': scan_run_s})
+            deleted = cur.rowcount
+            self.conn.commit()
+            return deleted
+
+        try:
+            return self._run(mark, retry=self.commit_per_batch)
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error marking directories deleted: {str(e)}")
+            raise
+
+    def mark_files_deleted(self, scan_run_s: int, resource_id: int, file_ids: List[int]) -> int:
+        """
+        Пометка удаленных файлов как неактуальных с записью изменений в журнал.
+        Возвращает количество помеченных записей
+        """
+        if not file_ids:
+            return 0
+
+        def mark(cur):
+            self._set_history_scan_run(cur, scan_run_s)
+            cur.execute("""
+                WITH deleted_files AS (
+                    UPDATE file
+                    SET is_actual = FALSE
+                    WHERE information_resource_s = %(resource_id)s
+                    AND file_s = ANY(%(file_ids)s)
+                    AND is_actual = TRUE
+                    RETURNING file_s, relative_path, name
+                )
+                INSERT INTO scan_change (
+                    scan_run_s, information_resource_s, object_type, object_s, change_type, relative_path, name
+                )
+                SELECT %(scan_run_s)s, %(resource_id)s, 'file', file_s, 'deleted', relative_path, name
+                FROM deleted_files
+            """, {'file_ids': file_ids, 'resource_id': resource_id, 'scan_run_s': scan_run_s})
+            deleted = cur.rowcount
+            self.conn.commit()
+            return deleted
+
+        try:
+            return self._run(mark, retry=self.commit_per_batch)
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error marking files deleted: {str(e)}")
+            raise
+
+    def get_files_to_hash(self, resource_id: int, after_file_s: int, limit: int) -> List[Tuple[int, str, str]]:
+        """
+        Очередная порция актуальных файлов ресурса без MD5-хеша (постранично по file_s):
+        возвращает список (file_s, relative_path, name)
+        """
+        def fetch(cur):
+            cur.execute("""
+                SELECT file_s, relative_path, name
+                FROM file
+                WHERE information_resource_s = %s
+                AND is_actual = TRUE
+                AND md5_hash IS NULL
+                AND file_s > %s
+                ORDER BY file_s
+                LIMIT %s
+            """, (resource_id, after_file_s, limit))
+            return cur.fetchall()
+
+        return self._run(fetch)
+
+    def save_file_hashes(self, hashes: List[Tuple[int, str]]) -> None:
+        """
+        Пакетное сохранение MD5-хешей: hashes - список (file_s, md5_hash).
+        Ключи (размер, MD5) хешированных файлов ставятся в очередь пересчета групп дубликатов
+        """
+        if not hashes:
+            return
+
+        def save(cur):
+            execute_values(cur, """
+                WITH hashed AS (
+                    UPDATE file
+                    SET md5_hash = v.md5_hash
+                    FROM (VALUES %s) AS v(file_s, md5_hash)
+                    WHERE file.file_s = v.file_s
+                    RETURNING file.size_bytes, file.md5_hash, file.is_actual
+                )
+                INSERT INTO duplicate_pending_key (size_bytes, md5_hash)
+                SELECT DISTINCT size_bytes, md5_hash
+                FROM hashed
+                WHERE is_actual = TRUE
+                AND size_bytes > 0
+                ON CONFLICT DO NOTHING
+            """, hashes)
+            self.conn.commit()
+
+        try:
+            self._run(save)
+            logger.debug(f"Saved {len(hashes)} file hashes")
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error saving file hashes: {str(e)}")
+            raise
+
+    def get_partial_hash_candidates(self, resource_ids: List[int], after_file_s: int,
+                                    limit: int) -> List[Tuple[int, int, str, str, int]]:
+        """
+        Файлы ресурсов без частичного хеша, размер которых совпадает с размером другого актуального файла
+        (в любом ресурсе): возвращает список (file_s, information_resource_s, relative_path, name, size_bytes)
+        """
+        def fetch(cur):
+            cur.execute("""
+                SELECT f.file_s, f.information_resource_s, f.relative_path, f.name, f.size_bytes
+                FROM file f
+                WHERE f.information_resource_s = ANY(%s)
+                AND f.is_actual = TRUE
+                AND f.size_bytes > 0
+                AND f.partial_md5_hash IS NULL
+                AND f.file_s > %s
+                AND EXISTS (
+                    SELECT 1 FROM file other
+                    WHERE other.size_bytes = f.size_bytes
+                    AND other.is_actual = TRUE
+                    AND other.file_s <> f.file_s
+                )
+                ORDER BY f.file_s
+                LIMIT %s
+            """, (resource_ids, after_file_s, limit))
+            return cur.fetchall()
+
+        return self._run(fetch)
+
+    def get_full_hash_candidates(self, resource_ids: List[int], after_file_s: int,
+                                 limit: int) -> List[Tuple[int, int, str, str]]:
+        """
+        Файлы ресурсов без MD5, у которых есть актуальный файл того же размера с тем же частичным хешем
+        (или еще без частичного хеша): возвращает список (file_s, information_resource_s, relative_path, name)
+        """
+        def fetch(cur):
+            cur.execute("""
+                SELECT f.file_s, f.information_resource_s, f.relative_path, f.name
+                FROM file f
+                WHERE f.information_resource_s = ANY(%s)
+                AND f.is_actual = TRUE
+                AND f.size_bytes > 0
+                AND f.md5_hash IS NULL
+                AND f.partial_md5_hash IS NOT NULL
+                AND f.file_s > %s
+                AND EXISTS (
+                    SELECT 1 FROM file other
+                    WHERE other.size_bytes = f.size_bytes
+                    AND other.is_actual = TRUE
+                    AND other.file_s <> f.file_s
+                    AND (other.partial_md5_hash = f.partial_md5_hash OR other.partial_md5_hash IS NULL)
+                )
+                ORDER BY f.file_s
+                LIMIT %s
+            """, (resource_ids, after_file_s, limit))
+            return cur.fetchall()
+
+        return self._run(fetch)
+
+    def save_partial_hashes(self, hashes: List[Tuple[int, str, Optional[str]]]) -> None:
+        """
+        Пакетное сохранение частичных хешей: hashes - список (file_s, partial_md5_hash, md5_hash).
+        Для файлов не больше двух блоков частичный хеш совпадает с полным и md5_hash заполняется сразу
+        (ключи таких файлов ставятся в очередь пересчета групп дубликатов, как в save_file_hashes)
+        """
+        if not hashes:
+            return
+
+        def save(cur):
+            execute_values(cur, """
+                WITH hashed AS (
+                    UPDATE file
+                    SET partial_md5_hash = v.partial_md5_hash,
+                        md5_hash = COALESCE(v.md5_hash, file.md5_hash)
+                    FROM (VALUES %s) AS v(file_s, partial_md5_hash, md5_hash)
+                    WHERE file.file_s = v.file_s
+                    RETURNING file.size_bytes, v.md5_hash, file.is_actual
+                )
+                INSERT INTO duplicate_pending_key (size_bytes, md5_hash)
+                SELECT DISTINCT size_bytes, md5_hash
+                FROM hashed
+                WHERE md5_hash IS NOT NULL
+                AND is_actual = TRUE
+                AND size_bytes > 0
+                ON CONFLICT DO NOTHING
+            """, hashes, template="(%s, %s, %s::varchar)")
+            self.conn.commit()
+
+        try:
+            self._run(save)
+            logger.debug(f"Saved {len(hashes)} partial file hashes")
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error saving partial file hashes: {str(e)}")
+            raise
+
+    def refresh_duplicate_groups(self) -> int:
+        """
+        Инкрементальный пересчет групп дубликатов одной транзакцией, возвращает количество групп.
+        Пересчитываются только ключи (size_bytes, md5_hash) из очереди duplicate_pending_key
+        (файлы, хешированные после прошлого пересчета) и ключи групп, файлы которых изменились
+        или стали неактуальными; файлы ключа выбираются по idx_file_size_md5
+        """
+        def refresh(cur):
+            cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS _duplicate_key (
+                    size_bytes BIGINT NOT NULL,
+                    md5_hash VARCHAR(32) NOT NULL,
+                    file_count INTEGER,
+                    resource_count INTEGER,
+                    PRIMARY KEY (size_bytes, md5_hash)
+                ) ON COMMIT DELETE ROWS
+            """)
+            cur.execute("""
+                WITH pending AS (
+                    DELETE FROM duplicate_pending_key
+                    RETURNING size_bytes, md5_hash
+                )
+                INSERT INTO _duplicate_key (size_bytes, md5_hash)
+                SELECT size_bytes, md5_hash FROM pending
+                UNION
+                SELECT dg.size_bytes, dg.md5_hash
+                FROM duplicate_file df
+                JOIN duplicate_group dg ON dg.duplicate_group_s = df.duplicate_group_s
+                JOIN file f ON f.file_s = df.file_s AND f.information_resource_s = df.information_resource_s
+                WHERE NOT f.is_actual
+                OR f.size_bytes IS DISTINCT FROM dg.size_bytes
+                OR f.md5_hash IS DISTINCT FROM dg.md5_hash
+            """)
+            cur.execute("""
+                UPDATE _duplicate_key k
+                SET file_count = c.file_count,
+                    resource_count = c.resource_count
+                FROM (
+                    SELECT k.size_bytes, k.md5_hash, COUNT(f.file_s) AS file_count,
+                           COUNT(DISTINCT f.information_resource_s) AS resource_count
+                    FROM _duplicate_key k
+                    LEFT JOIN file f ON f.size_bytes = k.size_bytes
+                        AND f.md5_hash = k.md5_hash
+                        AND f.is_actual = TRUE
+                        AND f.md5_hash IS NOT NULL
+                    GROUP BY k.size_bytes, k.md5_hash
+                ) c
+                WHERE c.size_bytes = k.size_bytes AND c.md5_hash = k.md5_hash
+            """)
+            # Ключи, у которых осталось меньше двух файлов, перестают быть группами (файлы - каскадом)
+            cur.execute("""
+                DELETE FROM duplicate_group dg
+                USING _duplicate_key k
+                WHERE dg.size_bytes = k.size_bytes
+                AND dg.md5_hash = k.md5_hash
+                AND k.file_count < 2
+            """)
+            cur.execute("""
+                INSERT INTO duplicate_group (size_bytes, md5_hash, file_count, resource_count)
+                SELECT size_bytes, md5_hash, file_count, resource_count
+                FROM _duplicate_key
+                WHERE file_count > 1
+                ON CONFLICT (size_bytes, md5_hash) DO UPDATE SET
+                    file_count = EXCLUDED.file_count,
+                    resource_count = EXCLUDED.resource_count
+            """)
+            cur.execute("""
+                DELETE FROM duplicate_file df
+                USING duplicate_group dg, _duplicate_key k
+                WHERE df.duplicate_group_s = dg.duplicate_group_s
+                AND dg.size_bytes = k.size_bytes
+                AND dg.md5_hash = k.md5_hash
+                AND NOT EXISTS (
+                    SELECT 1 FROM file f
+                    WHERE f.file_s = df.file_s
+                    AND f.information_resource_s = df.information_resource_s
+                    AND f.is_actual = TRUE
+                    AND f.size_bytes = dg.size_bytes
+                    AND f.md5_hash = dg.md5_hash
+                )
+            """)
+            cur.execute("""
+                INSERT INTO duplicate_file (duplicate_group_s, file_s, information_resource_s)
+                SELECT dg.duplicate_group_s, f.file_s, f.information_resource_s
+                FROM _duplicate_key k
+                JOIN duplicate_group dg ON dg.size_bytes = k.size_bytes AND dg.md5_hash = k.md5_hash
+                JOIN file f ON f.size_bytes = k.size_bytes
+                    AND f.md5_hash = k.md5_hash
+                    AND f.is_actual = TRUE
+                    AND f.md5_hash IS NOT NULL
+                WHERE k.file_count > 1
+                ON CONFLICT (duplicate_group_s, file_s) DO NOTHING
+            """)
+            cur.execute("SELECT COUNT(*) FROM _duplicate_key")
+            recounted = cur.fetchone()[0]
+            cur.execute("SELECT COUNT(*) FROM duplicate_group")
+            group_count = cur.fetchone()[0]
+            self.conn.commit()
+            logger.debug(f"Recounted {recounted} duplicate keys")
+            return group_count
+
+        try:
+            return self._run(refresh)
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error refreshing duplicate groups: {str(e)}")
+            raise
+
+    def get_duplicate_report(self, resource_id: int) -> Tuple[int, int, int, int]:
+        """
+        Сводка по дубликатам ресурса: возвращает (количество групп, количество файлов в группах,
+        освобождаемый объем внутри ресурса, количество групп с копиями в других ресурсах)
+        """
+        def fetch(cur):
+            cur.execute("""
+                SELECT
+                    COUNT(*),
+                    COALESCE(SUM(files_in_resource), 0),
+                    COALESCE(SUM(reclaimable_bytes), 0),
+                    COUNT(*) FILTER (WHERE resource_count > 1)
+                FROM v_duplicate_report
+                WHERE information_resource_s = %s
+            """, (resource_id,))
+            return cur.fetchone()
+
+        return self._run(fetch)
+
+    def get_files_to_index(self, resource_id: int, after_file_s: int,
+                           limit: int) -> List[Tuple[int, str, str, Optional[str]]]:
+        """
+        Очередная порция актуальных файлов ресурса для полнотекстовой индексации (постранично по file_s):
+        файлы без поискового вектора и файлы, у которых после индексации изменились размер или время
+        изменения, а также MD5 (если он известен и при индексации, и сейчас).
+        Возвращает список (file_s, relative_path, name, extension)
+        """
+        def fetch(cur):
+            cur.execute("""
+                SELECT f.file_s, f.relative_path, f.name, f.extension
+                FROM file f
+                LEFT JOIN file_search s ON s.file_s = f.file_s
+                WHERE f.information_resource_s = %s
+                AND f.is_actual = TRUE
+                AND f.file_s > %s
+                AND (s.file_s IS NULL
+                     OR s.size_bytes IS DISTINCT FROM f.size_bytes
+                     OR s.modification_time IS DISTINCT FROM f.modification_time
+                     OR s.md5_hash <> f.md5_hash)
+                ORDER BY f.file_s
+                LIMIT %s
+            """, (resource_id, after_file_s, limit))
+            return cur.fetchall()
+
+        return self._run(fetch)
+
+    def save_search_vectors(self, contents: List[Tuple[int, Optional[str]]]) -> None:
+        """
+        Пакетное сохранение поисковых векторов: contents - список (file_s, извлеченный текст или None).
+        Вектор строится на сервере по имени, пути и тексту (f_file_search_vector) вместе
+        с состоянием файла, по которому определяется необходимость повторной индексации
+        """
+        if not contents:
+            return
+
+        def save(cur):
+            execute_values(cur, """
+                INSERT INTO file_search (file_s, information_resource_s, size_bytes, modification_time, md5_hash,
+                                         search_vector, content_indexed, indexed_time)
+                SELECT f.file_s, f.information_resource_s, f.size_bytes, f.modification_time, f.md5_hash,
+                       f_file_search_vector(f.name, f.relative_path, v.content), v.content IS NOT NULL, now()
+                FROM (VALUES %s) AS v(file_s, content)
+                JOIN file f ON f.file_s = v.file_s
+                ON CONFLICT (file_s) DO UPDATE SET
+                    size_bytes = EXCLUDED.size_bytes,
+                    modification_time = EXCLUDED.modification_time,
+                    md5_hash = EXCLUDED.md5_hash,
+                    search_vector = EXCLUDED.search_vector,
+                    content_indexed = EXCLUDED.content_indexed,
+                    indexed_time = EXCLUDED.indexed_time
+            """, contents, template="(%s, %s::text)")
+            self.conn.commit()
+
+        try:
+            self._run(save)
+            self.metrics.add('db_rows', len(contents))
+            logger.debug(f"Saved {len(contents)} search vectors")
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error saving search vectors: {str(e)}")
+            raise
+
+    def search_files(self, query: str, resource_id: Optional[int] = None,
+                     limit: int = 50) -> List[Tuple[int, int, str, str, float]]:
+        """
+        Полнотекстовый поиск актуальных файлов по имени, пути и содержимому (индекс idx_file_search_vector).
+        query - запрос в синтаксисе веб-поиска; resource_id - только файлы ресурса (None - все ресурсы).
+        Возвращает список (file_s, information_resource_s, relative_path, name, релевантность)
+        по убыванию релевантности
+        """
+        def fetch(cur):
+            cur.execute("""
+                SELECT f.file_s, f.information_resource_s, f.relative_path, f.name,
+                       ts_rank(s.search_vector, q.query) AS rank
+                FROM f_file_search_query(%(query)s) AS q(query)
+                JOIN file_search s ON s.search_vector @@ q.query
+                JOIN file f ON f.file_s = s.file_s AND f.information_resource_s = s.information_resource_s
+                WHERE f.is_actual = TRUE
+                AND (%(resource_id)s::integer IS NULL OR s.information_resource_s = %(resource_id)s)
+                ORDER BY rank DESC, f.file_s
+                LIMIT %(limit)s
+            """, {'query': query, 'resource_id': resource_id, 'limit': limit})
+            result = cur.fetchall()
+            self.conn.commit()
+            return result
+
+        return self._run(fetch)
+
+    def get_changes_since(self, resource_id: int,
+                          scan_run_s: int) -> List[Tuple[int, str, int, str, datetime, str, str, Optional[int]]]:
+        """
+        Изменения файлов и каталогов ресурса в запусках сканирования после scan_run_s
+        (история file_history/directory_history, читаются только секции более поздних запусков).
+        Возвращает список (scan_run_s, object_type, object_s, change_type, change_time, relative_path, name,
+        size_bytes) в порядке запусков
+        """
+        def fetch(cur):
+            cur.execute("""
+                SELECT scan_run_s, object_type, object_s, change_type, change_time, relative_path, name, size_bytes
+                FROM f_changes_since(%s, %s)
+            """, (resource_id, scan_run_s))
+            result = cur.fetchall()
+            self.conn.commit()
+            return result
+
+        return self._run(fetch)
+
+    def drop_history_before(self, scan_run_s: int) -> int:
+        """
+        Удаление истории изменений запусков раньше scan_run_s целыми секциями
+        (секция, содержащая scan_run_s, сохраняется). Возвращает количество удаленных секций
+        """
+        def drop(cur):
+            cur.execute("SELECT drop_history_partitions(%s)", (scan_run_s,))
+            dropped = cur.fetchone()[0]
+            self.conn.commit()
+            return dropped
+
+        try:
+            return self._run(drop)
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error dropping change history before scan run {scan_run_s}: {str(e)}")
+            raise
+
+    def get_resources_to_analyze(self) -> List[Tuple[int, str, int]]:
+        """
+        Ресурсы, сканированные после их последнего анализа корректности данных:
+        возвращает список (information_resource_s, name, scan_run_s последнего завершенного сканирования)
+        """
+        def fetch(cur):
+            cur.execute("SELECT information_resource_s, resource_name, scan_run_s FROM f_resources_to_analyze()")
+            result = cur.fetchall()
+            self.conn.commit()
+            return result
+
+        return self._run(fetch)
+
+    def analyze_resource(self, resource_id: int) -> AnalysisResult:
+        """
+        Анализ корректности данных ресурса (f_analyze_resource): ошибки сохраняются в analysis_finding,
+        итоги - в analysis_run. Выполняется одной транзакцией
+        """
+        def analyze(cur):
+            cur.execute("SELECT f_analyze_resource(%s)", (resource_id,))
+            analysis_run_s = cur.fetchone()[0]
+            cur.execute("""
+                SELECT scan_run_s, total_directories, total_files, total_size, percent_compliance, finding_count
+                FROM analysis_run
+                WHERE analysis_run_s = %s
+            """, (analysis_run_s,))
+            scan_run_s, directories, files, size, compliance, findings = cur.fetchone()
+            self.conn.commit()
+            return AnalysisResult(resource_id, analysis_run_s, scan_run_s, directories, files, size,
+                                  float(compliance), findings)
+
+        try:
+            return self._run(analyze)
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error analyzing resource {resource_id}: {str(e)}")
+            raise
+
+    def get_analysis_findings(self, analysis_run_s: int) -> List[Tuple[str, int]]:
+        """Количество ошибок запуска анализа по типам: список (issue_type, количество)"""
+        def fetch(cur):
+            cur.execute("""
+                SELECT issue_type, COUNT(*)
+                FROM analysis_finding
+                WHERE analysis_run_s = %s
+                GROUP BY issue_type
+                ORDER BY issue_type
+            """, (analysis_run_s,))
+            result = cur.fetchall()
+            self.conn.commit()
+            return result
+
+        return self._run(fetch)
+
+    def check_scan_freshness(self, days_threshold: int) -> List[Tuple[int, str, Optional[int], str]]:
+        """
+        Ресурсы без завершенного сканирования дольше days_threshold дней (f_check_scan_freshness):
+        возвращает список (information_resource_s, name, дней без сканирования, статус)
+        """
+        def fetch(cur):
+            cur.execute("""
+                SELECT resource_id, resource_name, days_without_scan, status
+                FROM f_check_scan_freshness(%s)
+            """, (days_threshold,))
+            result = cur.fetchall()
+            self.conn.commit()
+            return result
+
+        return self._run(fetch)
+
+    def start_nsi_sync(self, source: str) -> int:
+        """Регистрация запуска синхронизации справочников с НСИ, возвращает nsi_sync_run_s"""
+        def start(cur):
+            cur.execute("""
+                INSERT INTO nsi_sync_run (source, status, start_time)
+                VALUES (%s, 'running', %s)
+                RETURNING nsi_sync_run_s
+            """, (source, datetime.now()))
+            nsi_sync_run_s = cur.fetchone()[0]
+            self.conn.commit()
+            return nsi_sync_run_s
+
+        try:
+            return self._run(start)
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error starting NSI sync: {str(e)}")
+            raise
+
+    def create_nsi_stage(self) -> None:
+        """
+        Создание временных таблиц загрузки выгрузки НСИ. Таблицы удаляются при фиксации транзакции,
+        поэтому загрузка и слияние (apply_nsi_stage) выполняются одной транзакцией и не повторяются
+        на новом соединении после разрыва (загруженные строки потеряны вместе с соединением)
+        """
+        def create(cur):
+            for table, columns in NSI_STAGE_TABLES.items():
+                cur.execute(f"DROP TABLE IF EXISTS {table}")
+                cur.execute(f"""
+                    CREATE TEMP TABLE {table} ({', '.join(f"{name} {type}" for name, type in columns)})
+                    ON COMMIT DROP
+                """)
+
+        self._run(create, retry=False)
+
+    def copy_nsi_stage(self, table: str, rows: List[tuple]) -> None:
+        """Загрузка порции строк в таблицу загрузки НСИ потоком COPY FROM STDIN (CSV) без фиксации"""
+        if not rows:
+            return
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(','.join(_csv_value(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+        columns = ', '.join(name for name, _ in NSI_STAGE_TABLES[table])
+        self._run(lambda cur: cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer),
+                  retry=False)
+        self.metrics.add('db_rows', len(rows))
+
+    def apply_nsi_stage(self, nsi_sync_run_s: int, records: int, errors: int) -> List[NsiDictionaryChange]:
+        """
+        Слияние загруженной выгрузки с nsi_data/nsi_data_x (процедура nsi_apply_stage) и завершение
+        запуска синхронизации одной транзакцией. Возвращает изменения по справочникам
+        с числом правил эталонной структуры, проверяемых по каждому из них
+        """
+        def apply(cur):
+            cur.execute("CALL nsi_apply_stage(%s)", (nsi_sync_run_s,))
+            cur.execute("""
+                UPDATE nsi_sync_run
+                SET status = 'completed',
+                    end_time = %s,
+                    record_count = %s,
+                    error_count = %s
+                WHERE nsi_sync_run_s = %s
+            """, (datetime.now(), records, errors, nsi_sync_run_s))
+            cur.execute("""
+                SELECT c.dictionary_s, d.code, c.inserted, c.updated, c.deactivated, c.links_changed,
+                       (SELECT COUNT(*) FROM compiled_rule cr WHERE cr.dictionary_s = c.dictionary_s)
+                FROM nsi_sync_change c
+                JOIN dictionary d ON d.dictionary_s = c.dictionary_s
+                WHERE c.nsi_sync_run_s = %s
+                ORDER BY d.code
+            """, (nsi_sync_run_s,))
+            changes = [NsiDictionaryChange(*row) for row in cur.fetchall()]
+            self.conn.commit()
+            return changes
+
+        try:
+            return self._run(apply, retry=False)
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error applying NSI export: {str(e)}")
+            raise
+
+    def fail_nsi_sync(self, nsi_sync_run_s: int, records: int, errors: int) -> None:
+        """Завершение прерванного запуска синхронизации (загруженная часть выгрузки отменена)"""
+        self._rollback()
+
+        def fail(cur):
+            cur.execute("""
+                UPDATE nsi_sync_run
+                SET status = 'failed',
+                    end_time = %s,
+                    record_count = %s,
+                    error_count = %s
+                WHERE nsi_sync_run_s = %s
+            """, (datetime.now(), records, errors, nsi_sync_run_s))
+            self.conn.commit()
+
+        try:
+            self._run(fail)
+
+        except Exception as e:
+            self._rollback()
+            logger.error(f"Error finishing NSI sync {nsi_sync_run_s}: {str(e)}")
+            raise
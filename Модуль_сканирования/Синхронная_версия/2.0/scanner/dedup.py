@@ -0,0 +1,108 @@
+# scanner/dedup.py
+
+import os
+import logging
+from typing import Dict, List, Tuple
+from .models import InformationResource
+from .database import Database
+from .hash_calculator import HashCalculator
+
+logger = logging.getLogger(__name__)
+
+class DuplicateFinder:
+    """
+    Поиск дубликатов файлов по содержимому.
+    Кандидаты отбираются по размеру (файлы с уникальным размером не читаются),
+    затем сравниваются MD5 первого и последнего блоков, и только совпавшие файлы хешируются полностью.
+    Частичный и полный хеши сохраняются в file и сбрасываются при изменении файла,
+    поэтому при повторном запуске неизменившиеся файлы не перечитываются.
+    Группы дубликатов пересчитываются только по ключам (размер, MD5), затронутым с прошлого запуска.
+    """
+
+    def __init__(self, db: Database, calculator: HashCalculator, block_size: int = 64 * 1024,
+                 batch_size: int = 1000):
+        self.db = db
+        self.calculator = calculator
+        self.block_size = block_size
+        self.batch_size = batch_size
+
+    def _file_path(self, resources: Dict[int, InformationResource], resource_id: int,
+                   relative_path: str, name: str) -> str:
+        return os.path.normpath(os.path.join(resources[resource_id].path, relative_path, name))
+
+    def _partial_pass(self, resources: Dict[int, InformationResource], errors: list) -> int:
+        """Частичное хеширование файлов с неуникальным размером"""
+        processed = 0
+        last_file_s = 0
+
+        while True:
+            files = self.db.get_partial_hash_candidates(list(resources), last_file_s, self.batch_size)
+            if not files:
+                break
+            last_file_s = files[-1][0]
+
+            items = []
+            sizes = {}
+            for file_s, resource_id, relative_path, name, size in files:
+                items.append((file_s, self._file_path(resources, resource_id, relative_path, name), size))
+                sizes[file_s] = size
+
+            paths = {file_s: path for file_s, path, _ in items}
+            hashes = []
+            for file_s, partial in self.calculator.calculate_partial_many(items, self.block_size):
+                if partial is None:
+                    errors.append(f"Error reading file {paths[file_s]}")
+                    continue
+                # Файл прочитан целиком - частичный хеш является полным
+                md5 = partial if sizes[file_s] <= 2 * self.block_size else None
+                hashes.append((file_s, partial, md5))
+
+            self.db.save_partial_hashes(hashes)
+            processed += len(hashes)
+
+        return processed
+
+    def _full_pass(self, resources: Dict[int, InformationResource], errors: list) -> int:
+        """Полное хеширование файлов, совпавших по размеру и частичному хешу"""
+        processed = 0
+        last_file_s = 0
+
+        while True:
+            files = self.db.get_full_hash_candidates(list(resources), last_file_s, self.batch_size)
+            if not files:
+                break
+            last_file_s = files[-1][0]
+
+            items = [
+                (file_s, self._file_path(resources, resource_id, relative_path, name))
+                for file_s, resource_id, relative_path, name in files
+            ]
+            paths = dict(items)
+            hashes = []
+            for file_s, md5 in self.calculator.calculate_many(items):
+                if md5 is None:
+                    errors.append(f"Error reading file {paths[file_s]}")
+                else:
+                    hashes.append((file_s, md5))
+
+            self.db.save_file_hashes(hashes)
+            processed += len(hashes)
+
+        return processed
+
+    def find_duplicates(self, resources: List[InformationResource]) -> Tuple[int, int, int, list]:
+        """
+        Поиск дубликатов среди файлов указанных ресурсов и ранее хешированных файлов остальных ресурсов.
+        Возвращает (частично хешировано, полностью хешировано, количество групп дубликатов, ошибки)
+        """
+        by_id = {resource.information_resource_s: resource for resource in resources}
+        errors = []
+
+        partial = self._partial_pass(by_id, errors)
+        full = self._full_pass(by_id, errors)
+        groups = self.db.refresh_duplicate_groups()
+
+        for error_msg in errors:
+            logger.error(error_msg)
+
+        return partial, full, groups, errors
@@ -1,19 +1,132 @@
 # scanner/hash_calculator.py
 import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Iterator, Optional, Tuple, Any
+from .metrics import ScanMetrics
+
+
+class BandwidthLimiter:
+    """Ограничение скорости чтения (маркерная корзина), общее для всех потоков хеширования"""
+
+    def __init__(self, bytes_per_second: int):
+        self.rate = bytes_per_second
+        self.allowance = float(bytes_per_second)
+        self.last_check = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, nbytes: int) -> None:
+        """Учет прочитанных байтов; при превышении лимита поток приостанавливается"""
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.rate, self.allowance + (now - self.last_check) * self.rate)
+            self.last_check = now
+            self.allowance -= nbytes
+            delay = -self.allowance / self.rate if self.allowance < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
 
 class HashCalculator:
-    def __init__(self, chunk_size: int = 8192):
+    def __init__(self, chunk_size: int = 1024 * 1024, workers: int = 1,
+                 bandwidth_limit: Optional[int] = None, metrics: Optional[ScanMetrics] = None):
+        """
+        chunk_size - максимальный размер буфера чтения; файлы меньше буфера читаются одним вызовом
+        workers - число потоков хеширования (hashlib освобождает GIL при обработке буфера)
+        bandwidth_limit - ограничение суммарной скорости чтения, байт/с (None - без ограничения)
+        metrics - метрики хеширования (фазы hash_file, hash_partial; счетчики hash_files, hash_bytes)
+        """
+        self.metrics = metrics or ScanMetrics()
         self.chunk_size = chunk_size
+        self.workers = max(1, workers)
+        self.limiter = BandwidthLimiter(bandwidth_limit) if bandwidth_limit else None
+        # Буфер чтения переиспользуется в пределах потока, чтобы не создавать bytes на каждый блок
+        self._local = threading.local()
+        self.bytes_read = 0
+        self._bytes_lock = threading.Lock()
+
+    def _buffer(self) -> memoryview:
+        """Буфер чтения текущего потока"""
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = memoryview(bytearray(self.chunk_size))
+            self._local.buffer = buffer
+        return buffer
 
     def calculate_md5(self, file_path: Path) -> Optional[str]:
         """Вычисляет MD5-хеш файла"""
         try:
-            md5 = hashlib.md5()
-            with open(file_path, 'rb') as f:
-                while chunk := f.read(self.chunk_size):
-                    md5.update(chunk)
+            with self.metrics.timer('hash_file'):
+                md5 = hashlib.md5()
+                buffer = self._buffer()
+                total = 0
+                with open(file_path, 'rb', buffering=0) as f:
+                    while n := f.readinto(buffer):
+                        md5.update(buffer[:n])
+                        total += n
+                        if self.limiter:
+                            self.limiter.consume(n)
+            with self._bytes_lock:
+                self.bytes_read += total
+            self.metrics.add('hash_files')
+            self.metrics.add('hash_bytes', total)
             return md5.hexdigest()
         except Exception:
+            self.metrics.add('hash_errors')
             return None
+
+    def calculate_partial_md5(self, file_path: Path, size: int, block_size: int) -> Optional[str]:
+        """
+        MD5 первого и последнего блоков файла (вместе с размером отличает большинство несовпадающих файлов
+        без полного чтения). Для файлов не больше двух блоков совпадает с calculate_md5
+        """
+        if size <= 2 * block_size:
+            return self.calculate_md5(file_path)
+        try:
+            with self.metrics.timer('hash_partial'):
+                md5 = hashlib.md5()
+                with open(file_path, 'rb', buffering=0) as f:
+                    head = f.read(block_size)
+                    f.seek(-block_size, 2)
+                    tail = f.read(block_size)
+                md5.update(head)
+                md5.update(tail)
+                if self.limiter:
+                    self.limiter.consume(len(head) + len(tail))
+            with self._bytes_lock:
+                self.bytes_read += len(head) + len(tail)
+            self.metrics.add('hash_files')
+            self.metrics.add('hash_bytes', len(head) + len(tail))
+            return md5.hexdigest()
+        except Exception:
+            self.metrics.add('hash_errors')
+            return None
+
+    def _map(self, func, items: list) -> Iterator[Tuple[Any, Optional[str]]]:
+        """Применение func к аргументам items[i][1:] в пуле потоков; возвращает пары (items[i][0], результат)"""
+        if self.workers == 1:
+            for key, *args in items:
+                yield key, func(*args)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [(key, executor.submit(func, *args)) for key, *args in items]
+            for key, future in futures:
+                yield key, future.result()
+
+    def calculate_many(self, items: Iterable[Tuple[Any, Path]]) -> Iterator[Tuple[Any, Optional[str]]]:
+        """
+        Хеширование набора файлов в пуле потоков.
+        items - пары (ключ, путь); возвращает пары (ключ, MD5 или None при ошибке чтения)
+        """
+        return self._map(self.calculate_md5, list(items))
+
+    def calculate_partial_many(self, items: Iterable[Tuple[Any, Path, int]],
+                               block_size: int) -> Iterator[Tuple[Any, Optional[str]]]:
+        """
+        Частичное хеширование набора файлов в пуле потоков.
+        items - тройки (ключ, путь, размер); возвращает пары (ключ, MD5 первого и последнего блоков или None)
+        """
+        return self._map(lambda path, size: self.calculate_partial_md5(path, size, block_size), list(items))
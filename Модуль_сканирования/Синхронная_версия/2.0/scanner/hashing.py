@@ -0,0 +1,58 @@
+# scanner/hashing.py
+
+import os
+import logging
+from typing import Tuple
+from .models import InformationResource
+from .database import Database
+from .hash_calculator import HashCalculator
+
+logger = logging.getLogger(__name__)
+
+class HashingStage:
+    """
+    Этап вычисления MD5 для файлов ресурса (поле file.md5_hash).
+    Хешируются только актуальные файлы без хеша: при изменении размера или времени изменения
+    файла сохраненный хеш сбрасывается при записи результатов сканирования,
+    поэтому неизменившиеся файлы повторно не читаются.
+    """
+
+    def __init__(self, db: Database, calculator: HashCalculator, batch_size: int = 1000):
+        self.db = db
+        self.calculator = calculator
+        self.batch_size = batch_size
+
+    def hash_resource(self, resource: InformationResource) -> Tuple[int, int, list]:
+        """
+        Хеширование файлов ресурса пакетами.
+        Возвращает (количество хешированных файлов, количество прочитанных байтов, ошибки)
+        """
+        hashed = 0
+        errors = []
+        bytes_before = self.calculator.bytes_read
+        last_file_s = 0
+
+        while True:
+            files = self.db.get_files_to_hash(resource.information_resource_s, last_file_s, self.batch_size)
+            if not files:
+                break
+            last_file_s = files[-1][0]
+
+            paths = [
+                (file_s, os.path.normpath(os.path.join(resource.path, relative_path, name)))
+                for file_s, relative_path, name in files
+            ]
+            path_by_id = dict(paths)
+            hashes = []
+            for file_s, md5 in self.calculator.calculate_many(paths):
+                if md5 is None:
+                    error_msg = f"Error hashing file {path_by_id[file_s]}"
+                    logger.error(error_msg)
+                    errors.append(error_msg)
+                else:
+                    hashes.append((file_s, md5))
+
+            self.db.save_file_hashes(hashes)
+            hashed += len(hashes)
+
+        return hashed, self.calculator.bytes_read - bytes_before, errors
@@ -0,0 +1,82 @@
+# scanner/indexing.py
+
+import os
+import logging
+from typing import Tuple
+from .models import InformationResource
+from .database import Database
+from .text_extractor import TextExtractor
+
+logger = logging.getLogger(__name__)
+
+
+class IndexingStage:
+    """
+    Этап полнотекстовой индексации файлов ресурса (таблица file_search).
+    Индексируются актуальные файлы без поискового вектора и файлы, изменившиеся после индексации
+    (размер, время изменения или MD5), поэтому неизменившиеся файлы повторно не читаются.
+    Текст следующей порции извлекается в пуле процессов, пока сохраняются векторы текущей
+    """
+
+    def __init__(self, db: Database, extractor: TextExtractor, batch_size: int = 500):
+        self.db = db
+        self.extractor = extractor
+        self.metrics = db.metrics
+        self.batch_size = batch_size
+
+    def index_resource(self, resource: InformationResource) -> Tuple[int, int, list]:
+        """
+        Индексация файлов ресурса порциями.
+        Возвращает (количество проиндексированных файлов, количество файлов с извлеченным текстом, ошибки)
+        """
+        indexed = 0
+        with_content = 0
+        errors = []
+        last_file_s = 0
+        pending = None
+
+        with self.extractor:
+            while True:
+                files = self.db.get_files_to_index(resource.information_resource_s, last_file_s, self.batch_size)
+                submitted = None
+                if files:
+                    last_file_s = files[-1][0]
+                    paths = {
+                        file_s: os.path.normpath(os.path.join(resource.path, relative_path, name))
+                        for file_s, relative_path, name, _ in files
+                    }
+                    submitted = (paths, self.extractor.submit([
+                        (file_s, paths[file_s], extension or '') for file_s, _, _, extension in files
+                    ]))
+                if pending is not None:
+                    saved, texts = self._save(pending, errors)
+                    indexed += saved
+                    with_content += texts
+                if submitted is None:
+                    break
+                pending = submitted
+
+        return indexed, with_content, errors
+
+    def _save(self, submitted, errors: list) -> Tuple[int, int]:
+        """
+        Ожидание текста порции (фаза index_extract) и сохранение ее векторов (фаза index_save).
+        submitted - (пути файлов порции, итератор результатов извлечения);
+        возвращает (количество файлов, количество файлов с текстом)
+        """
+        paths, results = submitted
+        with self.metrics.timer('index_extract'):
+            contents = []
+            for file_s, text, error in results:
+                if error is not None:
+                    # Файл индексируется по имени и пути
+                    error_msg = f"Error extracting text of file {paths[file_s]}: {error}"
+                    logger.error(error_msg)
+                    errors.append(error_msg)
+                contents.append((file_s, text))
+        with self.metrics.timer('index_save'):
+            self.db.save_search_vectors(contents)
+        texts = sum(1 for _, text in contents if text is not None)
+        self.metrics.add('index_files', len(contents))
+        self.metrics.add('index_text_files', texts)
+        return len(contents), texts
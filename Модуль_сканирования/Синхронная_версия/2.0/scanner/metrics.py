@@ -0,0 +1,250 @@
+# scanner/metrics.py
+
+import bisect
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм длительности, секунды
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Производные скорости: (имя, счетчики, фазы-знаменатель; None - общее время измерения).
+# Время фаз, выполняемых в нескольких потоках, суммируется, поэтому такая скорость - скорость одного потока
+RATES = (
+    ('entries_per_second', ('directories', 'files'), None),
+    ('bytes_per_second', ('bytes',), None),
+    ('db_rows_per_second', ('db_rows',), ('flush_directories', 'flush_files')),
+    ('hash_bytes_per_second', ('hash_bytes',), ('hash_file', 'hash_partial')),
+)
+
+# Префикс имен метрик в формате Prometheus
+PROMETHEUS_PREFIX = 'scanner'
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными границами корзин (как histogram в Prometheus)"""
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # counts[i] - число наблюдений в (buckets[i-1], buckets[i]], последний элемент - больше buckets[-1]
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Накопленные счетчики корзин: (верхняя граница, число наблюдений не больше нее)"""
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((repr(bound), total))
+        result.append(('+Inf', self.count))
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'avg': round(self.sum / self.count, 6) if self.count else 0.0,
+            'max': round(self.max, 6),
+            'buckets': dict(self.cumulative()),
+        }
+
+
+class ScanMetrics:
+    """
+    Метрики этапов сканирования: длительности фаз (гистограммы по пакетам и обращениям),
+    счетчики (элементы, байты, обращения к БД) и производные скорости.
+    Общий объект используется Database, FilesystemScanner и HashCalculator одного процесса;
+    обновления потокобезопасны (обход и хеширование выполняются в пулах потоков)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Начало нового измерения (запуск сканирования ресурса)"""
+        with self._lock:
+            self.started = time.perf_counter()
+            self.phases: Dict[str, Histogram] = {}
+            self.counters: Dict[str, int] = {}
+            self.gauges: Dict[str, float] = {}
+
+    def observe(self, phase: str, seconds: float) -> None:
+        """Учет одного выполнения фазы длительностью seconds"""
+        with self._lock:
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, phase: str) -> Iterator[None]:
+        """Измерение длительности блока как одного выполнения фазы"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start)
+
+    def add(self, counter: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def set(self, gauge: str, value: float) -> None:
+        with self._lock:
+            self.gauges[gauge] = value
+
+    def elapsed(self) -> float:
+        """Время с начала измерения, секунды"""
+        return time.perf_counter() - self.started
+
+    def rates(self) -> Dict[str, float]:
+        """Производные скорости RATES (в единицах счетчика в секунду)"""
+        elapsed = self.elapsed()
+        result = {}
+        with self._lock:
+            for name, counters, phases in RATES:
+                value = sum(self.counters.get(counter, 0) for counter in counters)
+                if phases is None:
+                    seconds = elapsed
+                else:
+                    seconds = sum(self.phases[phase].sum for phase in phases if phase in self.phases)
+                if value and seconds > 0:
+                    result[name] = round(value / seconds, 3)
+        return result
+
+    def to_dict(self) -> dict:
+        """Метрики в виде словаря для JSON (scan_run.metrics, --metrics-json)"""
+        rates = self.rates()
+        with self._lock:
+            return {
+                'elapsed_seconds': round(self.elapsed(), 6),
+                'phases': {name: histogram.to_dict() for name, histogram in sorted(self.phases.items())},
+                'counters': dict(sorted(self.counters.items())),
+                'gauges': dict(sorted(self.gauges.items())),
+                'rates': rates,
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self, labels: Optional[Dict[str, str]] = None) -> str:
+        """Метрики в текстовом формате Prometheus (для textfile collector node_exporter)"""
+        base = _format_labels(labels or {})
+        rates = self.rates()
+        lines = []
+        with self._lock:
+            name = f"{PROMETHEUS_PREFIX}_phase_seconds"
+            lines.append(f"# HELP {name} Duration of scan phases (per batch, directory listing or database call)")
+            lines.append(f"# TYPE {name} histogram")
+            for phase, histogram in sorted(self.phases.items()):
+                phase_labels = _join_labels(base, f'phase="{_escape(phase)}"')
+                for bound, count in histogram.cumulative():
+                    bucket_labels = _join_labels(phase_labels, f'le="{bound}"')
+                    lines.append(f"{name}_bucket{{{bucket_labels}}} {count}")
+                lines.append(f"{name}_sum{{{phase_labels}}} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{{{phase_labels}}} {histogram.count}")
+
+            for counter, value in sorted(self.counters.items()):
+                name = f"{PROMETHEUS_PREFIX}_{counter}_total"
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name}{_braces(base)} {value}")
+
+            for gauge, value in sorted(self.gauges.items()):
+                name = f"{PROMETHEUS_PREFIX}_{gauge}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name}{_braces(base)} {value}")
+
+        name = f"{PROMETHEUS_PREFIX}_elapsed_seconds"
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name}{_braces(base)} {self.elapsed():.6f}")
+        for rate, value in sorted(rates.items()):
+            name = f"{PROMETHEUS_PREFIX}_{rate}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{_braces(base)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    """Экранирование значения метки Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+def _join_labels(*parts: str) -> str:
+    return ','.join(part for part in parts if part)
+
+
+def _braces(labels: str) -> str:
+    return f"{{{labels}}}" if labels else ''
+
+
+def write_metrics(metrics: ScanMetrics, json_path: Optional[str] = None, prometheus_path: Optional[str] = None,
+                  labels: Optional[Dict[str, str]] = None) -> None:
+    """
+    Выгрузка метрик в файлы JSON и/или Prometheus.
+    Файл Prometheus записывается через временный файл и переименование,
+    чтобы textfile collector не прочитал его частично
+    """
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            f.write(metrics.to_json())
+    if prometheus_path:
+        tmp_path = f"{prometheus_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(metrics.to_prometheus(labels))
+        os.replace(tmp_path, prometheus_path)
+
+
+@contextmanager
+def profiling(metrics: ScanMetrics, profile_path: Optional[str] = None, trace_memory: bool = False,
+              top: int = 20) -> Iterator[None]:
+    """
+    Профилирование блока: cProfile с сохранением статистики в profile_path (просмотр - python -m pstats)
+    и/или tracemalloc с записью пикового объема памяти в метрики и выводом в лог мест наибольших выделений
+    """
+    profiler = cProfile.Profile() if profile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            logger.info(f"Profile saved to {profile_path}")
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            metrics.set('memory_current_bytes', current)
+            metrics.set('memory_peak_bytes', peak)
+            statistics = snapshot.statistics('lineno')[:top]
+            logger.info(
+                f"Memory: current {current:,} bytes, peak {peak:,} bytes. Top allocations:\n" +
+                '\n'.join(f"  {stat}" for stat in statistics)
+            )
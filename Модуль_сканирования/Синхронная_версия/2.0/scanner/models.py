@@ -1,8 +1,10 @@
 # scanner/models.py
 
+from array import array
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
+from itertools import repeat
+from typing import Iterator, List, Optional, Tuple
 
 @dataclass
 class InformationResource:
@@ -11,33 +13,115 @@ class InformationResource:
     name: str
     description: str
 
-@dataclass
-class DirectoryItem:
-    information_resource_s: int
-    directory_s: Optional[int] = None
-    parent_directory_s: Optional[int] = None
-    name: str = ''
-    relative_path: str = ''
-    nesting_level: int = 0
-    first_discovered: datetime = None
-    owner: str = ''
-    is_actual: bool = True
+class DirectoryBatch:
+    """
+    Пакет директорий для сохранения в БД в колоночном представлении (параллельные массивы).
+    Ресурс, время обнаружения и запуск сканирования общие для пакета, метки времени хранятся
+    в микросекундах от эпохи, относительные пути интернированы сканером и разделяются всеми элементами
+    одного каталога. parent_directory_s заполняется сканером непосредственно перед сохранением пакета
+    """
+    __slots__ = ('information_resource_s', 'first_discovered', 'scan_run_s', 'parent_directory_s', 'name',
+                 'relative_path', 'nesting_level', 'owner', 'modification_time', 'changes')
+
+    def __init__(self, information_resource_s: int, first_discovered: int, scan_run_s: Optional[int] = None):
+        self.information_resource_s = information_resource_s
+        self.first_discovered = first_discovered
+        # Запуск, в котором элемент видели последним (last_seen_scan_run_s)
+        self.scan_run_s = scan_run_s
+        self.parent_directory_s: List[Optional[int]] = []
+        self.name: List[str] = []
+        self.relative_path: List[str] = []
+        self.nesting_level: List[int] = []
+        self.owner: List[str] = []
+        self.modification_time = array('q')
+        # Элементы, для которых нужно записать изменение: (индекс в пакете, тип изменения)
+        self.changes: List[Tuple[int, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.name)
+
+    def append(self, name: str, relative_path: str, nesting_level: int, owner: str,
+               modification_time: int, change_type: Optional[str] = None) -> None:
+        if change_type is not None:
+            self.changes.append((len(self.name), change_type))
+        self.name.append(name)
+        self.relative_path.append(relative_path)
+        self.nesting_level.append(nesting_level)
+        self.owner.append(owner)
+        self.modification_time.append(modification_time)
+
+    def rows(self) -> Iterator[tuple]:
+        """Строки в порядке DIRECTORY_COLUMNS (формируются по одной при передаче в БД)"""
+        return zip(repeat(self.information_resource_s), self.parent_directory_s, self.name,
+                   self.relative_path, self.nesting_level, repeat(self.first_discovered),
+                   self.owner, repeat(True), self.modification_time, repeat(self.scan_run_s))
+
+
+class FileBatch:
+    """
+    Пакет файлов для сохранения в БД в колоночном представлении (параллельные массивы).
+    Ресурс, время обнаружения и запуск сканирования общие для пакета, метки времени хранятся
+    в микросекундах от эпохи, относительные пути, расширения и владельцы интернированы сканером.
+    directory_s заполняется сканером непосредственно перед сохранением пакета
+    """
+    __slots__ = ('information_resource_s', 'first_discovered', 'scan_run_s', 'directory_s', 'name',
+                 'relative_path', 'extension', 'size_bytes', 'creation_time', 'modification_time', 'owner',
+                 'nesting_level', 'changes')
+
+    def __init__(self, information_resource_s: int, first_discovered: int, scan_run_s: Optional[int] = None):
+        self.information_resource_s = information_resource_s
+        self.first_discovered = first_discovered
+        # Запуск, в котором элемент видели последним (last_seen_scan_run_s)
+        self.scan_run_s = scan_run_s
+        self.directory_s: List[Optional[int]] = []
+        self.name: List[str] = []
+        self.relative_path: List[str] = []
+        self.extension: List[str] = []
+        self.size_bytes = array('q')
+        self.creation_time = array('q')
+        self.modification_time = array('q')
+        self.owner: List[str] = []
+        self.nesting_level: List[int] = []
+        # Элементы, для которых нужно записать изменение: (индекс в пакете, тип изменения)
+        self.changes: List[Tuple[int, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.name)
+
+    def append(self, name: str, relative_path: str, extension: str, size_bytes: int,
+               creation_time: int, modification_time: int, owner: str, nesting_level: int,
+               change_type: Optional[str] = None) -> None:
+        if change_type is not None:
+            self.changes.append((len(self.name), change_type))
+        self.name.append(name)
+        self.relative_path.append(relative_path)
+        self.extension.append(extension)
+        self.size_bytes.append(size_bytes)
+        self.creation_time.append(creation_time)
+        self.modification_time.append(modification_time)
+        self.owner.append(owner)
+        self.nesting_level.append(nesting_level)
+
+    def rows(self) -> Iterator[tuple]:
+        """Строки в порядке FILE_COLUMNS (формируются по одной при передаче в БД)"""
+        return zip(repeat(self.information_resource_s), self.directory_s, self.name, self.relative_path,
+                   self.extension, self.size_bytes, self.creation_time, self.modification_time,
+                   repeat(self.first_discovered), self.owner, repeat(True), self.nesting_level,
+                   repeat(self.scan_run_s))
 
 @dataclass
-class FileItem:
-    information_resource_s: int
-    file_s: Optional[int] = None
-    directory_s: Optional[int] = None
-    name: str = ''
-    relative_path: str = ''
-    extension: str = ''
-    size_bytes: int = 0
-    creation_time: datetime = None
-    modification_time: datetime = None
-    first_discovered: datetime = None
-    owner: str = ''
-    is_actual: bool = True
-    nesting_level: int = 0
+class ScanCheckpoint:
+    """
+    Контрольная точка полного сканирования (scan_checkpoint): фронт обхода - полные пути
+    ("<relative_path>/<name>") сохраненных каталогов, содержимое которых еще не прочитано,
+    и итоги по каталогам, обработанным до фиксации контрольной точки
+    """
+    scan_run_s: int
+    frontier: List[str]
+    total_directories: int = 0
+    total_files: int = 0
+    total_size: int = 0
+    syscalls: int = 0
 
 @dataclass
 class ScanResult:
@@ -47,3 +131,56 @@ class ScanResult:
     start_time: datetime
     end_time: datetime
     errors: list
+    # Число системных вызовов к файловой системе (scandir/stat) за сканирование
+    syscalls: int = 0
+    # Изменения, обнаруженные инкрементальным сканированием
+    created_items: int = 0
+    modified_items: int = 0
+    deleted_items: int = 0
+    # Метрики этапов сканирования (ScanMetrics.to_dict), сохраняются в scan_run.metrics
+    metrics: Optional[dict] = None
+    # Сканирование прервано критической ошибкой: признак is_actual не финализируется,
+    # запуск можно продолжить с последней контрольной точки
+    interrupted: bool = False
+
+    @property
+    def syscalls_per_entry(self) -> float:
+        """Среднее число системных вызовов на один каталог или файл"""
+        entries = self.total_directories + self.total_files
+        return self.syscalls / entries if entries else 0.0
+
+
+@dataclass
+class NsiDictionaryChange:
+    """Изменения справочника при синхронизации с НСИ (nsi_sync_change)"""
+    dictionary_s: int
+    code: str
+    inserted: int
+    updated: int
+    deactivated: int
+    links_changed: int
+    # Правила эталонной структуры, проверяемые по справочнику (результаты проверки по ним могут измениться)
+    affected_rules: int
+
+
+@dataclass
+class NsiSyncResult:
+    nsi_sync_run_s: int
+    # Прочитано записей выгрузки
+    records: int
+    errors: list
+    changes: List[NsiDictionaryChange]
+
+
+@dataclass
+class AnalysisResult:
+    """Итоги анализа корректности данных ресурса (analysis_run)"""
+    information_resource_s: int
+    analysis_run_s: int
+    # Последний завершенный запуск сканирования на момент анализа
+    scan_run_s: int
+    total_directories: int
+    total_files: int
+    total_size: int
+    percent_compliance: float
+    finding_count: int
@@ -0,0 +1,122 @@
+# scanner/nsi_import.py
+
+import io
+import json
+import logging
+import urllib.request
+from contextlib import contextmanager
+from typing import Iterator, TextIO
+from .models import NsiSyncResult
+from .database import Database
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def open_export(source: str) -> Iterator[TextIO]:
+    """
+    Поток строк выгрузки НСИ: файл или адрес HTTP(S) сервиса выгрузки (читается по мере разбора,
+    без загрузки ответа в память)
+    """
+    if source.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(source) as response:
+            yield io.TextIOWrapper(response, encoding='utf-8')
+    else:
+        with open(source, encoding='utf-8') as f:
+            yield f
+
+
+class NsiImporter:
+    """
+    Дифференциальная загрузка справочников из выгрузки НСИ в nsi_data/nsi_data_x.
+
+    Выгрузка - JSON Lines, по одной записи в строке:
+      {"dictionary": "<код>", "name": "<наименование>", "description": ...}       - справочник;
+      {"dictionary": "<код>", "id": "<ID значения>", "name": "<наименование>",
+       "types": {...}, "attributes": {...},
+       "depends_on": [{"dictionary": "<код>", "id": "<ID>"}, ...]}                 - значение справочника.
+    Выгрузка содержит полный состав своих справочников: значения, отсутствующие в ней, становятся
+    неактуальными, поэтому выгрузка с некорректными записями не применяется (запуск завершается ошибкой):
+    иначе значения из некорректных строк стали бы неактуальными. Записи загружаются порциями через COPY
+    во временные таблицы и сливаются с nsi_data одной транзакцией (nsi_apply_stage), изменяются только
+    отличающиеся строки
+    """
+
+    def __init__(self, db: Database, chunk_size: int = 10000):
+        self.db = db
+        self.metrics = db.metrics
+        self.chunk_size = chunk_size
+
+    def import_export(self, source: str) -> NsiSyncResult:
+        """Загрузка выгрузки source (файл или адрес HTTP(S)), возвращает изменения по справочникам"""
+        nsi_sync_run_s = self.db.start_nsi_sync(source)
+        records = 0
+        errors = []
+        buffers = {'_nsi_stage_dictionary': [], '_nsi_stage_data': [], '_nsi_stage_link': []}
+
+        try:
+            self.db.create_nsi_stage()
+            with open_export(source) as export:
+                for line_no, line in enumerate(export, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        self._stage_record(line_no, json.loads(line), buffers)
+                        records += 1
+                    except (ValueError, TypeError, KeyError, AttributeError) as e:
+                        error_msg = f"Invalid NSI record at line {line_no}: {str(e)}"
+                        logger.error(error_msg)
+                        errors.append(error_msg)
+                    if line_no % self.chunk_size == 0:
+                        self._flush(buffers)
+            self._flush(buffers)
+
+            # Неполный состав справочников сделал бы неактуальными значения некорректных записей
+            if errors:
+                raise ValueError(f"{len(errors)} invalid records, export is not applied")
+
+            with self.metrics.timer('nsi_apply'):
+                changes = self.db.apply_nsi_stage(nsi_sync_run_s, records, len(errors))
+
+        except Exception as e:
+            error_msg = f"Error importing NSI export {source}: {str(e)}"
+            logger.error(error_msg)
+            errors.append(error_msg)
+            self.db.fail_nsi_sync(nsi_sync_run_s, records, len(errors))
+            return NsiSyncResult(nsi_sync_run_s, records, errors, [])
+
+        self.metrics.add('nsi_records', records)
+        return NsiSyncResult(nsi_sync_run_s, records, errors, changes)
+
+    @staticmethod
+    def _stage_record(line_no: int, record: dict, buffers: dict) -> None:
+        """Разбор записи выгрузки в строки таблиц загрузки"""
+        code = str(record['dictionary'])
+        if 'id' not in record:
+            buffers['_nsi_stage_dictionary'].append(
+                (line_no, code, str(record.get('name') or code), record.get('description')))
+            return
+
+        entity_id = str(record['id'])
+        name = record['name']
+        if not entity_id.strip() or not str(name).strip():
+            raise ValueError("empty id or name")
+        types = record.get('types')
+        attributes = record.get('attributes')
+        # Связи разбираются до добавления значения: некорректная запись не загружается частично
+        links = [(code, entity_id, str(dependency.get('dictionary', code)), str(dependency['id']))
+                 for dependency in record.get('depends_on') or ()]
+        buffers['_nsi_stage_data'].append((
+            line_no, code, entity_id, str(name),
+            json.dumps(types, ensure_ascii=False) if types is not None else None,
+            json.dumps(attributes, ensure_ascii=False) if attributes is not None else None
+        ))
+        buffers['_nsi_stage_link'].extend(links)
+
+    def _flush(self, buffers: dict) -> None:
+        """Загрузка накопленных строк через COPY (фаза nsi_copy)"""
+        with self.metrics.timer('nsi_copy'):
+            for table, rows in buffers.items():
+                self.db.copy_nsi_stage(table, rows)
+                rows.clear()
+
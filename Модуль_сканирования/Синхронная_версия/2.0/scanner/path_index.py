@@ -0,0 +1,141 @@
+# scanner/path_index.py
+
+import os
+import sqlite3
+import tempfile
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+class PathIndex(ABC):
+    """
+    Индекс "полный путь каталога -> directory_s" на время сканирования ресурса.
+    Ключ - "<relative_path>/<name>" каталога, совпадающий с relative_path его элементов.
+    Сканер удаляет из индекса каталоги, обработка которых завершена (discard),
+    поэтому в индексе остаются только открытые поддеревья обхода
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[int]:
+        """directory_s каталога по ключу (None - нет в индексе)"""
+
+    @abstractmethod
+    def __setitem__(self, key: str, directory_s: int) -> None:
+        """Добавление каталога в индекс"""
+
+    @abstractmethod
+    def discard(self, keys: Iterable[str]) -> None:
+        """Удаление каталогов из индекса (отсутствующие ключи пропускаются)"""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Число каталогов в индексе"""
+
+    def close(self) -> None:
+        """Освобождение ресурсов индекса"""
+
+
+class MemoryPathIndex(PathIndex):
+    """Индекс в памяти процесса"""
+
+    def __init__(self):
+        self.items: Dict[str, int] = {}
+
+    def get(self, key: str) -> Optional[int]:
+        return self.items.get(key)
+
+    def __setitem__(self, key: str, directory_s: int) -> None:
+        self.items[key] = directory_s
+
+    def discard(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            self.items.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class SqlitePathIndex(PathIndex):
+    """
+    Индекс во временном файле SQLite (для деревьев, открытая часть которых не помещается в память).
+    Файл не журналируется и удаляется при закрытии индекса
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        fd, self.path = tempfile.mkstemp(prefix='path_index_', suffix='.sqlite', dir=directory)
+        os.close(fd)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute("CREATE TABLE path_index (path TEXT PRIMARY KEY, directory_s INTEGER NOT NULL)")
+
+    def get(self, key: str) -> Optional[int]:
+        row = self.conn.execute("SELECT directory_s FROM path_index WHERE path = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def __setitem__(self, key: str, directory_s: int) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO path_index (path, directory_s) VALUES (?, ?)", (key, directory_s))
+
+    def discard(self, keys: Iterable[str]) -> None:
+        self.conn.executemany("DELETE FROM path_index WHERE path = ?", ((key,) for key in keys))
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM path_index").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            logger.warning(f"Error removing path index file {self.path}: {str(e)}")
+
+
+class SpillingPathIndex(PathIndex):
+    """
+    Индекс в памяти с ограничением числа записей: при превышении limit новые записи
+    сохраняются во временный файл SQLite, который создается при первом переполнении
+    """
+
+    def __init__(self, limit: int, directory: Optional[str] = None):
+        self.limit = limit
+        self.directory = directory
+        self.memory = MemoryPathIndex()
+        self.disk: Optional[SqlitePathIndex] = None
+
+    def get(self, key: str) -> Optional[int]:
+        directory_s = self.memory.get(key)
+        if directory_s is None and self.disk is not None:
+            directory_s = self.disk.get(key)
+        return directory_s
+
+    def __setitem__(self, key: str, directory_s: int) -> None:
+        if len(self.memory) < self.limit or key in self.memory.items:
+            self.memory[key] = directory_s
+            return
+        if self.disk is None:
+            logger.info(f"Path index exceeded {self.limit} entries, spilling to disk")
+            self.disk = SqlitePathIndex(self.directory)
+        self.disk[key] = directory_s
+
+    def discard(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        self.memory.discard(keys)
+        if self.disk is not None:
+            self.disk.discard(keys)
+
+    def __len__(self) -> int:
+        return len(self.memory) + (len(self.disk) if self.disk is not None else 0)
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+
+def create_path_index(limit: int = 0) -> PathIndex:
+    """Индекс путей каталогов: limit - число записей в памяти до выгрузки на диск (0 - без ограничения)"""
+    if limit > 0:
+        return SpillingPathIndex(limit)
+    return MemoryPathIndex()
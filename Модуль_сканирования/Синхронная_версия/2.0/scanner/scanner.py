@@ -1,191 +1,944 @@
 # scanner/scanner.py
 
 import os
+import queue
+import stat
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 import logging
-from .models import InformationResource, DirectoryItem, FileItem, ScanResult
+from .models import InformationResource, DirectoryBatch, FileBatch, ScanCheckpoint, ScanResult
 from .database import Database
+from .path_index import PathIndex, MemoryPathIndex, create_path_index
 
 logger = logging.getLogger(__name__)
 
+
+def branch_path(resource: InformationResource, branch: Optional[str]) -> Optional[str]:
+    """
+    Полный путь (directory.full_path) корневого каталога ветви branch ресурса.
+    branch - путь относительно корневого каталога ресурса; None - сканируется весь ресурс
+    """
+    if not branch:
+        return None
+    root_path = os.path.normpath(os.path.join(resource.path, resource.name))
+    walk_root = os.path.normpath(os.path.join(root_path, branch))
+    if walk_root == root_path:
+        return None
+    if os.path.commonpath([root_path, walk_root]) != root_path:
+        raise ValueError(f"Branch {branch} is outside of resource root {root_path}")
+    return os.path.join('.', os.path.relpath(walk_root, resource.path))
+
+
 class FilesystemScanner:
-    def __init__(self, db: Database, batch_size: int = 5000):
+    def __init__(self, db: Database, batch_size: int = 5000, walk_workers: int = 1,
+                 incremental: bool = False, pipeline_depth: int = 0, path_index_limit: int = 0,
+                 checkpoint_interval: float = 0, write_sessions: int = 0):
         self.db = db
+        # Метрики этапов сканирования общие с подключением к БД
+        self.metrics = db.metrics
         self.batch_size = batch_size
-        self.directories: List[DirectoryItem] = []
-        self.files: List[FileItem] = []
+        # Количество потоков обхода дерева каталогов (1 - последовательный обход)
+        self.walk_workers = max(1, walk_workers)
+        # Инкрементальный режим: сравнение с сохраненным состоянием и запись только изменений
+        self.incremental = incremental
+        # Размер очереди конвейера обход -> запись в БД в каталогах (0 - без конвейера)
+        self.pipeline_depth = max(0, pipeline_depth)
+        # Интервал сохранения контрольных точек полного сканирования в секундах (0 - без контрольных точек)
+        self.checkpoint_interval = max(0, checkpoint_interval)
+        # Число сессий пула соединений, записывающих пакеты файлов полного сканирования в фоне
+        # (0 - запись в соединении сканера); пул должен вмещать их вместе с соединением сканера
+        self.write_sessions = max(0, write_sessions)
+        self._file_writer: Optional[ThreadPoolExecutor] = None
+        self._file_writes: List[Future] = []
+        self._writer_local = threading.local()
+        self._writer_sessions: List[Database] = []
+        # Текущие пакеты (создаются в начале сканирования ресурса)
+        self.directories: Optional[DirectoryBatch] = None
+        self.files: Optional[FileBatch] = None
         self.root_path = ''
-        # Словарь для хранения пути к директории и её ID
-        self.path_to_dir_id: Dict[str, int] = {}
+        # Каталог, с которого начинается обход (корень ресурса или корень сканируемой ветви)
+        self.walk_root = ''
+        # Каталоги, с которых начинается обход: корень обхода или фронт контрольной точки
+        self._walk_start: List[str] = []
+        # Фронт обхода: сохраненные каталоги, содержимое которых еще не обработано (для контрольных точек)
+        self._frontier: Dict[str, None] = {}
+        # Итоги, учтенные до начала обхода (корень или контрольная точка), и время последней контрольной точки
+        self._checkpoint_base: Tuple[int, int, int] = (0, 0, 0)
+        self._last_checkpoint = 0.0
+        # Время начала сканирования в микросекундах от эпохи (first_discovered новых элементов)
+        self.discovered_at = 0
+        # Последний обработанный каталог: (путь, relative_path и nesting_level его элементов)
+        self._dir_context: Tuple[str, str, int] = ('', '', 0)
+        # Индекс пути к директории и её ID: хранит только каталоги, обработка которых не завершена
+        # path_index_limit - число записей в памяти до выгрузки индекса на диск (0 - без ограничения)
+        self.path_index_limit = max(0, path_index_limit)
+        self.path_to_dir_id: PathIndex = MemoryPathIndex()
+        # Обработанные каталоги, которые удаляются из индекса после сохранения их файлов
+        self._finished_dirs: List[str] = []
+        # Число системных вызовов к файловой системе (scandir/stat) за текущее сканирование
+        self.syscalls = 0
+        # Состояние инкрементального сканирования
+        self.resource_id = None
+        self.scan_run_s = None
+        self.created_items = 0
+        self.modified_items = 0
+        self.deleted_items = 0
+
+    def _new_batches(self, resource: InformationResource) -> None:
+        """Создание пустых пакетов директорий и файлов ресурса"""
+        self.directories = DirectoryBatch(resource.information_resource_s, self.discovered_at, self.scan_run_s)
+        self.files = FileBatch(resource.information_resource_s, self.discovered_at, self.scan_run_s)
 
     def _flush_directories(self):
-        """Сохранение накопленных директорий в БД и получение их ID"""
-        if self.directories:
-            path_to_id = self.db.save_directories_bulk(self.directories)
-            # Объединяем полученные ID с нашим словарем
-            # print(f"path_to_id={path_to_id}")
-            self.path_to_dir_id.update(path_to_id)
-            self.directories = []
+        """Сохранение накопленных директорий в БД и получение их ID (фаза flush_directories)"""
+        batch = self.directories
+        if not len(batch):
+            return
+        with self.metrics.timer('flush_directories'):
+            # ID родительских директорий известны к моменту сохранения пакета:
+            # родитель всегда сохраняется раньше своих подкаталогов
+            batch.parent_directory_s = self._resolve_directory_ids(batch.relative_path)
+            self.db.save_directories_bulk(batch, self.path_to_dir_id)
+            if batch.changes:
+                self._save_changes('directory', [
+                    (self.path_to_dir_id.get(f"{batch.relative_path[i]}/{batch.name[i]}"),
+                     batch.relative_path[i], batch.name[i], change_type)
+                    for i, change_type in batch.changes
+                ])
+        self.directories = DirectoryBatch(batch.information_resource_s, batch.first_discovered, batch.scan_run_s)
 
     def _flush_files(self):
-        # print(f"self.files={self.files}")
-        """Сохранение накопленных файлов в БД"""
-        if self.files:
-            self.db.save_files_bulk(self.files)
-            self.files = []
+        """Сохранение накопленных файлов в БД (фаза flush_files)"""
+        batch = self.files
+        if not len(batch):
+            return
+        if self._file_writer is not None:
+            # ID каталогов определяются до передачи пакета: после этого каталоги можно удалить из индекса
+            batch.directory_s = self._resolve_directory_ids(batch.relative_path)
+            self._submit_file_batch(batch)
+        else:
+            with self.metrics.timer('flush_files'):
+                batch.directory_s = self._resolve_directory_ids(batch.relative_path)
+                path_to_id = self.db.save_files_bulk(batch)
+                if batch.changes:
+                    self._save_changes('file', [
+                        (path_to_id.get(f"{batch.relative_path[i]}/{batch.name[i]}"),
+                         batch.relative_path[i], batch.name[i], change_type)
+                        for i, change_type in batch.changes
+                    ])
+        self.files = FileBatch(batch.information_resource_s, batch.first_discovered, batch.scan_run_s)
+        self._release_finished_directories()
+
+    def _start_file_writer(self) -> None:
+        """
+        Запуск фоновой записи пакетов файлов сессиями пула (полное сканирование с фиксацией каждого пакета:
+        каталоги пакета к моменту записи зафиксированы соединением сканера)
+        """
+        if self.write_sessions and not self.incremental and self.db.commit_per_batch:
+            self._file_writer = ThreadPoolExecutor(self.write_sessions, thread_name_prefix='file-writer')
+
+    def _write_file_batch(self, batch: FileBatch) -> None:
+        """Запись пакета файлов сессией пула, закрепленной за потоком записи (фаза flush_files)"""
+        session = getattr(self._writer_local, 'db', None)
+        if session is None:
+            session = self._writer_local.db = self.db.session()
+            self._writer_sessions.append(session)
+        with self.metrics.timer('flush_files'):
+            session.save_files_bulk(batch)
+
+    def _submit_file_batch(self, batch: FileBatch) -> None:
+        """
+        Передача пакета файлов на фоновую запись. В памяти не больше write_sessions пакетов в записи:
+        при их заполнении ожидается завершение одного из них. Ошибка записи прерывает сканирование
+        """
+        while len(self._file_writes) >= self.write_sessions:
+            wait(self._file_writes, return_when=FIRST_COMPLETED)
+            self._collect_file_writes()
+        self._collect_file_writes()
+        self._file_writes.append(self._file_writer.submit(self._write_file_batch, batch))
+
+    def _collect_file_writes(self, wait_all: bool = False) -> None:
+        """Проверка завершенных фоновых записей (при wait_all - ожидание всех): ошибка записи передается дальше"""
+        if wait_all and self._file_writes:
+            wait(self._file_writes)
+        done = [future for future in self._file_writes if future.done()]
+        self._file_writes = [future for future in self._file_writes if not future.done()]
+        for future in done:
+            future.result()
+
+    def _stop_file_writer(self) -> None:
+        """Завершение фоновой записи: ожидание начатых записей и возврат сессий в пул"""
+        if self._file_writer is None:
+            return
+        self._file_writer.shutdown(wait=True)
+        self._file_writer = None
+        self._file_writes = []
+        for session in self._writer_sessions:
+            session.close()
+        self._writer_sessions = []
+        self._writer_local = threading.local()
+
+    def _resolve_directory_ids(self, relative_paths: List[str]) -> List[Optional[int]]:
+        """
+        ID каталогов для столбца relative_path пакета.
+        Элементы одного каталога идут в пакете подряд, поэтому индекс запрашивается один раз на каталог
+        """
+        ids = []
+        last_path = None
+        last_id = None
+        for rel_path in relative_paths:
+            if rel_path != last_path:
+                last_path = rel_path
+                last_id = self._get_parent_directory_id(rel_path) if rel_path != '.' else None
+            ids.append(last_id)
+        return ids
+
+    def _finish_directory(self, resource: InformationResource, dir_path: str) -> None:
+        """
+        Завершение обработки каталога: его подкаталоги сохранены, поэтому ID каталога
+        нужен только для еще не сохраненных файлов и удаляется из индекса после их сохранения
+        """
+        self._finished_dirs.append(self._directory_context(resource, dir_path)[0])
+        if not len(self.files):
+            self._release_finished_directories()
+
+    def _release_finished_directories(self) -> None:
+        """Удаление из индекса путей обработанных каталогов, файлы которых сохранены"""
+        if self._finished_dirs:
+            self.path_to_dir_id.discard(self._finished_dirs)
+            self._finished_dirs = []
+
+    def _advance_frontier(self, dir_path: str, dirs: list) -> None:
+        """Каталог dir_path обработан: он удаляется из фронта обхода, его подкаталоги добавляются"""
+        if not self.checkpoint_interval:
+            return
+        self._frontier.pop(dir_path, None)
+        for dirname, _, is_symlink in dirs:
+            if not is_symlink:
+                self._frontier[os.path.join(dir_path, dirname)] = None
+
+    def _checkpoint(self, resource: InformationResource, total_directories: int, total_files: int,
+                    total_size: int) -> None:
+        """
+        Сохранение контрольной точки полного сканирования не чаще checkpoint_interval секунд (фаза checkpoint).
+        Вызывается между каталогами: элементы обработанных каталогов к этому моменту сохранены,
+        каталоги фронта записаны в directory, поэтому обход можно продолжить с фронта
+        """
+        if not self.checkpoint_interval or self.incremental or self.scan_run_s is None:
+            return
+        now = time.monotonic()
+        if now - self._last_checkpoint < self.checkpoint_interval:
+            return
+        # Конвейерный режим сохраняет файлы полными пакетами: дописываем файлы обработанных каталогов
+        self._flush_files()
+        self._collect_file_writes(wait_all=True)
+        directories, files, size = self._checkpoint_base
+        with self.metrics.timer('checkpoint'):
+            self.db.save_checkpoint(
+                self.scan_run_s, self.resource_id,
+                [os.path.join('.', os.path.relpath(path, resource.path)) for path in self._frontier],
+                directories + total_directories, files + total_files, size + total_size, self.syscalls)
+        self._last_checkpoint = now
+
+    def _load_checkpoint(self, resource: InformationResource, checkpoint: ScanCheckpoint, errors: list) -> None:
+        """Продолжение обхода с фронта контрольной точки: ID каталогов фронта загружаются из БД"""
+        ids = self.db.get_directory_ids(resource.information_resource_s, checkpoint.frontier)
+        self._walk_start = []
+        for key in checkpoint.frontier:
+            directory_s = ids.get(key)
+            if directory_s is None:
+                error_msg = f"Checkpoint directory {key} is not found"
+                logger.error(error_msg)
+                errors.append(error_msg)
+                continue
+            self.path_to_dir_id[key] = directory_s
+            self._walk_start.append(os.path.normpath(os.path.join(resource.path, key)))
+        logger.info(f"Resuming scan run {checkpoint.scan_run_s} from {len(self._walk_start)} pending directories")
+
+    def _save_changes(self, object_type: str, changes: list) -> None:
+        """
+        Запись в журнал изменений сохраненных элементов:
+        changes - список (ID, relative_path, name, тип изменения)
+        """
+        rows = []
+        for object_s, relative_path, name, change_type in changes:
+            if object_s is None:
+                continue
+            rows.append((object_type, object_s, change_type, relative_path, name))
+            if change_type == 'created':
+                self.created_items += 1
+            else:
+                self.modified_items += 1
+        self.db.save_scan_changes(self.scan_run_s, self.resource_id, rows)
 
     def _get_parent_directory_id(self, parent_path: str) -> int:
         """Получение ID родительской директории по пути"""
         return self.path_to_dir_id.get(parent_path)
 
-    def _add_directory(self, resource: InformationResource, dir_path: str, dir_name: str) -> None:
+    def _directory_context(self, resource: InformationResource, dir_path: str) -> Tuple[str, int]:
         """
-        Добавление директории в список для последующего сохранения
-        abs_path - абсолютный путь к директории
+        relative_path и nesting_level элементов каталога dir_path.
+        Элементы одного каталога обрабатываются подряд, поэтому путь вычисляется один раз на каталог
+        и интернируется: все записи каталога в пакетах ссылаются на одну строку
         """
-        # Получаем относительный путь от корня информационного ресурса
-        abs_path = os.path.join(dir_path, dir_name)
-        if abs_path == self.root_path:
-            rel_path = '.'
-        else:
-            rel_path = os.path.join('.', os.path.relpath(dir_path, resource.path))
+        cached_path, rel_path, nesting_level = self._dir_context
+        if cached_path != dir_path:
+            rel_path = sys.intern(os.path.join('.', os.path.relpath(dir_path, resource.path)))
+            nesting_level = len(rel_path.split(os.sep)) - 1
+            self._dir_context = (dir_path, rel_path, nesting_level)
+        return rel_path, nesting_level
 
-        if rel_path == '.':
+    def _add_directory(self, resource: InformationResource, dir_path: str, dir_name: str,
+                       stat_result: os.stat_result, change_type: Optional[str] = None) -> None:
+        """
+        Добавление директории в пакет для последующего сохранения
+        stat_result - метаданные директории, полученные при чтении родительского каталога
+        change_type - тип изменения для журнала (инкрементальный режим)
+        """
+        self._append_directory(resource, dir_path, dir_name, stat_result, change_type)
+        if len(self.directories) >= self.batch_size:
+            self._flush_directories()
+
+    def _append_directory(self, resource: InformationResource, dir_path: str, dir_name: str,
+                          stat_result: os.stat_result, change_type: Optional[str] = None) -> None:
+        """Запись директории в текущий пакет (без сохранения заполненного пакета)"""
+        if os.path.join(dir_path, dir_name) == self.root_path:
             # Корневая директория
-            nesting_level = 0
-            parent_dir_s = None
+            rel_path, nesting_level = '.', 0
         else:
-            # Подкаталог
-            nesting_level = len(rel_path.split(os.sep))-1
-            # Получаем ID родительской директории
-            parent_dir_s = self.path_to_dir_id.get(rel_path)
-            # print (f"parent_dir_s={parent_dir_s}")
-
-        dir_item = DirectoryItem(
-            information_resource_s = resource.information_resource_s,
-            parent_directory_s = parent_dir_s,
+            rel_path, nesting_level = self._directory_context(resource, dir_path)
+
+        self.directories.append(
             name = dir_name,
-            relative_path = rel_path, #rel_path_without_name,
+            relative_path = rel_path,
             nesting_level = nesting_level,
-            first_discovered = datetime.now(),
-            owner = self._get_owner(abs_path),
-            is_actual=True
+            owner = self._get_owner(stat_result),
+            modification_time = stat_result.st_mtime_ns // 1000,
+            change_type = change_type
         )
 
-        self.directories.append(dir_item)
-        if len(self.directories) >= self.batch_size:
-            self._flush_directories()
+    def _add_file(self, resource: InformationResource, dir_path: str, file_name: str,
+                  stat_result: os.stat_result, change_type: Optional[str] = None) -> int:
+        """
+        Добавление файла в пакет для последующего сохранения
+        stat_result - метаданные файла, полученные при чтении каталога
+        change_type - тип изменения для журнала (инкрементальный режим)
+        Возвращает размер файла в байтах
+        """
+        size = self._append_file(resource, dir_path, file_name, stat_result, change_type)
+        if len(self.files) >= self.batch_size:
+            self._flush_files()
+        return size
+
+    def _append_file(self, resource: InformationResource, dir_path: str, file_name: str,
+                     stat_result: os.stat_result, change_type: Optional[str] = None) -> int:
+        """Запись файла в текущий пакет (без сохранения заполненного пакета), возвращает размер файла"""
+        rel_path, nesting_level = self._directory_context(resource, dir_path)
+
+        self.files.append(
+            name = file_name,
+            relative_path = rel_path,
+            extension = sys.intern(os.path.splitext(file_name)[1].lower()),
+            size_bytes = stat_result.st_size,
+            creation_time = stat_result.st_ctime_ns // 1000,
+            modification_time = stat_result.st_mtime_ns // 1000,
+            owner = self._get_owner(stat_result),
+            nesting_level = nesting_level,
+            change_type = change_type
+        )
+        return stat_result.st_size
 
+    @staticmethod
+    def _get_owner(stat_result: os.stat_result) -> str:
+        """Получение владельца файла/директории (строки интернируются: владельцев немного)"""
+        return sys.intern(str(stat_result.st_uid))
 
-    def _add_file(self, resource: InformationResource, dir_path: str, file_name: str) -> None:
+    def _list_directory(self, dir_path: str):
+        """Чтение содержимого каталога с учетом длительности в метриках (фаза list_directory)"""
+        start = time.perf_counter()
+        try:
+            return self._read_directory(dir_path)
+        finally:
+            self.metrics.observe('list_directory', time.perf_counter() - start)
+
+    @staticmethod
+    def _read_directory(dir_path: str):
         """
-        Добавление файла в список для последующего сохранения
-        abs_path - абсолютный путь к файлу
+        Чтение содержимого каталога через os.scandir.
+        Метаданные каждого элемента запрашиваются один раз (DirEntry кэширует результат stat)
+        и затем переиспользуются для записей пакетов, владельца и итогов сканирования.
+        Не обращается к БД и к состоянию сканера, поэтому может выполняться в потоках обхода.
+        Возвращает (подкаталоги, файлы, ошибки, число системных вызовов, имена с ошибкой чтения метаданных),
+        где подкаталоги - список (имя, stat, is_symlink), файлы - список (имя, stat)
         """
-        abs_path = os.path.join(dir_path, file_name)
-        # Получаем относительный путь от корня информационного ресурса
-        # rel_path = os.path.relpath(abs_path, resource.path)
-        rel_path = os.path.join('.', os.path.relpath(dir_path, resource.path))
-        # print (f"rel_path={rel_path}")
+        dirs = []
+        files = []
+        errors = []
+        failed = []
+        syscalls = 1  # os.scandir
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                try:
+                    syscalls += 1
+                    entry_stat = entry.stat()
+                    if stat.S_ISDIR(entry_stat.st_mode):
+                        dirs.append((entry.name, entry_stat, entry.is_symlink()))
+                    else:
+                        files.append((entry.name, entry_stat))
+                except Exception as e:
+                    failed.append(entry.name)
+                    errors.append(f"Error reading metadata of {entry.path}: {str(e)}")
+        return dirs, files, errors, syscalls, failed
 
-        # Определяем имя файла и его относительный путь (без имени)
-        # file_name = os.path.basename(abs_path)
-        # file_dir_path = os.path.dirname(abs_path)
-        # rel_dir_path = os.path.relpath(file_dir_path, resource.path)
+    def _walk_worker(self, tasks: queue.Queue, results: queue.Queue) -> None:
+        """Поток обхода: берет каталоги из общей очереди и возвращает их содержимое"""
+        while True:
+            dir_path = tasks.get()
+            if dir_path is None:
+                break
+            try:
+                dirs, files, errors, syscalls, _ = self._list_directory(dir_path)
+                results.put((dir_path, dirs, files, errors, syscalls, None))
+            except Exception as e:
+                results.put((dir_path, [], [], [], 1, e))
 
-        # if rel_dir_path == '.':
-        #     rel_path_without_name = ''
-        #     dir_key = os.path.basename(resource.path)
-        # else:
-        #     rel_path_without_name = rel_dir_path
-        #     dir_key = rel_dir_path + '/' + os.path.basename(file_dir_path)
+    def _process_listing(self, resource: InformationResource, dirpath: str, dirs: list, files: list,
+                         entry_errors: list, errors: list, flush_files: bool = True):
+        """
+        Добавление содержимого одного каталога в пакеты и их сохранение в БД.
+        flush_files - сохранять файлы каталога сразу (иначе - по заполнении пакета)
+        Возвращает (количество директорий, количество файлов, общий размер файлов)
+        """
+        total_directories = 0
+        total_files = 0
+        total_size = 0
 
-        # Получаем ID директории, в которой находится файл
-        directory_s = self.path_to_dir_id.get(rel_path)
-        # print (f"directory_s={directory_s}")
+        for error_msg in entry_errors:
+            logger.error(error_msg)
+            errors.append(error_msg)
 
-        # Вычисляем уровень вложенности
-        nesting_level = len(rel_path.split(os.sep)) - 1
-        # print(f"nesting_level={nesting_level}")
+        # Обработка поддиректорий
+        for dirname, dir_stat, _ in dirs:
+            try:
+                self._add_directory(resource, dirpath, dirname, dir_stat)
+                total_directories += 1
+            except Exception as e:
+                error_msg = f"Error processing directory {dirname}: {str(e)}"
+                logger.error(error_msg)
+                errors.append(error_msg)
 
-        file_stat = os.stat(abs_path)
-        creation_time = datetime.fromtimestamp(file_stat.st_ctime)
-        modification_time = datetime.fromtimestamp(file_stat.st_mtime)
+        # Сохраняем директории перед обработкой файлов и обходом подкаталогов
+        self._flush_directories()
 
-        file_item = FileItem(
-            information_resource_s = resource.information_resource_s,
-            directory_s = directory_s,
-            name = file_name,
-            relative_path = rel_path,
-            extension = os.path.splitext(file_name)[1].lower(),
-            size_bytes = file_stat.st_size,
-            creation_time = creation_time,
-            modification_time = modification_time,
-            first_discovered = datetime.now(),
-            owner = self._get_owner(abs_path),
-            is_actual = True,
-            nesting_level = nesting_level
-        )
+        # Обработка файлов
+        for filename, file_stat in files:
+            try:
+                total_size += self._add_file(resource, dirpath, filename, file_stat)
+                total_files += 1
+            except Exception as e:
+                error_msg = f"Error processing file {filename}: {str(e)}"
+                logger.error(error_msg)
+                errors.append(error_msg)
 
-        self.files.append(file_item)
-        if len(self.files) >= self.batch_size:
+        # Сохраняем файлы после обработки всех файлов в текущей директории
+        if flush_files:
             self._flush_files()
+        self._finish_directory(resource, dirpath)
+
+        return total_directories, total_files, total_size
+
+    def _scan_sequential(self, resource: InformationResource, errors: list):
+        """
+        Последовательный обход дерева каталогов в глубину (в порядке os.walk) через os.scandir.
+        Возвращает (количество директорий, количество файлов, общий размер файлов)
+        """
+        total_directories = 0
+        total_files = 0
+        total_size = 0
+
+        stack = list(self._walk_start)
+        while stack:
+            dirpath = stack.pop()
+            try:
+                dirs, files, entry_errors, syscalls, _ = self._list_directory(dirpath)
+            except Exception as e:
+                self.syscalls += 1
+                error_msg = f"Error reading directory {dirpath}: {str(e)}"
+                logger.error(error_msg)
+                errors.append(error_msg)
+                self._advance_frontier(dirpath, [])
+                continue
+            self.syscalls += syscalls
+
+            directories, files_count, size = self._process_listing(
+                resource, dirpath, dirs, files, entry_errors, errors)
+            total_directories += directories
+            total_files += files_count
+            total_size += size
+
+            # Символические ссылки на каталоги не обходим (как os.walk по умолчанию)
+            for dirname, _, is_symlink in reversed(dirs):
+                if not is_symlink:
+                    stack.append(os.path.join(dirpath, dirname))
+            self._advance_frontier(dirpath, dirs)
+            self._checkpoint(resource, total_directories, total_files, total_size)
+
+        return total_directories, total_files, total_size
+
+    def _scan_parallel(self, resource: InformationResource, errors: list):
+        """
+        Параллельный обход дерева каталогов пулом потоков с общей очередью заданий.
+        Потоки обхода только читают файловую систему; запись в БД выполняется в текущем потоке,
+        поэтому соединение с БД используется из одного потока.
+        Подкаталог ставится в очередь обхода только после сохранения его записи в БД,
+        так что родительская запись directory всегда сохраняется раньше дочерних.
+        Возвращает (количество директорий, количество файлов, общий размер файлов)
+        """
+        total_directories = 0
+        total_files = 0
+        total_size = 0
+
+        tasks = queue.Queue()
+        results = queue.Queue()
+        workers = [
+            threading.Thread(target=self._walk_worker, args=(tasks, results), daemon=True)
+            for _ in range(self.walk_workers)
+        ]
+        for worker in workers:
+            worker.start()
 
-    def _get_owner(self, path: str) -> str:
-        """Получение владельца файла/директории"""
+        for dir_path in self._walk_start:
+            tasks.put(dir_path)
+        pending = len(self._walk_start)
         try:
-            return str(os.stat(path).st_uid)
-        except:
-            return "unknown"
+            while pending:
+                dirpath, dirs, files, entry_errors, syscalls, list_error = results.get()
+                pending -= 1
+                self.syscalls += syscalls
 
-    def scan_resource(self, resource: InformationResource) -> ScanResult:
-        """Сканирование информационного ресурса"""
-        start_time = datetime.now()
+                if list_error is not None:
+                    error_msg = f"Error reading directory {dirpath}: {str(list_error)}"
+                    logger.error(error_msg)
+                    errors.append(error_msg)
+                    self._advance_frontier(dirpath, [])
+                    continue
+
+                directories, files_count, size = self._process_listing(
+                    resource, dirpath, dirs, files, entry_errors, errors)
+                total_directories += directories
+                total_files += files_count
+                total_size += size
+
+                # Символические ссылки на каталоги не обходим (как os.walk по умолчанию)
+                for dirname, _, is_symlink in dirs:
+                    if not is_symlink:
+                        tasks.put(os.path.join(dirpath, dirname))
+                        pending += 1
+                self._advance_frontier(dirpath, dirs)
+                self._checkpoint(resource, total_directories, total_files, total_size)
+        finally:
+            # Отбрасываем необработанные задания, чтобы потоки завершились без дочитывания очереди
+            while True:
+                try:
+                    tasks.get_nowait()
+                except queue.Empty:
+                    break
+            for _ in workers:
+                tasks.put(None)
+            for worker in workers:
+                worker.join()
+
+        return total_directories, total_files, total_size
+
+    def _put_segment(self, segments: queue.Queue, segment, stop: threading.Event) -> bool:
+        """Передача сегмента в очередь конвейера с ожиданием свободного места (False - конвейер остановлен)"""
+        while not stop.is_set():
+            try:
+                segments.put(segment, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _walk_producer(self, segments: queue.Queue, stop: threading.Event) -> None:
+        """
+        Стадия обхода конвейера: читает дерево каталогов без обращения к БД.
+        Содержимое каждого каталога передается одним сегментом
+        (путь, подкаталоги, файлы, ошибки, число системных вызовов) в ограниченную очередь;
+        при ее заполнении обход приостанавливается до освобождения места стадией записи.
+        В конце передается None, при критической ошибке - объект исключения
+        """
+        try:
+            stack = list(self._walk_start)
+            while stack and not stop.is_set():
+                dirpath = stack.pop()
+                try:
+                    dirs, files, entry_errors, syscalls, _ = self._list_directory(dirpath)
+                except Exception as e:
+                    segment = (dirpath, [], [], [f"Error reading directory {dirpath}: {str(e)}"], 1)
+                    self._put_segment(segments, segment, stop)
+                    continue
+
+                if not self._put_segment(segments, (dirpath, dirs, files, entry_errors, syscalls), stop):
+                    return
+
+                # Символические ссылки на каталоги не обходим (как os.walk по умолчанию)
+                for dirname, _, is_symlink in reversed(dirs):
+                    if not is_symlink:
+                        stack.append(os.path.join(dirpath, dirname))
+
+            self._put_segment(segments, None, stop)
+        except Exception as e:
+            self._put_segment(segments, e, stop)
+
+    def _scan_pipelined(self, resource: InformationResource, errors: list):
+        """
+        Конвейерное сканирование: обход файловой системы выполняется в отдельном потоке,
+        текущий поток владеет соединением с БД и записывает пакеты, так что чтение каталогов
+        и запись в БД перекрываются. Очередь между стадиями ограничена pipeline_depth сегментами.
+        Директории сохраняются после каждого сегмента (их ID нужны дочерним элементам),
+        файлы - полными пакетами.
+        Возвращает (количество директорий, количество файлов, общий размер файлов)
+        """
         total_directories = 0
         total_files = 0
         total_size = 0
-        errors = []
 
-        # print("scan_resource")
-        # print(f"resource.path={resource.path}")
+        segments = queue.Queue(maxsize=self.pipeline_depth)
+        stop = threading.Event()
+        walker = threading.Thread(target=self._walk_producer, args=(segments, stop), daemon=True)
+        walker.start()
+
         try:
-            # Сначала сканируем корневую директорию
-            self.root_path = os.path.join(resource.path, resource.name)
-            self._add_directory(resource, resource.path, resource.name)
+            while True:
+                segment = segments.get()
+                if segment is None:
+                    break
+                if isinstance(segment, Exception):
+                    raise segment
+
+                dirpath, dirs, files, entry_errors, syscalls = segment
+                self.syscalls += syscalls
+
+                directories, files_count, size = self._process_listing(
+                    resource, dirpath, dirs, files, entry_errors, errors, flush_files=False)
+                total_directories += directories
+                total_files += files_count
+                total_size += size
+                self._advance_frontier(dirpath, dirs)
+                self._checkpoint(resource, total_directories, total_files, total_size)
+
+            self._flush_files()
+        finally:
+            stop.set()
+            walker.join()
+
+        return total_directories, total_files, total_size
+
+    @staticmethod
+    def _directory_change(stored: Optional[Tuple[int, Optional[int]]], dir_stat: os.stat_result) -> Optional[str]:
+        """
+        Тип изменения каталога по сравнению с сохраненным состоянием stored
+        ((directory_s, modification_time) или None), None - не изменился
+        """
+        if stored is None:
+            return 'created'
+        if stored[1] != dir_stat.st_mtime_ns // 1000:
+            return 'modified'
+        return None
+
+    def _compare_files(self, resource: InformationResource, dirpath: str, files: list, stored_files: dict,
+                       errors: list) -> Tuple[int, int]:
+        """
+        Сравнение файлов каталога с сохраненными размером и временем изменения: новые и измененные
+        добавляются в пакет, сохраненные файлы, не найденные в files (остаются в stored_files),
+        помечаются неактуальными. files - список (имя, stat), stored_files - файлы get_directory_contents.
+        Возвращает (количество просмотренных файлов, их общий размер)
+        """
+        total_files = 0
+        total_size = 0
+        for filename, file_stat in files:
+            total_files += 1
+            total_size += file_stat.st_size
+            stored = stored_files.pop(filename, None)
+            if stored is None:
+                file_change = 'created'
+            elif (stored[1] != file_stat.st_size
+                  or stored[2] != file_stat.st_mtime_ns // 1000):
+                file_change = 'modified'
+            else:
+                continue
+            try:
+                self._add_file(resource, dirpath, filename, file_stat, file_change)
+            except Exception as e:
+                error_msg = f"Error processing file {filename}: {str(e)}"
+                logger.error(error_msg)
+                errors.append(error_msg)
+        self._flush_files()
+
+        if stored_files:
+            self.deleted_items += self.db.mark_files_deleted(
+                self.scan_run_s, self.resource_id, [stored[0] for stored in stored_files.values()])
+        return total_files, total_size
+
+    def _stat_stored_files(self, dirpath: str, stored_files: dict, errors: list) -> list:
+        """
+        Метаданные сохраненных файлов каталога, содержимое которого не читается (один stat на файл).
+        Исчезнувшие файлы остаются в stored_files (помечаются неактуальными), файлы с ошибкой чтения
+        метаданных из него удаляются. Возвращает список (имя, stat)
+        """
+        files = []
+        for filename in list(stored_files):
+            try:
+                self.syscalls += 1
+                file_stat = os.stat(os.path.join(dirpath, filename))
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                stored_files.pop(filename)
+                error_msg = f"Error reading metadata of {os.path.join(dirpath, filename)}: {str(e)}"
+                logger.error(error_msg)
+                errors.append(error_msg)
+                continue
+            if stat.S_ISDIR(file_stat.st_mode):
+                # Файл заменен каталогом: состав каталога изменился бы вместе с его mtime
+                continue
+            files.append((filename, file_stat))
+        return files
+
+    def _stat_stored_directory(self, path: str) -> Tuple[os.stat_result, bool]:
+        """
+        Метаданные сохраненного подкаталога без чтения родительского каталога: (stat, is_symlink).
+        Как при чтении каталога, метаданные символической ссылки берутся у ее цели
+        """
+        self.syscalls += 1
+        dir_stat = os.lstat(path)
+        if not stat.S_ISLNK(dir_stat.st_mode):
+            return dir_stat, False
+        self.syscalls += 1
+        return os.stat(path), True
+
+    def _push_directory(self, stack: list, dirpath: str, dirname: str, key: str, change: Optional[str],
+                        stored: Optional[Tuple[int, Optional[int]]]) -> None:
+        """
+        Добавление подкаталога в стек инкрементального обхода. ID неизменившегося каталога
+        (изменившиеся получают ID при сохранении) нужен для его элементов и хранится в индексе путей
+        до завершения его обработки, как при полном сканировании
+        """
+        if change is None:
+            self.path_to_dir_id[key] = stored[0]
+        stack.append((os.path.join(dirpath, dirname), key, change))
+
+    def _scan_incremental(self, resource: InformationResource, root_parent: str, root_name: str, root_key: str,
+                          root_stat: os.stat_result, errors: list):
+        """
+        Инкрементальный обход дерева каталогов.
+        Время изменения каталога меняется только при изменении его состава, поэтому у каталога
+        с неизменившимся mtime содержимое не читается: подкаталоги и файлы берутся из сохраненного
+        состояния и проверяются отдельным stat (подкаталоги - по mtime, файлы - по размеру и mtime,
+        так что изменения содержимого файлов на месте тоже обнаруживаются). У новых и изменившихся
+        каталогов содержимое читается и сравнивается с БД. В БД записываются только новые и измененные
+        элементы, исчезнувшие помечаются неактуальными; все изменения попадают в журнал scan_change.
+        Сохраненное состояние читается по каталогам при входе в них, поэтому в памяти держится только
+        индекс путей открытой части обхода (ограничивается path_index_limit, как при полном сканировании).
+        root_parent, root_name, root_key - родительский каталог, имя и полный путь каталога self.walk_root,
+        с которого начинается обход
+        Возвращает (количество просмотренных директорий, файлов, общий размер просмотренных файлов)
+        """
+        total_directories = 0
+        total_files = 0
+        total_size = 0
+
+        root_stored = self.db.get_directory_state(self.resource_id, root_key)
+        root_change = self._directory_change(root_stored, root_stat)
+        if root_change is not None:
+            self._add_directory(resource, root_parent, root_name, root_stat, root_change)
             self._flush_directories()
+        else:
+            self.path_to_dir_id[root_key] = root_stored[0]
+
+        stack = [(self.walk_root, root_key, root_change)]
+        while stack:
+            dirpath, key, change = stack.pop()
             total_directories += 1
+            # Сохраненное состояние содержимого загружается при входе в каталог (у нового каталога его нет)
+            # и не хранится после его обработки
+            stored_dirs = {}
+            stored_files = {}
+            directory_s = self.path_to_dir_id.get(key)
+            if change != 'created' and directory_s is not None:
+                stored_dirs, stored_files = self.db.get_directory_contents(self.resource_id, directory_s)
 
-            # Используем os.walk для обхода всей структуры каталогов
-            for dirpath, dirnames, filenames in os.walk(self.root_path):
-                # Обработка поддиректорий
-                for dirname in dirnames:
+            if change is None:
+                # Состав каталога не изменился: проверяем известные подкаталоги и файлы
+                for dirname, stored in stored_dirs.items():
+                    child_key = f"{key}/{dirname}"
                     try:
-                        self._add_directory(resource, dirpath, dirname)
-                        total_directories += 1
+                        child_stat, is_symlink = self._stat_stored_directory(os.path.join(dirpath, dirname))
+                    except FileNotFoundError:
+                        self.deleted_items += self.db.mark_directories_deleted(
+                            self.scan_run_s, self.resource_id, [child_key])
+                        continue
                     except Exception as e:
                         error_msg = f"Error processing directory {dirname}: {str(e)}"
                         logger.error(error_msg)
                         errors.append(error_msg)
-
-                # Сохраняем директории перед обработкой файлов
+                        continue
+                    child_change = self._directory_change(stored, child_stat)
+                    if child_change is not None:
+                        self._add_directory(resource, dirpath, dirname, child_stat, child_change)
+                    # Символические ссылки на каталоги не обходим (как при полном сканировании)
+                    if not is_symlink:
+                        self._push_directory(stack, dirpath, dirname, child_key, child_change, stored)
                 self._flush_directories()
 
-                # Обработка файлов
-                for filename in filenames:
+                files = self._stat_stored_files(dirpath, stored_files, errors)
+                files_count, size = self._compare_files(resource, dirpath, files, stored_files, errors)
+                total_files += files_count
+                total_size += size
+                self._finish_directory(resource, dirpath)
+                continue
+
+            try:
+                dirs, files, entry_errors, syscalls, failed = self._list_directory(dirpath)
+            except Exception as e:
+                self.syscalls += 1
+                error_msg = f"Error reading directory {dirpath}: {str(e)}"
+                logger.error(error_msg)
+                errors.append(error_msg)
+                continue
+            self.syscalls += syscalls
+
+            for error_msg in entry_errors:
+                logger.error(error_msg)
+                errors.append(error_msg)
+            # Элементы с ошибкой чтения метаданных не считаются исчезнувшими: их состояние в БД не меняется
+            for name in failed:
+                stored_dirs.pop(name, None)
+                stored_files.pop(name, None)
+
+            # Подкаталоги: новые и изменившиеся сохраняем, исчезнувшие помечаем неактуальными
+            listed_dirs = set()
+            for dirname, dir_stat, is_symlink in dirs:
+                listed_dirs.add(dirname)
+                child_key = f"{key}/{dirname}"
+                stored = stored_dirs.get(dirname)
+                child_change = self._directory_change(stored, dir_stat)
+                if child_change is not None:
                     try:
-                        full_file_path = os.path.join(dirpath, filename)
-                        self._add_file(resource, dirpath, filename)
-                        file_size = os.path.getsize(full_file_path)
-                        total_files += 1
-                        total_size += file_size
+                        self._add_directory(resource, dirpath, dirname, dir_stat, child_change)
                     except Exception as e:
-                        error_msg = f"Error processing file {filename}: {str(e)}"
+                        error_msg = f"Error processing directory {dirname}: {str(e)}"
                         logger.error(error_msg)
                         errors.append(error_msg)
+                        continue
+                # Символические ссылки на каталоги не обходим (как os.walk по умолчанию)
+                if not is_symlink:
+                    self._push_directory(stack, dirpath, dirname, child_key, child_change, stored)
+            self._flush_directories()
+
+            deleted_dirs = [f"{key}/{dirname}" for dirname in stored_dirs if dirname not in listed_dirs]
+            if deleted_dirs:
+                self.deleted_items += self.db.mark_directories_deleted(
+                    self.scan_run_s, self.resource_id, deleted_dirs)
+
+            # Файлы: сравнение с сохраненными размером и временем изменения
+            files_count, size = self._compare_files(resource, dirpath, files, stored_files, errors)
+            total_files += files_count
+            total_size += size
+            self._finish_directory(resource, dirpath)
+
+        return total_directories, total_files, total_size
+
+    def scan_resource(self, resource: InformationResource, scan_run_s: Optional[int] = None,
+                      branch: Optional[str] = None, checkpoint: Optional[ScanCheckpoint] = None) -> ScanResult:
+        """
+        Сканирование информационного ресурса
+        scan_run_s - ID запуска сканирования (обязателен для инкрементального режима и контрольных точек)
+        branch - путь ветви относительно корневого каталога ресурса (сканируется только ее поддерево;
+                 родительский каталог ветви должен быть сохранен предыдущим сканированием)
+        checkpoint - контрольная точка прерванного полного сканирования, с фронта которой продолжается обход
+        """
+        start_time = datetime.now()
+        total_directories = 0
+        total_files = 0
+        total_size = 0
+        errors = []
+        self.syscalls = 0
+        self.resource_id = resource.information_resource_s
+        self.scan_run_s = scan_run_s
+        self.created_items = 0
+        self.modified_items = 0
+        self.deleted_items = 0
+        self.discovered_at = time.time_ns() // 1000
+        self._dir_context = ('', '', 0)
+        self._new_batches(resource)
+        self.path_to_dir_id = create_path_index(self.path_index_limit)
+        self._finished_dirs = []
+        self._start_file_writer()
+
+        try:
+            # Сначала сканируем корневую директорию
+            self.root_path = os.path.join(resource.path, resource.name)
+            root_key = branch_path(resource, branch)
+            if root_key is None:
+                self.walk_root = self.root_path
+                root_key = f"./{resource.name}"
+                root_parent, root_name = resource.path, resource.name
+            else:
+                self.walk_root = os.path.normpath(os.path.join(self.root_path, branch))
+                root_parent, root_name = os.path.split(self.walk_root)
+                # Ссылка корня ветви на родительский каталог из ранее сохраненного дерева
+                parent_key = os.path.dirname(root_key)
+                parent_id = self.db.get_directory_id(resource.information_resource_s, parent_key)
+                if parent_id is None:
+                    raise ValueError(f"Parent directory {parent_key} of branch is not scanned")
+                self.path_to_dir_id[parent_key] = parent_id
+            root_stat = os.stat(self.walk_root)
+            self.syscalls += 1
+
+            if self.incremental:
+                directories, files, size = self._scan_incremental(resource, root_parent, root_name, root_key,
+                                                                  root_stat, errors)
+            else:
+                if checkpoint is not None:
+                    total_directories = checkpoint.total_directories
+                    total_files = checkpoint.total_files
+                    total_size = checkpoint.total_size
+                    self.syscalls += checkpoint.syscalls
+                    self._load_checkpoint(resource, checkpoint, errors)
+                else:
+                    self._add_directory(resource, root_parent, root_name, root_stat)
+                    self._flush_directories()
+                    total_directories += 1
+                    self._walk_start = [self.walk_root]
+                self._frontier = dict.fromkeys(self._walk_start) if self.checkpoint_interval else {}
+                self._checkpoint_base = (total_directories, total_files, total_size)
+                self._last_checkpoint = time.monotonic()
+
+                if self.walk_workers > 1:
+                    # Параллельный обход пулом потоков
+                    directories, files, size = self._scan_parallel(resource, errors)
+                elif self.pipeline_depth > 0:
+                    # Обход и запись в БД в разных потоках
+                    directories, files, size = self._scan_pipelined(resource, errors)
+                else:
+                    directories, files, size = self._scan_sequential(resource, errors)
+            total_directories += directories
+            total_files += files
+            total_size += size
+            self.metrics.add('directories', total_directories)
+            self.metrics.add('files', total_files)
+            self.metrics.add('bytes', total_size)
+            self.metrics.add('syscalls', self.syscalls)
+            self._collect_file_writes(wait_all=True)
 
-                # Сохраняем файлы после обработки всех файлов в текущей директории
-                self._flush_files()
+            # Фиксируем этап сканирования (при загрузке через COPY пакеты не фиксируются по отдельности)
+            self.db.commit()
 
             end_time = datetime.now()
 
@@ -195,7 +948,11 @@ class FilesystemScanner:
 	            total_size=total_size,
 	            start_time=start_time,
 	            end_time=end_time,
-	            errors=errors
+	            errors=errors,
+	            syscalls=self.syscalls,
+	            created_items=self.created_items,
+	            modified_items=self.modified_items,
+	            deleted_items=self.deleted_items
 	        )
 
         except Exception as e:
@@ -210,5 +967,13 @@ class FilesystemScanner:
 	            total_size=total_size,
 	            start_time=start_time,
 	            end_time=end_time,
-	            errors=errors
+	            errors=errors,
+	            syscalls=self.syscalls,
+	            created_items=self.created_items,
+	            modified_items=self.modified_items,
+	            deleted_items=self.deleted_items,
+	            interrupted=True
 	        )
+        finally:
+            self._stop_file_writer()
+            self.path_to_dir_id.close()
@@ -0,0 +1,321 @@
+# scanner/scheduler.py
+
+import os
+import re
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from .models import InformationResource, ScanResult
+from .scanner import FilesystemScanner, branch_path
+from .database import Database
+
+logger = logging.getLogger(__name__)
+
+# Поля cron-выражения: минута, час, день месяца, месяц, день недели (0 и 7 - воскресенье)
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+# Сервер хранения из пути информационного ресурса вида //servername/sharename
+HOST_PATTERN = re.compile(r'^//([^/]+)/')
+
+
+class CronSchedule:
+    """Расписание в формате cron из пяти полей: '*', 'N', 'N-M', '*/S', 'N-M/S' и списки через запятую"""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Invalid cron expression: {expression}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse_field(field, low, high) for field, (low, high) in zip(fields, CRON_FIELDS))
+        # Воскресенье может быть задано как 0 или 7
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - {7}) | {0}
+        # Если ограничены и день месяца, и день недели, достаточно совпадения любого из них
+        self.any_day = fields[2] != '*' and fields[4] != '*'
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> frozenset:
+        values = set()
+        for part in field.split(','):
+            range_part, _, step = part.partition('/')
+            step = int(step) if step else 1
+            if range_part == '*':
+                start, end = low, high
+            elif '-' in range_part:
+                start, end = (int(value) for value in range_part.split('-', 1))
+            else:
+                start = int(range_part)
+                end = high if step > 1 else start
+            if step < 1 or start < low or end > high or start > end:
+                raise ValueError(f"Invalid cron field: {field}")
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day = moment.day in self.days
+        # datetime.weekday(): понедельник - 0, в cron понедельник - 1
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        return (day or weekday) if self.any_day else (day and weekday)
+
+    def next_after(self, moment: datetime) -> Optional[datetime]:
+        """Ближайший момент запуска после moment (None - нет в течение года)"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                candidate = (candidate.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        return None
+
+
+@dataclass
+class ScanJob:
+    """Задание сканирования ресурса по расписанию"""
+    resource: InformationResource
+    host: str
+    scheduled_time: datetime
+    result: Optional[ScanResult] = None
+
+    @property
+    def wait_seconds(self) -> float:
+        """Время ожидания задания в очереди до начала сканирования"""
+        if self.result is None:
+            return 0.0
+        return max(0.0, (self.result.start_time - self.scheduled_time).total_seconds())
+
+
+def storage_host(path: str) -> str:
+    """Сервер хранения информационного ресурса (для ограничения параллельных сканирований)"""
+    match = HOST_PATTERN.match(path)
+    return match.group(1).lower() if match else path
+
+
+def resource_from_mount(information_resource_s: int, name: str, path_to_mount: str) -> InformationResource:
+    """
+    Информационный ресурс для сканера: корневой каталог сканирования - точка монтирования
+    (сканер обходит каталог os.path.join(path, name))
+    """
+    mount = os.path.normpath(path_to_mount)
+    return InformationResource(
+        information_resource_s=information_resource_s,
+        path=os.path.dirname(mount),
+        name=os.path.basename(mount),
+        description=name
+    )
+
+
+def run_scan(db: Database, scanner: FilesystemScanner, resource: InformationResource,
+             scheduled_time: Optional[datetime] = None, branch: Optional[str] = None,
+             resume: bool = False, resume_max_age: Optional[timedelta] = None) -> ScanResult:
+    """
+    Сканирование одного информационного ресурса с регистрацией запуска в scan_run
+    branch - путь ветви относительно корневого каталога ресурса (None - весь ресурс)
+    resume - продолжить прерванное полное сканирование ресурса (ветви) с его последней контрольной точки
+    resume_max_age - не продолжать с контрольных точек старше этого возраста (None - любого возраста):
+                     каталоги, обработанные до сбоя, за это время могли измениться
+    Завершенный запуск удаляет контрольные точки ресурса (ветви) более ранних запусков.
+    Метрики этапов (db.metrics) измеряются заново и сохраняются в scan_run.metrics.
+    При полном сканировании признак is_actual записей, не встреченных запуском, снимается только
+    после завершения обхода: прерванный запуск не оставляет ресурс частично неактуальным
+    """
+    start_time = datetime.now()
+    errors = []
+    scan_run_s = None
+    scan_result = None
+    db.metrics.reset()
+
+    try:
+        branch_key = branch_path(resource, branch)
+
+        checkpoint = None
+        if resume and not scanner.incremental:
+            checkpoint = db.get_checkpoint(resource.information_resource_s, branch_key, resume_max_age)
+
+        if checkpoint is not None:
+            # Продолжаем прерванный запуск: записи, встреченные им до сбоя, остаются за ним
+            scan_run_s = checkpoint.scan_run_s
+            db.resume_scan_run(scan_run_s)
+        else:
+            # Регистрируем запуск сканирования
+            scan_run_s = db.start_scan_run(resource.information_resource_s,
+                                           'incremental' if scanner.incremental else 'full', scheduled_time,
+                                           branch_key)
+
+        # Сканируем ресурс
+        scan_result = scanner.scan_resource(resource, scan_run_s, branch, checkpoint)
+
+        if scan_result.interrupted:
+            # Запуск можно продолжить с последней контрольной точки (resume)
+            errors.extend(scan_result.errors[-1:])
+        elif not scanner.incremental:
+            # Не встреченные запуском записи помечаем неактуальными
+            # (в инкрементальном режиме неактуальными помечаются только исчезнувшие элементы)
+            db.finalize_scan(resource.information_resource_s, scan_run_s, branch_key)
+        else:
+            # Прерванные ранее полные запуски устарели: их продолжение не обошло бы обработанные до сбоя каталоги
+            db.clear_checkpoints(resource.information_resource_s, scan_run_s, branch_key)
+
+        # Получаем статистику
+        if branch_key:
+            stats = db.get_subtree_stats(resource.information_resource_s, branch_key)
+        else:
+            stats = db.get_resource_stats(resource.information_resource_s)
+
+    except Exception as e:
+        error_msg = f"Error scanning resource {resource.information_resource_s}: {str(e)}"
+        logger.error(error_msg)
+        errors.append(error_msg)
+        stats = (0, 0, 0)  # directories, files, total_size
+
+    end_time = datetime.now()
+
+    result = ScanResult(
+        total_directories=stats[0],
+        total_files=stats[1],
+        total_size=stats[2],
+        start_time=start_time,
+        end_time=end_time,
+        errors=errors,
+        syscalls=scan_result.syscalls if scan_result else 0,
+        created_items=scan_result.created_items if scan_result else 0,
+        modified_items=scan_result.modified_items if scan_result else 0,
+        deleted_items=scan_result.deleted_items if scan_result else 0,
+        metrics=db.metrics.to_dict()
+    )
+
+    if scan_run_s is not None:
+        try:
+            db.finish_scan_run(scan_run_s, result)
+        except Exception as e:
+            logger.error(f"Error finishing scan run {scan_run_s}: {str(e)}")
+
+    return result
+
+
+def _scan_worker(db_config: dict, scanner_options: dict, resource: InformationResource,
+                 scheduled_time: datetime, resume: bool = False,
+                 resume_max_age: Optional[timedelta] = None) -> ScanResult:
+    """
+    Задание рабочего процесса: собственное подключение к БД на время сканирования ресурса.
+    При resume прерванное полное сканирование ресурса продолжается с контрольной точки не старше resume_max_age
+    """
+    db = Database(**db_config)
+    try:
+        scanner = FilesystemScanner(db, **scanner_options)
+        return run_scan(db, scanner, resource, scheduled_time, resume=resume, resume_max_age=resume_max_age)
+    finally:
+        db.close()
+
+
+class ScanScheduler:
+    """
+    Планировщик заданий: запускает сканирование ресурсов по расписанию information_resource.scan_schedule
+    в пуле процессов (у каждого задания собственное подключение к БД), ограничивая число
+    одновременных сканирований одного сервера хранения
+    """
+
+    def __init__(self, db: Database, db_config: dict, scanner_options: dict,
+                 max_workers: int = 4, per_host_limit: int = 1, resume: bool = False,
+                 resume_max_age: Optional[timedelta] = None):
+        """
+        db - подключение планировщика (чтение расписаний)
+        db_config - параметры Database для рабочих процессов
+        scanner_options - параметры FilesystemScanner
+        resume - продолжать прерванные полные сканирования с контрольных точек не старше resume_max_age
+                 (по умолчанию каждое задание начинает новый запуск)
+        """
+        self.db = db
+        self.db_config = db_config
+        self.scanner_options = scanner_options
+        self.max_workers = max(1, max_workers)
+        self.per_host_limit = max(1, per_host_limit)
+        self.resume = resume
+        self.resume_max_age = resume_max_age
+
+    def due_jobs(self, now: datetime) -> List[ScanJob]:
+        """Задания для ресурсов, очередной запуск которых по расписанию наступил"""
+        jobs = []
+        for resource_id, path, name, schedule, path_to_mount, last_start in self.db.get_scheduled_resources():
+            try:
+                cron = CronSchedule(schedule)
+            except ValueError as e:
+                logger.error(f"Invalid scan schedule of resource {resource_id}: {str(e)}")
+                continue
+            # Ресурс, который еще не сканировался, сканируется при первом проходе планировщика
+            next_run = cron.next_after(last_start) if last_start is not None else now
+            if next_run is not None and next_run <= now:
+                # Время постановки в очередь - наступивший момент расписания, а не время прохода планировщика
+                jobs.append(ScanJob(resource_from_mount(resource_id, name, path_to_mount), storage_host(path),
+                                    next_run))
+        return jobs
+
+    def run_jobs(self, jobs: List[ScanJob]) -> List[ScanJob]:
+        """
+        Выполнение заданий в пуле процессов. Задание запускается, когда свободен рабочий процесс
+        и число выполняемых сканирований его сервера меньше per_host_limit
+        """
+        pending = list(jobs)
+        running: Dict[object, ScanJob] = {}
+        host_load: Dict[str, int] = {}
+        finished = []
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for job in list(pending):
+                    if len(running) >= self.max_workers:
+                        break
+                    if host_load.get(job.host, 0) >= self.per_host_limit:
+                        continue
+                    pending.remove(job)
+                    host_load[job.host] = host_load.get(job.host, 0) + 1
+                    future = executor.submit(_scan_worker, self.db_config, self.scanner_options,
+                                             job.resource, job.scheduled_time, self.resume, self.resume_max_age)
+                    running[future] = job
+                    logger.info(f"Scan job started: {job.resource.description} (host {job.host})")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    host_load[job.host] -= 1
+                    try:
+                        job.result = future.result()
+                    except Exception as e:
+                        logger.error(f"Scan job failed for {job.resource.description}: {str(e)}")
+                    else:
+                        duration = (job.result.end_time - job.result.start_time).total_seconds()
+                        logger.info(
+                            f"Scan job finished: {job.resource.description}:\n"
+                            f"  Waited: {job.wait_seconds:.2f} seconds\n"
+                            f"  Duration: {duration:.2f} seconds\n"
+                            f"  Directories: {job.result.total_directories}\n"
+                            f"  Files: {job.result.total_files}\n"
+                            f"  Errors: {len(job.result.errors)}"
+                        )
+                    finished.append(job)
+
+        return finished
+
+    def run_pending(self, now: Optional[datetime] = None) -> List[ScanJob]:
+        """Один проход планировщика: запуск всех наступивших по расписанию заданий"""
+        jobs = self.due_jobs(now or datetime.now())
+        if not jobs:
+            return []
+        logger.info(f"Scheduler: {len(jobs)} scan jobs due")
+        return self.run_jobs(jobs)
+
+    def run_forever(self, interval: int = 60) -> None:
+        """Периодическая проверка расписаний с интервалом interval секунд"""
+        while True:
+            self.run_pending()
+            time.sleep(interval)
@@ -0,0 +1,136 @@
+# scanner/text_extractor.py
+
+import html
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterator, List, Optional, Tuple
+
+# Текстовые форматы: содержимое читается как есть
+TEXT_EXTENSIONS = frozenset((
+    '.txt', '.md', '.csv', '.tsv', '.log', '.json', '.ini', '.cfg', '.conf', '.yaml', '.yml',
+    '.py', '.sql', '.psql', '.sh', '.bat',
+))
+
+# Разметка: теги удаляются
+MARKUP_EXTENSIONS = frozenset(('.html', '.htm', '.xml', '.svg'))
+
+# Документы Office Open XML и OpenDocument (ZIP): элемент архива с текстом документа
+ARCHIVE_DOCUMENTS = {
+    '.docx': 'word/document.xml',
+    '.xlsx': 'xl/sharedStrings.xml',
+    '.odt': 'content.xml',
+    '.ods': 'content.xml',
+    '.odp': 'content.xml',
+}
+
+SUPPORTED_EXTENSIONS = TEXT_EXTENSIONS | MARKUP_EXTENSIONS | frozenset(ARCHIVE_DOCUMENTS)
+
+# Закрывающие теги абзацев и ячеек заменяются переводом строки, остальные теги удаляются
+# (слова внутри абзаца документа могут быть разбиты на несколько элементов);
+# тег, обрезанный ограничением чтения, удаляется до конца текста
+PARAGRAPH_END = re.compile(r'</(?:w:p|w:tc|text:p|text:h|table:table-cell|si|p|div|li|td|tr|h\d)>', re.IGNORECASE)
+TAG = re.compile(r'<[^>]*(?:>|$)')
+
+
+def _decode(data: bytes) -> Optional[str]:
+    """
+    Текст из прочитанных байтов: UTF-8 (последний символ может быть обрезан ограничением чтения),
+    иначе CP1251. None - двоичные данные
+    """
+    if b'\x00' in data:
+        return None
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Ограничение чтения обрезало многобайтовый символ в конце
+        if e.start >= len(data) - 3 and e.reason == 'unexpected end of data':
+            return data[:e.start].decode('utf-8', errors='replace')
+    return data.decode('cp1251', errors='replace')
+
+
+def _strip_markup(text: str) -> str:
+    """Текст разметки без тегов"""
+    return html.unescape(TAG.sub('', PARAGRAPH_END.sub('\n', text)))
+
+
+def extract_text(path: str, extension: str, max_bytes: int) -> Optional[str]:
+    """
+    Текст файла поддерживаемого формата; читается не больше max_bytes байтов файла
+    (для документов-архивов - распакованного элемента с текстом). None - формат не поддерживается
+    или файл двоичный. Ошибки чтения передаются вызывающему
+    """
+    if extension in TEXT_EXTENSIONS or extension in MARKUP_EXTENSIONS:
+        with open(path, 'rb') as f:
+            text = _decode(f.read(max_bytes))
+        if text is not None and extension in MARKUP_EXTENSIONS:
+            text = _strip_markup(text)
+        return text
+
+    member = ARCHIVE_DOCUMENTS.get(extension)
+    if member is None:
+        return None
+    with zipfile.ZipFile(path) as archive:
+        with archive.open(member) as f:
+            text = _decode(f.read(max_bytes))
+    return _strip_markup(text) if text is not None else None
+
+
+def _extract_one(path: str, extension: str, max_bytes: int) -> Tuple[Optional[str], Optional[str]]:
+    """extract_text для процесса пула: возвращает (текст, сообщение об ошибке)"""
+    try:
+        return extract_text(path, extension, max_bytes), None
+    except Exception as e:
+        return None, str(e)
+
+
+class TextExtractor:
+    """
+    Извлечение текста из файлов в пуле процессов (разбор форматов и декодирование не освобождают GIL).
+    Используется как контекстный менеджер: пул создается при входе и завершается при выходе
+    """
+
+    def __init__(self, workers: int = 2, max_bytes: int = 256 * 1024):
+        """
+        workers - число процессов разбора (1 - в текущем процессе)
+        max_bytes - максимальный объем текста, читаемого из одного файла, байт
+        """
+        self.workers = max(1, workers)
+        self.max_bytes = max_bytes
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self) -> 'TextExtractor':
+        if self.workers > 1:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def submit(self, items: List[Tuple[Any, str, str]]) -> Iterator[Tuple[Any, Optional[str], Optional[str]]]:
+        """
+        Передача набора файлов на извлечение текста. items - тройки (ключ, путь, расширение);
+        возвращает итератор троек (ключ, текст или None, ошибка или None) в порядке items.
+        В пуле процессов файлы разбираются сразу, пока вызывающий обрабатывает предыдущий набор;
+        файлы неподдерживаемых форматов в пул не передаются
+        """
+        supported = [(path, extension) for _, path, extension in items if extension in SUPPORTED_EXTENSIONS]
+        paths = [path for path, _ in supported]
+        extensions = [extension for _, extension in supported]
+        limits = [self.max_bytes] * len(supported)
+        if self._executor is None:
+            results = map(_extract_one, paths, extensions, limits)
+        else:
+            results = self._executor.map(_extract_one, paths, extensions, limits,
+                                         chunksize=max(1, len(supported) // (self.workers * 4)))
+        return self._merge(items, iter(results))
+
+    @staticmethod
+    def _merge(items: List[Tuple[Any, str, str]],
+               results: Iterator) -> Iterator[Tuple[Any, Optional[str], Optional[str]]]:
+        """Результаты разбора поддерживаемых файлов в порядке исходного набора"""
+        for key, _, extension in items:
+            text, error = next(results) if extension in SUPPORTED_EXTENSIONS else (None, None)
+            yield key, text, error
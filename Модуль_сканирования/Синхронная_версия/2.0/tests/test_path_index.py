@@ -0,0 +1,53 @@
+# tests/test_path_index.py
+
+import pytest
+
+from scanner.path_index import MemoryPathIndex, PathIndex, SpillingPathIndex, SqlitePathIndex, create_path_index
+
+
+def test_path_index_is_abstract():
+    with pytest.raises(TypeError):
+        PathIndex()
+
+
+@pytest.mark.parametrize('make_index', [MemoryPathIndex, SqlitePathIndex, lambda: SpillingPathIndex(2)])
+def test_path_index(make_index):
+    index = make_index()
+    try:
+        for i in range(5):
+            index[f"./R/d{i}"] = i + 1
+        index['./R/d0'] = 10
+        assert len(index) == 5
+        assert index.get('./R/d0') == 10
+        assert index.get('./R/d4') == 5
+        assert index.get('./R/missing') is None
+
+        index.discard(['./R/d0', './R/d3', './R/missing'])
+        assert len(index) == 3
+        assert index.get('./R/d0') is None
+        assert index.get('./R/d3') is None
+        assert index.get('./R/d1') == 2
+    finally:
+        index.close()
+
+
+def test_spilling_path_index():
+    """Записи сверх limit выгружаются на диск, записи в памяти обновляются на месте"""
+    index = SpillingPathIndex(2)
+    try:
+        index['./R/a'] = 1
+        index['./R/b'] = 2
+        assert index.disk is None
+        index['./R/a'] = 3
+        assert index.disk is None
+        index['./R/c'] = 4
+        assert len(index.memory) == 2 and len(index.disk) == 1
+        assert [index.get(key) for key in ('./R/a', './R/b', './R/c')] == [3, 2, 4]
+    finally:
+        index.close()
+
+
+def test_create_path_index():
+    assert isinstance(create_path_index(), MemoryPathIndex)
+    index = create_path_index(100)
+    assert isinstance(index, SpillingPathIndex) and index.limit == 100
@@ -0,0 +1,421 @@
+# tests/test_scanner.py
+
+import copy
+import itertools
+import os
+from datetime import timedelta
+
+import pytest
+
+from scanner.metrics import ScanMetrics
+from scanner.models import InformationResource, ScanCheckpoint
+from scanner.scanner import FilesystemScanner
+from scanner.scheduler import run_scan
+
+# Время изменения элементов дерева до и после изменений между сканированиями (секунды от эпохи)
+BEFORE = 1_700_000_000
+AFTER = 1_700_000_100
+
+
+class ScanDatabase:
+    """
+    Подключение сканера с состоянием ресурса в памяти: каталоги и файлы по полному пути
+    ("<relative_path>/<name>"), журнал изменений и контрольные точки
+    """
+
+    commit_per_batch = True
+
+    def __init__(self):
+        self.metrics = ScanMetrics()
+        self.ids = itertools.count(1)
+        self.directories = {}
+        self.files = {}
+        self.changes = []
+        self.deleted_file_ids = []
+        self.deleted_paths = []
+        self.checkpoints = []
+
+    def save_directories_bulk(self, batch, path_to_id):
+        for _, parent_s, name, relative_path, nesting_level, _, _, _, mtime, _ in batch.rows():
+            key = f"{relative_path}/{name}"
+            # Родительский каталог сохраняется раньше дочерних
+            assert relative_path == '.' or parent_s == self.directories[relative_path]['id']
+            stored = self.directories.get(key)
+            self.directories[key] = dict(id=stored['id'] if stored else next(self.ids), parent=parent_s,
+                                         relative_path=relative_path, name=name, nesting_level=nesting_level,
+                                         mtime=mtime, actual=True)
+            path_to_id[key] = self.directories[key]['id']
+
+    def save_files_bulk(self, batch):
+        path_to_id = {}
+        for row in batch.rows():
+            _, directory_s, name, relative_path, _, size, _, mtime, _, _, _, nesting_level, _ = row
+            key = f"{relative_path}/{name}"
+            assert directory_s == self.directories[relative_path]['id']
+            stored = self.files.get(key)
+            self.files[key] = dict(id=stored['id'] if stored else next(self.ids), directory=directory_s,
+                                   relative_path=relative_path, name=name, nesting_level=nesting_level,
+                                   size=size, mtime=mtime, actual=True)
+            path_to_id[key] = self.files[key]['id']
+        return path_to_id
+
+    def save_scan_changes(self, scan_run_s, resource_id, rows):
+        self.changes.extend(rows)
+
+    def get_directory_id(self, resource_id, full_path):
+        stored = self.directories.get(full_path)
+        return stored['id'] if stored else None
+
+    def get_directory_ids(self, resource_id, full_paths):
+        return {path: self.directories[path]['id'] for path in full_paths if path in self.directories}
+
+    def get_directory_state(self, resource_id, full_path):
+        stored = self.directories.get(full_path)
+        return (stored['id'], stored['mtime']) if stored and stored['actual'] else None
+
+    def get_directory_contents(self, resource_id, directory_id):
+        dirs = {d['name']: (d['id'], d['mtime']) for d in self.directories.values()
+                if d['actual'] and d['parent'] == directory_id}
+        files = {f['name']: (f['id'], f['size'], f['mtime']) for f in self.files.values()
+                 if f['actual'] and f['directory'] == directory_id}
+        return dirs, files
+
+    def mark_directories_deleted(self, scan_run_s, resource_id, paths):
+        self.deleted_paths.extend(paths)
+        count = 0
+        for path in paths:
+            for key, item in itertools.chain(self.directories.items(), self.files.items()):
+                if item['actual'] and (key == path or key.startswith(path + '/')):
+                    item['actual'] = False
+                    count += 1
+        return count
+
+    def mark_files_deleted(self, scan_run_s, resource_id, file_ids):
+        self.deleted_file_ids.extend(file_ids)
+        count = 0
+        for item in self.files.values():
+            if item['actual'] and item['id'] in file_ids:
+                item['actual'] = False
+                count += 1
+        return count
+
+    def save_checkpoint(self, scan_run_s, resource_id, frontier, total_directories, total_files, total_size,
+                        syscalls):
+        checkpoint = ScanCheckpoint(scan_run_s, list(frontier), total_directories, total_files, total_size,
+                                    syscalls)
+        self.checkpoints.append((checkpoint, copy.deepcopy(self.directories), copy.deepcopy(self.files)))
+
+    def commit(self):
+        pass
+
+    def actual(self, items):
+        return {key for key, item in items.items() if item['actual']}
+
+    def file_id(self, key):
+        return self.files[key]['id']
+
+
+def touch(path, mtime=BEFORE, content=None):
+    if content is not None:
+        with open(path, 'w') as f:
+            f.write(content)
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def resource(tmp_path):
+    """
+    Ресурс R:
+      R/a.txt, R/b.txt, R/docs/c.txt, R/docs/old/d.txt, R/docs/old/e.txt, R/keep/f.txt,
+      R/link -> каталог вне ресурса (не обходится)
+    """
+    root = tmp_path / 'R'
+    for directory in ('docs/old', 'keep'):
+        (root / directory).mkdir(parents=True)
+    outside = tmp_path / 'outside'
+    outside.mkdir()
+    touch(outside / 'x.txt', content='x')
+    (root / 'link').symlink_to(outside, target_is_directory=True)
+    for name, content in (('a.txt', 'a'), ('b.txt', 'bb'), ('docs/c.txt', 'ccc'), ('docs/old/d.txt', 'd'),
+                          ('docs/old/e.txt', 'e'), ('keep/f.txt', 'ff')):
+        touch(root / name, content=content)
+    for directory in ('docs/old', 'docs', 'keep', ''):
+        touch(root / directory)
+    return InformationResource(1, str(tmp_path), 'R', '')
+
+
+ALL_DIRECTORIES = {'./R', './R/docs', './R/docs/old', './R/keep', './R/link'}
+ALL_FILES = {'./R/a.txt', './R/b.txt', './R/docs/c.txt', './R/docs/old/d.txt', './R/docs/old/e.txt',
+             './R/keep/f.txt'}
+
+
+def scan(db, resource, **options):
+    return FilesystemScanner(db, **options).scan_resource(resource, scan_run_s=7)
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'batch_size': 2},
+    {'walk_workers': 4},
+    {'walk_workers': 4, 'batch_size': 2},
+    {'pipeline_depth': 2},
+    {'pipeline_depth': 1, 'batch_size': 2},
+    {'path_index_limit': 1},
+])
+def test_full_scan(resource, options):
+    """Все режимы обхода сохраняют одно дерево; символическая ссылка на каталог сохраняется, но не обходится"""
+    db = ScanDatabase()
+    result = scan(db, resource, **options)
+
+    assert not result.errors and not result.interrupted
+    assert (result.total_directories, result.total_files, result.total_size) == (5, 6, 10)
+    assert set(db.directories) == ALL_DIRECTORIES
+    assert set(db.files) == ALL_FILES
+    assert db.directories['./R']['nesting_level'] == 0
+    assert db.directories['./R/docs/old']['nesting_level'] == 2
+    assert db.files['./R/docs/old/d.txt']['nesting_level'] == 3
+    assert db.files['./R/docs/c.txt']['mtime'] == BEFORE * 1_000_000
+
+
+def test_incremental_unchanged(resource):
+    """Без изменений инкрементальное сканирование ничего не записывает"""
+    db = ScanDatabase()
+    scan(db, resource)
+    result = scan(db, resource, incremental=True)
+
+    assert not result.errors
+    assert (result.total_directories, result.total_files, result.total_size) == (4, 6, 10)
+    assert (result.created_items, result.modified_items, result.deleted_items) == (0, 0, 0)
+    assert db.changes == []
+    assert db.actual(db.directories) == ALL_DIRECTORIES
+    assert db.actual(db.files) == ALL_FILES
+
+
+def test_incremental_changes(resource):
+    """Новые, измененные и исчезнувшие элементы: в каталогах с измененным и неизменным составом"""
+    db = ScanDatabase()
+    scan(db, resource)
+    root = os.path.join(resource.path, resource.name)
+    ids = {key: db.file_id(key) for key in ALL_FILES}
+
+    # Корень: новый файл и новый каталог, удален файл
+    touch(os.path.join(root, 'new.txt'), AFTER, 'new')
+    os.mkdir(os.path.join(root, 'added'))
+    touch(os.path.join(root, 'added', 'g.txt'), AFTER, 'g')
+    touch(os.path.join(root, 'added'), AFTER)
+    os.remove(os.path.join(root, 'b.txt'))
+    # docs: удален подкаталог
+    for name in ('d.txt', 'e.txt'):
+        os.remove(os.path.join(root, 'docs', 'old', name))
+    os.rmdir(os.path.join(root, 'docs', 'old'))
+    touch(os.path.join(root, 'docs'), AFTER)
+    touch(os.path.join(root), AFTER)
+    # keep: состав не изменился, файл изменен на месте
+    touch(os.path.join(root, 'keep', 'f.txt'), AFTER, 'changed')
+    touch(os.path.join(root, 'keep'))
+
+    result = scan(db, resource, incremental=True)
+
+    assert not result.errors
+    changes = {(object_type, f"{relative_path}/{name}", change_type)
+               for object_type, _, change_type, relative_path, name in db.changes}
+    assert changes == {
+        ('directory', './R', 'modified'),
+        ('directory', './R/docs', 'modified'),
+        ('directory', './R/added', 'created'),
+        ('file', './R/new.txt', 'created'),
+        ('file', './R/added/g.txt', 'created'),
+        ('file', './R/keep/f.txt', 'modified'),
+    }
+    assert db.deleted_paths == ['./R/docs/old']
+    assert db.deleted_file_ids == [ids['./R/b.txt']]
+    # Каталог docs/old и его два файла, файл b.txt
+    assert result.deleted_items == 4
+    assert (result.created_items, result.modified_items) == (3, 3)
+    assert db.actual(db.directories) == ALL_DIRECTORIES - {'./R/docs/old'} | {'./R/added'}
+    assert db.actual(db.files) == (ALL_FILES - {'./R/b.txt', './R/docs/old/d.txt', './R/docs/old/e.txt'}
+                                   | {'./R/new.txt', './R/added/g.txt'})
+    assert db.files['./R/keep/f.txt']['id'] == ids['./R/keep/f.txt']
+    assert db.files['./R/keep/f.txt']['size'] == len('changed')
+
+
+class FailingEntry:
+    """Элемент каталога, чтение метаданных которого завершается ошибкой доступа"""
+
+    def __init__(self, entry):
+        self.name = entry.name
+        self.path = entry.path
+
+    def stat(self):
+        raise PermissionError(13, 'Permission denied', self.path)
+
+    def is_symlink(self):
+        return False
+
+
+def test_incremental_entry_stat_error(resource, monkeypatch):
+    """Элементы каталога с измененным составом, метаданные которых не прочитаны, не помечаются удаленными"""
+    db = ScanDatabase()
+    scan(db, resource)
+    root = os.path.join(resource.path, resource.name)
+    touch(os.path.join(root, 'new.txt'), AFTER, 'new')
+    touch(root, AFTER)
+
+    scandir = os.scandir
+
+    class FailingScandir:
+        def __init__(self, path):
+            self.entries = scandir(path)
+
+        def __enter__(self):
+            return [FailingEntry(entry) if entry.name in ('b.txt', 'docs') else entry
+                    for entry in self.entries.__enter__()]
+
+        def __exit__(self, *args):
+            return self.entries.__exit__(*args)
+
+    monkeypatch.setattr(os, 'scandir', FailingScandir)
+    result = scan(db, resource, incremental=True)
+
+    assert len(result.errors) == 2
+    assert all('Permission denied' in error for error in result.errors)
+    assert result.deleted_items == 0
+    assert db.deleted_paths == [] and db.deleted_file_ids == []
+    assert db.actual(db.directories) == ALL_DIRECTORIES
+    assert db.actual(db.files) == ALL_FILES | {'./R/new.txt'}
+
+
+def test_incremental_stored_file_stat_error(resource, monkeypatch):
+    """Файл каталога с неизменным составом, метаданные которого не прочитаны, не помечается удаленным"""
+    db = ScanDatabase()
+    scan(db, resource)
+    failing = os.path.join(resource.path, resource.name, 'keep', 'f.txt')
+
+    stat = os.stat
+
+    def failing_stat(path, *args, **kwargs):
+        if path == failing:
+            raise OSError(5, 'Input/output error', path)
+        return stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'stat', failing_stat)
+    result = scan(db, resource, incremental=True)
+
+    assert len(result.errors) == 1 and 'Input/output error' in result.errors[0]
+    assert result.deleted_items == 0 and db.deleted_file_ids == []
+    assert db.actual(db.files) == ALL_FILES
+
+
+def test_checkpoints_and_resume(resource):
+    """
+    Контрольные точки сохраняются после сохранения каталогов фронта и файлов обработанных каталогов;
+    продолжение с контрольной точки дает то же дерево и итоги, что и полное сканирование
+    """
+    db = ScanDatabase()
+    full = scan(db, resource, checkpoint_interval=1e-9)
+
+    assert db.checkpoints
+    for checkpoint, directories, files in db.checkpoints:
+        assert set(checkpoint.frontier) <= set(directories)
+        for key in directories:
+            # Файлы каталогов вне фронта сохранены
+            if key not in checkpoint.frontier and key != './R/link':
+                assert {k for k in ALL_FILES if os.path.dirname(k) == key} <= set(files)
+
+    checkpoint, directories, files = next(
+        saved for saved in db.checkpoints if './R/docs' in saved[0].frontier)
+    resumed_db = ScanDatabase()
+    resumed_db.directories, resumed_db.files = directories, files
+    resumed_db.ids = itertools.count(1000)
+    result = FilesystemScanner(resumed_db).scan_resource(resource, scan_run_s=7, checkpoint=checkpoint)
+
+    assert not result.errors
+    assert (result.total_directories, result.total_files, result.total_size) == \
+           (full.total_directories, full.total_files, full.total_size)
+    assert set(resumed_db.directories) == ALL_DIRECTORIES
+    assert set(resumed_db.files) == ALL_FILES
+
+
+def test_branch_scan(resource):
+    """Сканирование ветви: корень ветви ссылается на родительский каталог ранее сохраненного дерева"""
+    db = ScanDatabase()
+    scan(db, resource)
+    parent = db.directories['./R']['id']
+    db.files.clear()
+
+    result = FilesystemScanner(db).scan_resource(resource, scan_run_s=7, branch='docs')
+
+    assert not result.errors
+    assert (result.total_directories, result.total_files) == (2, 3)
+    assert db.directories['./R/docs']['parent'] == parent
+    assert set(db.files) == {'./R/docs/c.txt', './R/docs/old/d.txt', './R/docs/old/e.txt'}
+
+
+class RunDatabase(ScanDatabase):
+    """Подключение run_scan: регистрация запусков и контрольная точка прерванного запуска"""
+
+    def __init__(self, checkpoint=None):
+        super().__init__()
+        self.checkpoint = checkpoint
+        self.calls = []
+
+    def start_scan_run(self, resource_id, scan_type, scheduled_time, branch_key):
+        self.calls.append(('start_scan_run', scan_type))
+        return 8
+
+    def resume_scan_run(self, scan_run_s):
+        self.calls.append(('resume_scan_run', scan_run_s))
+
+    def get_checkpoint(self, resource_id, branch_key, max_age):
+        self.calls.append(('get_checkpoint', max_age))
+        return self.checkpoint
+
+    def finalize_scan(self, resource_id, scan_run_s, branch_key):
+        self.calls.append(('finalize_scan', scan_run_s))
+
+    def clear_checkpoints(self, resource_id, scan_run_s, branch_key):
+        self.calls.append(('clear_checkpoints', scan_run_s))
+
+    def get_resource_stats(self, resource_id):
+        return len(self.actual(self.directories)), len(self.actual(self.files)), 0
+
+    def finish_scan_run(self, scan_run_s, result):
+        self.calls.append(('finish_scan_run', scan_run_s))
+
+
+def test_run_scan_resume_is_opt_in(resource):
+    """Без resume контрольная точка не запрашивается: начинается новый запуск"""
+    db = RunDatabase(ScanCheckpoint(5, ['./R/docs']))
+    result = run_scan(db, FilesystemScanner(db), resource)
+
+    assert not result.errors
+    assert db.calls == [('start_scan_run', 'full'), ('finalize_scan', 8), ('finish_scan_run', 8)]
+
+
+def test_run_scan_resume(resource):
+    """resume продолжает запуск контрольной точки не старше resume_max_age"""
+    full_db = ScanDatabase()
+    scan(full_db, resource, checkpoint_interval=1e-9)
+    checkpoint, directories, files = next(
+        saved for saved in full_db.checkpoints if './R/docs' in saved[0].frontier)
+    checkpoint.scan_run_s = 5
+
+    db = RunDatabase(checkpoint)
+    db.directories, db.files = directories, files
+    db.ids = itertools.count(1000)
+    result = run_scan(db, FilesystemScanner(db), resource, resume=True, resume_max_age=timedelta(hours=24))
+
+    assert not result.errors
+    assert db.calls == [('get_checkpoint', timedelta(hours=24)), ('resume_scan_run', 5), ('finalize_scan', 5),
+                        ('finish_scan_run', 5)]
+    assert set(db.files) == ALL_FILES
+
+
+def test_run_scan_incremental_clears_checkpoints(resource):
+    """Завершенное инкрементальное сканирование не продолжает контрольные точки и удаляет их"""
+    db = RunDatabase(ScanCheckpoint(5, ['./R/docs']))
+    scan(db, resource)
+    result = run_scan(db, FilesystemScanner(db, incremental=True), resource, resume=True)
+
+    assert not result.errors
+    assert db.calls == [('start_scan_run', 'incremental'), ('clear_checkpoints', 8), ('finish_scan_run', 8)]
@@ -0,0 +1,110 @@
+# tests/test_scheduler.py
+
+from datetime import datetime
+
+import pytest
+
+from scanner.scheduler import CronSchedule, ScanScheduler
+
+
+@pytest.mark.parametrize('expression, field, expected', [
+    ('* * * * *', 'hours', set(range(24))),
+    ('5 * * * *', 'minutes', {5}),
+    ('9-17 * * * *', 'minutes', set(range(9, 18))),
+    ('*/15 * * * *', 'minutes', {0, 15, 30, 45}),
+    ('0-30/10 * * * *', 'minutes', {0, 10, 20, 30}),
+    ('50/5 * * * *', 'minutes', {50, 55}),
+    ('5,35,40-42 * * * *', 'minutes', {5, 35, 40, 41, 42}),
+    ('0 0 * 1,6-7 *', 'months', {1, 6, 7}),
+    ('0 0 * * 1-5', 'weekdays', {1, 2, 3, 4, 5}),
+    # Воскресенье задается как 0 или 7
+    ('0 0 * * 7', 'weekdays', {0}),
+    ('0 0 * * 5-7', 'weekdays', {0, 5, 6}),
+])
+def test_parse_fields(expression, field, expected):
+    assert getattr(CronSchedule(expression), field) == expected
+
+
+@pytest.mark.parametrize('expression', [
+    '* * * *',
+    '* * * * * *',
+    '60 * * * *',
+    '* 24 * * *',
+    '* * 0 * *',
+    '* * * 13 *',
+    '* * * * 8',
+    '5-1 * * * *',
+    '*/0 * * * *',
+    'a * * * *',
+    '1,,2 * * * *',
+])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+@pytest.mark.parametrize('expression, moment, expected', [
+    # Следующая минута, секунды отбрасываются
+    ('* * * * *', datetime(2026, 10, 17, 10, 7, 30), datetime(2026, 10, 17, 10, 8)),
+    # Момент запуска строго после moment
+    ('*/15 * * * *', datetime(2026, 10, 17, 10, 15), datetime(2026, 10, 17, 10, 30)),
+    ('*/15 * * * *', datetime(2026, 10, 17, 10, 7), datetime(2026, 10, 17, 10, 15)),
+    ('5,35 * * * *', datetime(2026, 10, 17, 10, 36), datetime(2026, 10, 17, 11, 5)),
+    # Диапазон часов: переход на следующий день
+    ('0 9-17 * * *', datetime(2026, 10, 17, 17, 30), datetime(2026, 10, 18, 9, 0)),
+    ('30 2 * * *', datetime(2026, 12, 31, 3, 0), datetime(2027, 1, 1, 2, 30)),
+    # Переход через конец месяца и пропуск месяцев без нужного дня
+    ('0 0 1 * *', datetime(2026, 1, 31, 12, 0), datetime(2026, 2, 1, 0, 0)),
+    ('0 0 31 * *', datetime(2026, 1, 31, 0, 1), datetime(2026, 3, 31, 0, 0)),
+    ('0 0 1 1 *', datetime(2026, 10, 17, 12, 0), datetime(2027, 1, 1, 0, 0)),
+    ('0 12 * 3,6 *', datetime(2026, 4, 2, 0, 0), datetime(2026, 6, 1, 12, 0)),
+    # День недели (2026-10-17 - суббота)
+    ('0 0 * * 1', datetime(2026, 10, 17, 12, 0), datetime(2026, 10, 19, 0, 0)),
+    ('0 0 * * 0', datetime(2026, 10, 17, 12, 0), datetime(2026, 10, 18, 0, 0)),
+    ('0 0 * * 7', datetime(2026, 10, 17, 12, 0), datetime(2026, 10, 18, 0, 0)),
+    # Ограничены день месяца и день недели: достаточно совпадения любого из них
+    ('0 0 20 * 5', datetime(2026, 10, 17, 12, 0), datetime(2026, 10, 20, 0, 0)),
+    ('0 0 25 * 5', datetime(2026, 10, 17, 12, 0), datetime(2026, 10, 23, 0, 0)),
+    # Ограничен только день месяца: день недели не учитывается
+    ('0 0 13 * *', datetime(2026, 10, 17, 12, 0), datetime(2026, 11, 13, 0, 0)),
+    # Несуществующая дата: запуска нет
+    ('0 0 30 2 *', datetime(2026, 10, 17), None),
+])
+def test_next_after(expression, moment, expected):
+    assert CronSchedule(expression).next_after(moment) == expected
+
+
+def test_next_after_leap_day():
+    """29 февраля ищется в пределах года после moment: в 2027 году его нет, в 2028 - есть"""
+    cron = CronSchedule('0 0 29 2 *')
+    assert cron.next_after(datetime(2026, 10, 17)) is None
+    assert cron.next_after(datetime(2027, 10, 17)) == datetime(2028, 2, 29, 0, 0)
+
+
+class ScheduleDatabase:
+    """Подключение планировщика с заданным списком расписаний ресурсов"""
+
+    def __init__(self, resources):
+        self.resources = resources
+
+    def get_scheduled_resources(self):
+        return self.resources
+
+
+def test_due_jobs_scheduled_time():
+    """Время постановки задания - наступивший момент расписания"""
+    now = datetime(2026, 10, 17, 12, 7)
+    db = ScheduleDatabase([
+        (1, '//server1/share', 'Share 1', '0 * * * *', '/mnt/share1', datetime(2026, 10, 17, 11, 0, 5)),
+        (2, '//server1/other', 'Share 2', '0 0 * * *', '/mnt/share2', datetime(2026, 10, 17, 0, 0, 3)),
+        (3, '//server2/share', 'Share 3', '*/5 * * * *', '/mnt/share3', None),
+        (4, '//server2/bad', 'Share 4', '* * *', '/mnt/share4', None),
+    ])
+    jobs = ScanScheduler(db, {}, {}).due_jobs(now)
+
+    assert [(job.resource.information_resource_s, job.host, job.scheduled_time) for job in jobs] == [
+        (1, 'server1', datetime(2026, 10, 17, 12, 0)),
+        (3, 'server2', now),
+    ]
+    assert jobs[0].resource.path == '/mnt'
+    assert jobs[0].resource.name == 'share1'